@@ -5,4 +5,11 @@ do
     echo "Waiting for server volume..."
 done
 
-celery -A lmming worker -l info -P solo
+# WORKER_QUEUES, WORKER_POOL and WORKER_CONCURRENCY select what this worker runs, see docker-compose.yml:
+# the default worker runs NER and all other CPU/database work in one process per core, the io worker runs tasks that
+# wait on the Handle server, Arklet or the database in a thread pool.
+WORKER_QUEUES=${WORKER_QUEUES:-celery,ner,io}
+WORKER_POOL=${WORKER_POOL:-prefork}
+WORKER_CONCURRENCY=${WORKER_CONCURRENCY:-$(nproc)}
+
+celery -A lmming worker -l info -P "$WORKER_POOL" -Q "$WORKER_QUEUES" -c "$WORKER_CONCURRENCY" -n "$WORKER_POOL@%h"
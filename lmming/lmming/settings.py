@@ -157,17 +157,50 @@ REDIS_PORT = env("REDIS_PORT")
 CELERY_BROKER_URL = f"{REDIS_HOST}:{REDIS_PORT}"  # os.environ.get("REDIS", "redis://localhost:6379")
 CELERY_RESULT_BACKEND = f"{REDIS_HOST}:{REDIS_PORT}"  # os.environ.get("REDIS", "redis://localhost:6379")
 
+# Tasks that mostly wait for external services go to the "io" queue, which is served by a thread pool. NER goes to the
+# "ner" queue, served by a prefork pool with one process per core. Everything else stays in the default queue.
+WORKER_IO_QUEUE = "io"
+WORKER_NER_QUEUE = "ner"
+CELERY_TASK_ROUTES = {
+    "metadata.tasks.fac.mintArks": {"queue": WORKER_IO_QUEUE},
+    "metadata.tasks.arab.arabMintHandle": {"queue": WORKER_IO_QUEUE},
+    "metadata.tasks.arab_other.arabOtherMintHandle": {"queue": WORKER_IO_QUEUE},
+    "metadata.tasks.minting.refillHandleNoids": {"queue": WORKER_IO_QUEUE},
+    "metadata.tasks.minting.refillArkNoids": {"queue": WORKER_IO_QUEUE},
+    "metadata.tasks.shared.fileMakerLookup": {"queue": WORKER_IO_QUEUE},
+    "metadata.tasks.fac.translateToSwedish": {"queue": WORKER_IO_QUEUE},
+    "metadata.tasks.arab.translateToSwedish": {"queue": WORKER_IO_QUEUE},
+    "metadata.tasks.shared.namedEntityRecognition": {"queue": WORKER_NER_QUEUE},
+    "metadata.tasks.shared.nerPages": {"queue": WORKER_NER_QUEUE},
+}
+# NER tasks run for minutes: only reserve one task per process, so that waiting tasks can go to idle processes
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# NER tasks are acknowledged late: Redis hands an unacknowledged task to another worker after the visibility timeout
+# (1 hour by default), so it has to be longer than the longest NER run, otherwise that run is done twice
+CELERY_BROKER_TRANSPORT_OPTIONS = {"visibility_timeout": env("CELERY_VISIBILITY_TIMEOUT", int, 12 * 3600)}  # seconds
+
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / Path(env("MEDIA_PATH"))  # BASE_DIR / "media"
 
 NER_BASE_DIR = MEDIA_ROOT / "ner_data"
+NER_CACHE_DIR = NER_BASE_DIR / "cache"
+EXPORT_DIR = MEDIA_ROOT / "exports"
+EXPORT_TIMEOUT = env("EXPORT_TIMEOUT", int, 3600)  # seconds after which an unfinished export is started again
+UPLOAD_DIR = MEDIA_ROOT / "uploads"
+UPLOAD_CHUNK_SIZE = env("UPLOAD_CHUNK_SIZE", int, 8 * 1024 * 1024)  # bytes per request of a chunked upload
 
 if ARCHIVE_INST == "FAC":
     MINTER_URL = env("MINTER_URL", str)
     MINTER_AUTH = env("MINTER_AUTH", str)
     MINTER_ORG_ID = env("MINTER_ORG_ID", str)
+    MINTER_WORKERS = env("MINTER_WORKERS", int, 8)  # concurrent requests while minting page ARKs
+    MINTER_RATE = env("MINTER_RATE", float, 20)  # max. requests per second to Arklet, 0 = no limit
+    MINTER_NOID_POOL_SIZE = env("MINTER_NOID_POOL_SIZE", int, 500)  # reserved ARKs per shoulder, 0 = no pool
 elif ARCHIVE_INST == "ARAB":
     ARAB_RETRIES = env("ARAB_RETRIES", int, 3)
+    ARAB_HANDLE_WORKERS = env("ARAB_HANDLE_WORKERS", int, 8)  # concurrent requests while minting page handles
+    ARAB_HANDLE_RATE = env("ARAB_HANDLE_RATE", float, 20)  # max. requests per second to the handle server, 0 = no limit
+    ARAB_NOID_POOL_SIZE = env("ARAB_NOID_POOL_SIZE", int, 500)  # reserved handle noids, 0 = no pool
     ARAB_HANDLE_ADDRESS = env("ARAB_HANDLE_ADDRESS", str)
     ARAB_HANDLE_PORT = env("ARAB_HANDLE_PORT", int)
     ARAB_HANDLE_ADMIN = env("ARAB_HANDLE_ADMIN", str)
@@ -212,6 +245,20 @@ else:
 HF_CRINA_HASH = env("HF_CRINA_HASH", str, "88870df625e5abfb36c2ecfe2273b6f1a328f43b")
 HF_KB_HASH = env("HF_KB_HASH", str, "8e1e0bdcacc4dc230d2199de47b61ce9cac321c7")
 
+NER_BACKEND = env("NER_BACKEND", str, "torch")  # torch, quantised (int8, CPU) or onnx (ONNX Runtime, CPU)
+NER_BATCHED = env("NER_BATCHED", bool, False)  # run NER over all pages of a report at once instead of page by page
+# split the NER step into subtasks of this many pages, which can run on several workers; 0 runs it as a single task
+NER_PAGES_PER_TASK = env("NER_PAGES_PER_TASK", int, 0)
+NER_PAGE_RETRIES = env("NER_PAGE_RETRIES", int, 2)  # how often pages that failed in a subtask are retried
+NER_BATCH_SIZE = env("NER_BATCH_SIZE", int, 8)
+NER_WINDOW_SIZE = env("NER_WINDOW_SIZE", int, 510)  # in model tokens, excluding [CLS] and [SEP]
+NER_WINDOW_STRIDE = env("NER_WINDOW_STRIDE", int, 64)  # number of tokens shared by consecutive windows
+# address of the NER server ("host:port" or path of a unix socket), empty to load the models in each worker
+NER_SERVER_ADDRESS = env("NER_SERVER_ADDRESS", str, "")
+# NER results are cached by transcription content, settings and model revisions; 0 disables the cache
+NER_CACHE_MAX_SIZE = env("NER_CACHE_MAX_SIZE", int, 512 * 1024 * 1024)  # in bytes
+NER_SERVER_MAX_TEXTS = env("NER_SERVER_MAX_TEXTS", int, 32)  # texts from concurrent requests run as one batch
+
 SERVER_LOG_NAME = "lmming"
 WORKER_LOG_NAME = "lmming_celery"
 
@@ -0,0 +1,119 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import perf_counter
+from typing import List, Tuple, Callable, Optional, Iterable
+
+from metadata.models import ExtractionTransfer, Page
+from metadata.transcription import transcriptionFormat
+from metadata.xml_utils import ALTO_TEMPLATE, conversionKey, convertedAltoPath, convertJob, removeOutdatedAlto
+
+Progress = Callable[[int, int], None]
+
+
+@dataclass
+class ConversionResult:
+    converted: int = 0
+    skipped: int = 0
+    failed: List[Tuple[str, str]] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def filesPerSecond(self) -> float:
+        return self.converted / self.seconds if self.seconds else 0.0
+
+
+def __run(jobs: List[Tuple[str, str, str]], result: ConversionResult, workers: int = None,
+          progress: Optional[Progress] = None) -> List[str]:
+    """
+    Converts ``(source, target, filename)`` jobs with a pool of ``workers`` processes (default: one per CPU) and returns
+    the sources that were converted successfully.
+    """
+    done = []
+    start = perf_counter()
+    if jobs:
+        workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunkSize = max(1, min(32, len(jobs) // (workers * 4)))
+            for i, (source, error) in enumerate(pool.map(convertJob, jobs, chunksize=chunkSize), 1):
+                if error:
+                    result.failed.append((source, error))
+                else:
+                    done.append(source)
+                    result.converted += 1
+                if progress:
+                    progress(i, len(jobs))
+    result.seconds = perf_counter() - start
+    return done
+
+
+def __isUpToDate(source: Path, target: Path) -> bool:
+    if not target.exists():
+        return False
+    return target.stat().st_mtime >= max(source.stat().st_mtime, ALTO_TEMPLATE.stat().st_mtime)
+
+
+def convertTree(sourceDir: Path, targetDir: Path, workers: int = None, force: bool = False,
+                progress: Optional[Progress] = None) -> ConversionResult:
+    """
+    Converts every PAGE file below ``sourceDir`` to ALTO, keeping the directory layout in ``targetDir``. Files whose ALTO
+    version is newer than both the source and the template are skipped unless ``force`` is set, other XML files are
+    ignored.
+    """
+    result = ConversionResult()
+    jobs = []
+    for source in sorted(sourceDir.rglob("*.xml")):
+        try:
+            if transcriptionFormat(source) != Page.TranscriptionFormat.PAGE:
+                continue
+        except Exception as e:
+            result.failed.append((str(source), f"{type(e).__name__}: {e}"))
+            continue
+        target = targetDir / source.relative_to(sourceDir)
+        if not force and __isUpToDate(source, target):
+            result.skipped += 1
+            continue
+        jobs.append((str(source), str(target), source.name))
+
+    __run(jobs, result, workers, progress)
+    return result
+
+
+def convertTransfers(transfers: Iterable[ExtractionTransfer], workers: int = None, force: bool = False,
+                     progress: Optional[Progress] = None) -> ConversionResult:
+    """
+    Fills the cache used by the exports (see ``utils.altoTranscription``) for all PAGE transcriptions of the given
+    transfers. Pages whose format is not known yet are inspected and updated first.
+    """
+    result = ConversionResult()
+    pages = Page.objects.filter(report__transfer__in=transfers).exclude(transcriptionFile="") \
+        .only("pk", "transcriptionFile", "transcriptionFormat", "originalFileName")
+
+    unknown = []
+    jobs = []
+    for page in pages.iterator():
+        source = Path(page.transcriptionFile.path)
+        if not page.transcriptionFormat:
+            try:
+                page.transcriptionFormat = transcriptionFormat(source)
+            except Exception as e:
+                result.failed.append((str(source), f"{type(e).__name__}: {e}"))
+                continue
+            unknown.append(page)
+        if page.transcriptionFormat != Page.TranscriptionFormat.PAGE:
+            continue
+
+        target = convertedAltoPath(source, conversionKey(source))
+        if not force and target.exists():
+            result.skipped += 1
+            continue
+        jobs.append((str(source), str(target), page.originalFileName))
+
+    # bulk_update leaves lastUpdated alone, so cached exports stay valid
+    Page.objects.bulk_update(unknown, ["transcriptionFormat"], batch_size=500)
+
+    targets = {source: Path(target) for source, target, _ in jobs}
+    for source in __run(jobs, result, workers, progress):
+        removeOutdatedAlto(Path(source), targets[source])
+    return result
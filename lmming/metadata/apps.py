@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import pre_delete
 
 
 class MetadataConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'metadata'
+
+    def ready(self):
+        from metadata.models import Page
+        from metadata.signals import pageFileDeleteHandler
+
+        pre_delete.connect(pageFileDeleteHandler, sender=Page, weak=False, dispatch_uid="pageFileDeleteHandler")
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import List, Optional
+
+from django.conf import settings
+
+from metadata.models import ExtractionTransfer, Report, Page, Job, ReportTranslation, FacSpecificData
+from metadata.utils import buildTransferCsvs, buildFolderStructure, buildBulkTransferCsvs
+
+# part of every fingerprint: increase it whenever the content or layout of the exports changes, so that artefacts built
+# by an older version are not served anymore
+EXPORT_FORMAT_VERSION = 1
+
+
+@dataclass
+class ExportRequest:
+    """
+    Everything an export depends on besides the data of the transfers. ``filetype`` is one of "csv", "csv_restricted",
+    "zip", "zip_restricted" (one transfer) or "bulk_csv" (any number of transfers).
+    """
+    filetype: str
+    transferIds: List[int] = field(default_factory=list)
+    forArab: bool = False
+    arabOther: bool = False
+
+    def __post_init__(self):
+        self.transferIds = sorted(int(i) for i in self.transferIds)
+
+    @property
+    def key(self) -> str:
+        # identifies the export independent of the data, so that older versions can be cleaned up
+        ids = hashlib.sha256(",".join(map(str, self.transferIds)).encode()).hexdigest()[:12]
+        return f"{self.filetype}{'_arab' if self.arabOther else ''}_{ids}"
+
+
+def fingerprint(export: ExportRequest) -> str:
+    """
+    Content fingerprint of an export: changes whenever a report, page, job, translation or FAC-specific data of the
+    exported transfers is changed, added or removed, or the export flags, the settings written into the export or
+    ``EXPORT_FORMAT_VERSION`` differ. Translations and FAC-specific data have no modification date and are hashed
+    completely.
+    """
+    digest = hashlib.sha256(json.dumps([asdict(export), EXPORT_FORMAT_VERSION, settings.IIIF_BASE_URL,
+                                        settings.ARCHIVE_INST]).encode())
+    for rows in [ExtractionTransfer.objects.filter(pk__in=export.transferIds).values_list("pk", "name"),
+                 Report.objects.filter(transfer__in=export.transferIds).values_list("pk", "lastUpdated"),
+                 Page.objects.filter(report__transfer__in=export.transferIds).values_list("pk", "lastUpdated"),
+                 Job.objects.filter(transfer__in=export.transferIds).values_list("pk", "lastUpdated"),
+                 ReportTranslation.objects.filter(report__transfer__in=export.transferIds).values_list(),
+                 FacSpecificData.objects.filter(report__transfer__in=export.transferIds).values_list()]:
+        for row in rows.order_by("pk").iterator():
+            digest.update(repr(row).encode())
+    return digest.hexdigest()
+
+
+def artefactPath(export: ExportRequest, exportFingerprint: str) -> Path:
+    return Path(settings.EXPORT_DIR) / f"{export.key}_{exportFingerprint}.zip"
+
+
+def __partPath(artefact: Path) -> Path:
+    return artefact.with_suffix(".part")
+
+
+def __errorPath(artefact: Path) -> Path:
+    return artefact.with_suffix(".error")
+
+
+def claim(artefact: Path) -> bool:
+    """
+    Marks the artefact as being built. Returns False if another request already did so, unless that build has been
+    running for longer than ``EXPORT_TIMEOUT`` seconds and is assumed to be dead.
+    """
+    part = __partPath(artefact)
+    part.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        part.open("xb").close()
+        return True
+    except FileExistsError:
+        if time.time() - part.stat().st_mtime > settings.EXPORT_TIMEOUT:
+            part.touch()
+            return True
+        return False
+
+
+def popError(artefact: Path) -> Optional[str]:
+    """
+    Returns (and forgets) the error of a failed build, so that the next request starts a new one.
+    """
+    error = __errorPath(artefact)
+    if not error.exists():
+        return None
+    message = error.read_text()
+    error.unlink(missing_ok=True)
+    return message
+
+
+def writeExport(export: ExportRequest, artefact: Path):
+    """
+    Builds the export into the artefact's ``.part`` file and moves it into place once complete. Older versions of the
+    same export are removed afterwards.
+    """
+    part = __partPath(artefact)
+    try:
+        transfers = ExtractionTransfer.objects.filter(pk__in=export.transferIds)
+        with part.open("wb") as outFile:
+            if export.filetype == "bulk_csv":
+                outFile.write(buildBulkTransferCsvs(transfers, checkRestriction=True,
+                                                    forArab=export.forArab).getbuffer())
+            elif export.filetype in ["csv", "csv_restricted"]:
+                outFile.write(buildTransferCsvs(transfers.get(), checkRestriction=export.filetype == "csv_restricted",
+                                                forArab=export.forArab).getbuffer())
+            elif export.filetype in ["zip", "zip_restricted"]:
+                for chunk in buildFolderStructure(transfers.get(), checkRestriction=export.filetype == "zip_restricted",
+                                                  forArab=export.forArab, arabOther=export.arabOther):
+                    outFile.write(chunk)
+            else:
+                raise ValueError(f"unknown export type '{export.filetype}'")
+        part.replace(artefact)
+    except Exception as e:
+        __errorPath(artefact).write_text(f"{type(e).__name__}: {e}")
+        part.unlink(missing_ok=True)
+        raise
+
+    for outdated in artefact.parent.glob(f"{export.key}_*.zip"):
+        if outdated != artefact:
+            outdated.unlink(missing_ok=True)
@@ -1,3 +1,6 @@
+import zipfile
+
+from django.core.exceptions import ValidationError
 from django.forms import ClearableFileInput, FileField, Form, CharField, TextInput, ChoiceField, Select, BooleanField, \
     CheckboxInput, Textarea, IntegerField, URLField, FileInput
 from torch.optim.optimizer import required
@@ -31,6 +34,11 @@ class ExtractionTransferDetailForm(Form):
     file_field = MultipleFileField(label="Select transcription files (*.xml):")
 
 
+class TransferUploadForm(ExtractionTransferDetailForm):
+    # the files are sent separately, in chunks
+    file_field = None
+
+
 class TransferImportForm(Form):
     processName = CharField(max_length=100, label="Extraction Process Name:", required=True,
                             widget=TextInput(attrs={'class': 'form-control', 'placeholder': 'Name'}))
@@ -60,8 +68,18 @@ class ProcessingStepForm(Form):
 
 
 class ZipForm(Form):
-    zipFile = FileField(label="Select a compressed file, containing one or more collections (*.zip):",
-                        widget=ClearableFileInput(attrs={"accept": ".zip", "class": "form-control"}))
+    zipFile = MultipleFileField(label="Select a compressed file, containing one or more collections (*.zip):",
+                                widget=MultipleFileInput(attrs={"accept": ".zip", "class": "form-control"}))
+
+    def clean_zipFile(self):
+        archives = self.cleaned_data["zipFile"]
+        if not isinstance(archives, list):
+            archives = [archives]
+        for archive in archives:
+            if not zipfile.is_zipfile(archive):
+                raise ValidationError(f"{archive} is not a ZIP archive.")
+            archive.seek(0)
+        return archives
 
 
 class FilemakerForm(Form):
@@ -0,0 +1,293 @@
+import zipfile
+from datetime import datetime
+from pathlib import PurePosixPath
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+
+import pandas as pd
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from metadata.models import ExtractionTransfer, Report, Page, Job, ProcessingStep, Status, Pipeline, \
+    ReportTranslation, updateStatuses
+from metadata.utils import parseFilename, buildReportIdentifier, parseUnionId, noidFromIdentifier
+
+BATCH_SIZE = 500
+TRANSCRIPTION_SUFFIXES = {".xml", ".txt"}
+
+
+def groupTranscriptionFiles(files: Iterable) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Parses the names of the uploaded transcription files and groups them by the report they belong to. Files whose
+    names do not follow the expected pattern are skipped.
+    """
+    pagesToReports = {}
+    for file in files:
+        try:
+            data = parseFilename(str(file))
+        except SyntaxError as _e:
+            # TODO
+            continue
+        data["file"] = file
+        data["originalFileName"] = str(file)
+        pagesToReports.setdefault(buildReportIdentifier(data), []).append(data)
+    return pagesToReports
+
+
+def __report(transfer: ExtractionTransfer, pages: List[Dict[str, Any]]) -> Report:
+    unionId = set(p["union_id"] for p in pages).pop()  # TODO: can there be multiple?
+    reportType = list(set(p["type"] for p in pages))
+    typeName = set(p["typeName"] for p in pages).pop()
+
+    dates = set()
+    for p in pages:
+        dates.update(p["date"])
+    dateList = sorted(list(dates))
+
+    if transfer.pipeline == Pipeline.ARAB_OTHER:
+        return Report(transfer=transfer, unionId=unionId, type=reportType, date=dateList, type_other=typeName,
+                      publisher="SE/ARAB")
+    elif transfer.pipeline == Pipeline.FAC:
+        return Report(transfer=transfer, unionId=unionId, type=reportType, date=dateList)
+    return Report(transfer=transfer, unionId=unionId, date=dateList)
+
+
+def __createJobs(transfer: ExtractionTransfer, reports: List[Report], stepConfig: List[Dict[str, Any]]):
+    jobs = Job.objects.bulk_create([Job(transfer=transfer, report=report) for report in reports], batch_size=BATCH_SIZE)
+    ProcessingStep.objects.bulk_create([
+        ProcessingStep(job=job, order=entry["stepType"].order, processingStepType=entry["stepType"].value,
+                       humanValidation=entry["humanValidation"], mode=entry["mode"],
+                       status=entry["status"] if "status" in entry else Status.PENDING)
+        for job in jobs for entry in stepConfig], batch_size=BATCH_SIZE)
+
+    # also updates the transfer, unless it has no jobs
+    updateStatuses([job.pk for job in jobs])
+
+
+def buildTransfer(name: str, handler: str, pipeline: str, pagesToReports: Dict[str, List[Dict[str, Any]]],
+                  stepConfig: List[Dict[str, Any]]) -> ExtractionTransfer:
+    """
+    Creates a transfer with one report, job and set of processing steps (as described by ``stepConfig``, see
+    ``utils.buildProcessingSteps``) per group of pages (see ``groupTranscriptionFiles``). All rows are inserted with a
+    few bulk statements in one transaction, so no status signals fire; the statuses of the new jobs and the transfer are
+    computed once at the end instead.
+    """
+    if not stepConfig:
+        raise TypeError("no config was supplied")
+
+    with transaction.atomic():
+        transfer = ExtractionTransfer.objects.create(name=name, status=Status.AWAITING_HUMAN_VALIDATION,
+                                                     pipeline=pipeline, handler=handler)
+        reports = Report.objects.bulk_create([__report(transfer, pages) for pages in pagesToReports.values()],
+                                             batch_size=BATCH_SIZE)
+        Page.objects.bulk_create([Page(report=report, order=int(page["page"]), transcriptionFile=page["file"],
+                                       originalFileName=page["originalFileName"])
+                                  for report, pages in zip(reports, pagesToReports.values()) for page in pages],
+                                 batch_size=BATCH_SIZE)
+        __createJobs(transfer, reports, stepConfig)
+    transfer.refresh_from_db()
+    return transfer
+
+
+def ingestTransfer(name: str, handler: str, pipeline: str, files: Iterable,
+                   stepConfig: List[Dict[str, Any]]) -> ExtractionTransfer:
+    """
+    Creates a transfer from uploaded transcription files, see ``buildTransfer``.
+    """
+    return buildTransfer(name, handler, pipeline, groupTranscriptionFiles(files), stepConfig)
+
+
+def __transcriptionMembers(archive: zipfile.ZipFile) -> Iterable[zipfile.ZipInfo]:
+    for info in archive.infolist():
+        path = PurePosixPath(info.filename)
+        if info.is_dir() or path.suffix.lower() not in TRANSCRIPTION_SUFFIXES or path.name.startswith(".") \
+                or "__MACOSX" in path.parts:
+            continue
+        yield info
+
+
+def storeZipMembers(archives: Iterable) -> Tuple[Dict[str, List[Dict[str, Any]]], List[str]]:
+    """
+    Copies the transcription files in the given ZIP archives to the media storage one at a time, streaming every member
+    out of the archive instead of extracting it into memory, and groups them like ``groupTranscriptionFiles``. Folders
+    inside the archives are ignored, members whose names do not follow the expected pattern are skipped. If anything
+    fails, the files stored so far are removed again.
+
+    :return: the grouped pages and the names of the skipped members
+    """
+    pagesToReports = {}
+    skipped = []
+    stored = []
+    try:
+        for archiveFile in archives:
+            with zipfile.ZipFile(archiveFile) as archive:
+                for info in __transcriptionMembers(archive):
+                    name = PurePosixPath(info.filename).name
+                    try:
+                        data = parseFilename(name)
+                    except SyntaxError:
+                        skipped.append(info.filename)
+                        continue
+                    with archive.open(info) as member:
+                        data["file"] = default_storage.save(name, File(member, name=name))
+                    stored.append(data["file"])
+                    data["originalFileName"] = name
+                    pagesToReports.setdefault(buildReportIdentifier(data), []).append(data)
+    except Exception:
+        for name in stored:
+            default_storage.delete(name)
+        raise
+    return pagesToReports, skipped
+
+
+def ingestZipTransfer(name: str, handler: str, pipeline: str, archives: Iterable,
+                      stepConfig: List[Dict[str, Any]]) -> Tuple[ExtractionTransfer, List[str]]:
+    """
+    Creates a transfer from the transcription files in one or more ZIP archives, see ``storeZipMembers`` and
+    ``buildTransfer``.
+
+    :return: the transfer and the names of the archive members that were skipped because of their names
+    """
+    pagesToReports, skipped = storeZipMembers(archives)
+    try:
+        return buildTransfer(name, handler, pipeline, pagesToReports, stepConfig), skipped
+    except Exception:
+        for pages in pagesToReports.values():
+            for page in pages:
+                default_storage.delete(page["file"])
+        raise
+
+
+def indexRows(rows: List[Dict[str, str]]) -> Dict[str, Dict[str, str]]:
+    """
+    Indexes the rows of an Omeka CSV by the noids their ``dcterms:identifier`` URLs point to (see
+    ``utils.noidFromIdentifier``), a column that may hold several URLs separated by spaces. If a noid occurs more than
+    once, the first row wins.
+    """
+    index = {}
+    for row in rows:
+        for identifier in row["dcterms:identifier"].split():
+            index.setdefault(noidFromIdentifier(identifier), row)
+    return index
+
+
+def __findRow(index: Dict[str, Dict[str, str]], rows: List[Dict[str, str]], noid: str) -> Optional[Dict[str, str]]:
+    row = index.get(noid)
+    if row is None:
+        # identifiers that do not end with the noid are still found, as they were by the former substring search
+        row = next((r for r in rows if noid in r["dcterms:identifier"]), None)
+    return row
+
+
+def __splitAndStrip(text: str) -> List[str]:
+    return [x.strip() for x in text.split("|")]
+
+
+def __translationColumns(columns: Iterable[str]) -> Dict[str, Dict[str, str]]:
+    # e.g. "dcterms:coverage.en" -> {"en": {"coverage": "dcterms:coverage.en"}}
+    translationColumns = {}
+    for column in columns:
+        if "." in column:
+            s = column.split(".")
+            translationColumns.setdefault(s[-1], {})[s[0].split(":")[-1]] = column
+    return translationColumns
+
+
+def __importedDates(dateString: str) -> List[datetime]:
+    if "/" in dateString:
+        return [datetime(int(x), 1, 1) for x in dateString.split("/")]
+    dates = []
+    for d in dateString.split("|"):
+        if "--" in d:
+            dateRange = d.split("--")
+            for year in range(int(dateRange[0].strip()), int(dateRange[1].strip()) + 1):
+                dates.append(datetime(year, 1, 1))
+        else:
+            dates.append(datetime(int(d.strip()), 1, 1))
+    return dates
+
+
+def __importedReport(transfer: ExtractionTransfer, noid: str, reportStructure: Dict[str, Any],
+                     row: Dict[str, str]) -> Report:
+    coverage = [x for x in Report.UnionLevel if x.label == row["dcterms:coverage"]][0]
+    docType = [x for x in Report.DocumentType if x.label in row["dcterms:type"]]
+    isFormatOf = [x for x in Report.DocumentFormat if x.label in row["dcterms:isFormatOf"]]
+    accessRights = [x for x in Report.AccessRights if x.label == row["dcterms:accessRights"]][0]
+
+    return Report(transfer=transfer, unionId=parseUnionId(reportStructure["pages"][0]["filename"]), noid=noid,
+                  date=__importedDates(row["dcterms:date"]), description=row["dcterms:description"],
+                  created=datetime(int(row["dcterms:created"]), 1, 1), title=row["dcterms:title"].strip(),
+                  available=datetime.strptime(row["dcterms:available"], '%Y-%m-%d'),
+                  creator=row["dcterms:creator"].strip(), language=__splitAndStrip(row["dcterms:language"]),
+                  spatial=__splitAndStrip(row["dcterms:spatial"]), license=__splitAndStrip(row["dcterms:license"]),
+                  isVersionOf=row["dcterms:isVersionOf"].strip(), accessRights=accessRights,
+                  identifier=row["dcterms:identifier"].strip(), isFormatOf=isFormatOf,
+                  source=__splitAndStrip(row["dcterms:source"]), type=docType,
+                  relation=__splitAndStrip(row["dcterms:relation"]), coverage=coverage)
+
+
+def __importedPage(report: Report, pageData: Dict[str, str], row: Dict[str, str], file) -> Page:
+    return Page(report=report, order=int(pageData["order"]), transcriptionFile=file,
+                originalFileName=pageData["filename"], identifier=row["dcterms:identifier"].strip(),
+                transcription=row["lm:transcription"].strip(), normalisedTranscription=row["lm:normalised"].strip(),
+                persons=__splitAndStrip(row["lm:person"]), organisations=__splitAndStrip(row["lm:organisation"]),
+                locations=__splitAndStrip(row["lm:location"]), times=__splitAndStrip(row["lm:time"]),
+                works=__splitAndStrip(row["lm:work"]), events=__splitAndStrip(row["lm:event"]),
+                ner_objects=__splitAndStrip(row["lm:object"]), measures=row["lm:measure"].lower() == "true",
+                iiifId=pageData["id"], source=row.get("dcterms:source", ""),
+                bibCitation=row.get("dcterms:bibliographicCitation", ""))
+
+
+def importOmekaTransfer(name: str, handler: str, pipeline: str, structure: Dict[str, Dict[str, Any]],
+                        items: pd.DataFrame, media: pd.DataFrame, files: Dict[str, Any],
+                        stepConfig: List[Dict[str, Any]]) -> Tuple[ExtractionTransfer, List[str]]:
+    """
+    Recreates a transfer from an Omeka export: the structure map (see ``utils.getStructureFromStructMap``), the
+    items.csv and media.csv data and the transcription files by name. Both CSVs are indexed by noid once (see
+    ``indexRows``), so every report and page is a dictionary lookup, and all rows are bulk inserted like in
+    ``buildTransfer``. Reports and pages without an entry, or pages without a transcription file, are skipped.
+
+    :return: the transfer and a message for everything that was skipped
+    """
+    if not stepConfig:
+        raise TypeError("no config was supplied")
+
+    itemRows, mediaRows = items.to_dict("records"), media.to_dict("records")
+    itemIndex, mediaIndex = indexRows(itemRows), indexRows(mediaRows)
+    translationColumns = __translationColumns(items.columns)
+    errors = []
+
+    with transaction.atomic():
+        transfer = ExtractionTransfer.objects.create(name=name, status=Status.COMPLETE, handler=handler,
+                                                     pipeline=pipeline)
+        imported = []
+        for reportId, reportStructure in structure.items():
+            row = __findRow(itemIndex, itemRows, reportId)
+            if row is None:
+                errors.append(f"No entry for report ID {reportId} in items.csv")
+                continue
+            imported.append((__importedReport(transfer, reportId, reportStructure, row), row, reportStructure))
+        reports = Report.objects.bulk_create([report for report, _, _ in imported], batch_size=BATCH_SIZE)
+
+        translations, pages = [], []
+        for report, row, reportStructure in imported:
+            for language, columns in translationColumns.items():
+                translations.append(ReportTranslation(
+                    report=report, language=language, coverage=row[columns["coverage"]].strip(),
+                    isFormatOf=__splitAndStrip(row[columns["isFormatOf"]]), type=__splitAndStrip(row[columns["type"]]),
+                    accessRights=row[columns["accessRights"]].strip(), description=row[columns["description"]].strip()))
+            for pageData in reportStructure["pages"]:
+                pageRow = __findRow(mediaIndex, mediaRows, pageData["id"])
+                if pageRow is None:
+                    errors.append(f"No entry for page ID {pageData['id']} in media.csv")
+                    continue
+                if pageData["filename"] not in files:
+                    errors.append(f"No transcription file {pageData['filename']} for page ID {pageData['id']}")
+                    continue
+                pages.append(__importedPage(report, pageData, pageRow, files[pageData["filename"]]))
+        ReportTranslation.objects.bulk_create(translations, batch_size=BATCH_SIZE)
+        Page.objects.bulk_create(pages, batch_size=BATCH_SIZE)
+
+        __createJobs(transfer, reports, stepConfig)
+    transfer.refresh_from_db()
+    return transfer, errors
@@ -0,0 +1,78 @@
+from datetime import date
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from metadata.models import ExtractionTransfer, Report, Page, Pipeline
+from metadata.tasks.minting import mintPageArks
+from metadata.tasks.utils import ArkletAdapter
+from metadata.stand_ins import ArkletServer
+
+IIIF_BASE = "https://iiif.example.org/"
+SHOULDER = "/p"
+
+
+def describe(page, ark):
+    arkLink = f"https://ark.example.org/{ark}"
+    page.identifier = arkLink + "/info.json"
+    page.source = arkLink + "/full/full/0/default.jpg"
+
+
+def __sequential(adapter, pages, options):
+    # what mintArks did before: mint, point to the image and save one page at a time
+    for page in pages:
+        ark = adapter.createArkWithDependentUrl(SHOULDER, IIIF_BASE + "iiif/image/{}", {"title": "benchmark"})
+        page.noid = ark.split("/")[-1]
+        describe(page, ark)
+        page.save()
+
+
+def __concurrent(adapter, pages, options):
+    errors = mintPageArks(adapter, pages, SHOULDER, IIIF_BASE, "benchmark", describe, options["workers"],
+                          options["rate"])
+    if errors:
+        raise errors[0]
+
+
+def __interrupted(adapter, pages, options):
+    # a first run that failed on the last tenth of the pages
+    __concurrent(adapter, pages[:len(pages) * 9 // 10], options)
+    for page in pages:
+        page.refresh_from_db()
+
+
+# (name, preparation outside of the measurement, measured function)
+METHODS = [("sequential", None, __sequential), ("concurrent", None, __concurrent),
+           ("restart", __interrupted, __concurrent)]
+
+
+class Command(BaseCommand):
+    help = ("Measures how many page ARKs per second are minted against a local stand-in Arklet with the given latency, "
+            "one page at a time, with the concurrent minting engine, and restarting the concurrent minting engine after "
+            "it failed on the last tenth of the pages. Nothing is kept in the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=300)
+        parser.add_argument("--latency", type=float, default=0.02, help="seconds per request")
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--rate", type=float, default=0, help="max. requests per second, 0 = no limit")
+
+    def handle(self, *args, **options):
+        with ArkletServer(latency=options["latency"]) as server:
+            for name, prepare, function in METHODS:
+                adapter = ArkletAdapter(server.address, "12345", server.token, poolSize=options["workers"])
+                with transaction.atomic():
+                    transfer = ExtractionTransfer.objects.create(name="minting benchmark", pipeline=Pipeline.FAC)
+                    report = Report.objects.create(transfer=transfer, unionId="1", date=[date(1991, 1, 1)])
+                    pages = Page.objects.bulk_create([Page(report=report, order=i + 1)
+                                                      for i in range(options["pages"])])
+                    if prepare:
+                        prepare(adapter, pages, options)
+                    requestCount = len(server.requests)
+                    start = perf_counter()
+                    function(adapter, pages, options)
+                    elapsed = perf_counter() - start
+                    transaction.set_rollback(True)
+                self.stdout.write(f"{name:>10}: {len(server.requests) - requestCount:5d} requests, {elapsed:.2f}s, "
+                                  f"{len(pages) / elapsed:.1f} pages/s")
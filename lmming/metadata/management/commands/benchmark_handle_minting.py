@@ -0,0 +1,87 @@
+import tempfile
+from datetime import date
+from pathlib import Path
+from time import perf_counter
+
+from Crypto.PublicKey import RSA
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from metadata.models import ExtractionTransfer, Report, Page, Pipeline
+from metadata.tasks.minting import mintPageHandles, pageLocations, reserveHandleNoids
+from metadata.tasks.utils import HandleAdapter, Singleton, generateNoid
+from metadata.stand_ins import HandleServer
+
+IIIF_BASE = "https://iiif.example.org/"
+
+
+def describe(page, handle):
+    page.source = f"https://hdl.handle.net/{handle}?locatt=view:jpgfull"
+
+
+def __sequential(adapter, pages, options):
+    # what the minting tasks did before: one existence check, registration and save per page
+    for page in pages:
+        noid = generateNoid()
+        if adapter.doesHandleAlreadyExist(noid):
+            continue
+        handle = adapter.updateLocationBasedHandle(noid, pageLocations(IIIF_BASE, noid))
+        page.noid = noid
+        page.iiifId = noid
+        page.identifier = f"https://hdl.handle.net/{handle}?locatt=view:manifest"
+        describe(page, handle)
+        page.save()
+
+
+def __concurrent(adapter, pages, options):
+    errors = mintPageHandles(adapter, pages, IIIF_BASE, describe, 3, options["workers"], options["rate"])
+    if errors:
+        raise errors[0]
+
+
+def __reserve(adapter, pages, options):
+    errors = reserveHandleNoids(adapter, len(pages), 3, options["workers"], options["rate"])
+    if errors:
+        raise errors[0]
+
+
+# (name, preparation outside of the measurement, measured function)
+METHODS = [("sequential", None, __sequential), ("concurrent", None, __concurrent),
+           ("reserved", __reserve, __concurrent)]
+
+
+class Command(BaseCommand):
+    help = ("Measures how many page handles per second are minted against a local stand-in handle server with the given "
+            "latency: one page at a time, with the concurrent minting engine, and with the concurrent minting engine taking "
+            "its noids from a filled reservation pool. Nothing is kept in the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=300)
+        parser.add_argument("--latency", type=float, default=0.02, help="seconds per request")
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--rate", type=float, default=0, help="max. requests per second, 0 = no limit")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as keyDir, HandleServer(latency=options["latency"]) as server:
+            keyFile = str(Path(keyDir) / "key.pem")
+            Path(keyFile).write_bytes(RSA.generate(2048).export_key())
+            host, port = server.address.rsplit(":", 1)
+
+            for name, prepare, function in METHODS:
+                Singleton._instances.pop(HandleAdapter, None)
+                adapter = HandleAdapter(host, int(port), "12345", "0.NA/12345", keyFile, Path("unused"))
+                with transaction.atomic():
+                    transfer = ExtractionTransfer.objects.create(name="minting benchmark", pipeline=Pipeline.ARAB_OTHER)
+                    report = Report.objects.create(transfer=transfer, unionId="1", date=[date(1991, 1, 1)])
+                    pages = Page.objects.bulk_create([Page(report=report, order=i + 1)
+                                                      for i in range(options["pages"])])
+                    if prepare:
+                        prepare(adapter, pages, options)
+                    requestCount = len(server.requests)
+                    start = perf_counter()
+                    function(adapter, pages, options)
+                    elapsed = perf_counter() - start
+                    transaction.set_rollback(True)
+                self.stdout.write(f"{name:>10}: {len(server.requests) - requestCount:5d} requests, {elapsed:.2f}s, "
+                                  f"{len(pages) / elapsed:.1f} pages/s")
+            Singleton._instances.pop(HandleAdapter, None)
@@ -0,0 +1,48 @@
+from pathlib import Path
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from metadata.nlp.ner import NER_HELPER, processPage, processPages
+
+
+class Command(BaseCommand):
+    help = "Compares NER throughput (pages per second) of page-wise and batched processing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", type=Path, help="transcription files or directories containing them")
+        parser.add_argument("--limit", type=int, default=50, help="maximum number of pages to process")
+        parser.add_argument("--batch-size", type=int, default=settings.NER_BATCH_SIZE)
+        parser.add_argument("--no-normalise", action="store_true")
+
+    def handle(self, *args, **options):
+        pages = []
+        for path in options["paths"]:
+            if path.is_dir():
+                pages.extend(sorted(p for p in path.rglob("*") if p.suffix in [".xml", ".txt"]))
+            elif path.exists():
+                pages.append(path)
+        pages = pages[:options["limit"]]
+        if not pages:
+            raise CommandError("No transcription files found.")
+
+        normalise = not options["no_normalise"]
+
+        # load both models before timing anything
+        NER_HELPER.NER_RA("")
+        NER_HELPER.NER_KB("")
+
+        start = perf_counter()
+        for page in pages:
+            processPage(page, normalise)
+        pageWiseTime = perf_counter() - start
+
+        start = perf_counter()
+        processPages(pages, normalise, batchSize=options["batch_size"])
+        batchedTime = perf_counter() - start
+
+        self.stdout.write(f"{len(pages)} pages, batch size {options['batch_size']}, "
+                          f"window size {settings.NER_WINDOW_SIZE} (stride {settings.NER_WINDOW_STRIDE})")
+        for name, elapsed in [("page-wise", pageWiseTime), ("batched", batchedTime)]:
+            self.stdout.write(f"{name:>10}: {len(pages) / elapsed:8.2f} pages/s")
@@ -0,0 +1,56 @@
+import random
+from time import perf_counter
+from typing import List
+
+from django.core.management.base import BaseCommand
+
+from metadata.nlp.aux import loadSynonyms, get_key
+from metadata.nlp.ner import NER_HELPER, normalizeTokens, normalizeWord, applyNormalisationRules
+
+
+def legacyNormalizeTokens(tokens: List[str], dalin, dalinValuesFlat) -> str:
+    # token lookup as done before the reverse index: list membership test + linear scan for the key
+    edited = ""
+    for word in tokens:
+        if word in NER_HELPER.ABBREVIATIONS:
+            word = NER_HELPER.ABBREVIATIONS[word][0]
+        if word in dalinValuesFlat:
+            edited += get_key(word, dalin) + " "
+        else:
+            edited += applyNormalisationRules(word) + " "
+    return edited
+
+
+class Command(BaseCommand):
+    help = "Compares per-page spelling normalisation throughput of the list-based lookup and the reverse index."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=20)
+        parser.add_argument("--words", type=int, default=300, help="tokens per page")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        dalin, dalinValuesFlat = loadSynonyms()
+
+        rng = random.Random(options["seed"])
+        # pages are built from the bundled synonyms.txt: roughly half historical variants, half modern forms that
+        # fall through to the rule engine
+        vocabulary = rng.sample(dalinValuesFlat, 2000) + rng.sample(list(dalin.keys()), 2000)
+        pages = [[rng.choice(vocabulary) for _ in range(options["words"])] for _ in range(options["pages"])]
+
+        start = perf_counter()
+        legacy = [legacyNormalizeTokens(page, dalin, dalinValuesFlat) for page in pages]
+        legacyTime = perf_counter() - start
+
+        normalizeWord.cache_clear()
+        start = perf_counter()
+        indexed = [normalizeTokens(page) for page in pages]
+        indexedTime = perf_counter() - start
+
+        if legacy != indexed:
+            self.stderr.write("Normalised output differs between the two implementations!")
+
+        for name, elapsed in [("list scan", legacyTime), ("reverse index", indexedTime)]:
+            self.stdout.write(f"{name:>14}: {len(pages) / elapsed:10.1f} pages/s "
+                              f"({elapsed / len(pages) * 1000:.2f} ms/page)")
+        self.stdout.write(f"speed-up: {legacyTime / indexedTime:.1f}x")
@@ -0,0 +1,52 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from metadata.models import ExtractionTransfer, Report, Job, ProcessingStep, Status, deferredStatusUpdates
+
+STEP_TYPES = [ProcessingStep.ProcessingStepType.FILENAME, ProcessingStep.ProcessingStepType.FILEMAKER_LOOKUP,
+              ProcessingStep.ProcessingStepType.GENERATE, ProcessingStep.ProcessingStepType.NER,
+              ProcessingStep.ProcessingStepType.MINT_ARKS]
+
+
+class Command(BaseCommand):
+    help = ("Counts the queries needed to restart one step for every job of a large transfer, with the status being "
+            "updated on every save and with deferred status updates. Nothing is kept in the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reports", type=int, default=500)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            transfer = ExtractionTransfer.objects.create(name="status benchmark", status=Status.COMPLETE)
+            reports = Report.objects.bulk_create([Report(transfer=transfer) for _ in range(options["reports"])])
+            jobs = Job.objects.bulk_create([Job(transfer=transfer, report=r, status=Status.COMPLETE) for r in reports])
+            ProcessingStep.objects.bulk_create([
+                ProcessingStep(job=job, order=stepType.order, processingStepType=stepType.value,
+                               status=Status.COMPLETE)
+                for job in jobs for stepType in STEP_TYPES])
+
+            for name, deferred in [("per save", False), ("deferred", True)]:
+                steps = list(ProcessingStep.objects.filter(job__transfer=transfer,
+                                                           processingStepType=ProcessingStep.ProcessingStepType.NER.value
+                                                           ).select_related("job__transfer"))
+                start = perf_counter()
+                with CaptureQueriesContext(connection) as queries:
+                    if deferred:
+                        with deferredStatusUpdates():
+                            self.restart(steps)
+                    else:
+                        self.restart(steps)
+                elapsed = perf_counter() - start
+                self.stdout.write(f"{name:>9}: {len(queries):6d} queries, {elapsed:.2f}s for {len(steps)} jobs")
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def restart(steps):
+        # what restartTask does for every job, minus scheduling the task
+        for step in steps:
+            step.status = Status.IN_PROGRESS
+            step.save()
@@ -0,0 +1,138 @@
+import multiprocessing
+import tempfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from lxml import etree
+
+from metadata.transcription import Page, extractTranscription, transcriptionFormat, pageNamespace, parseTextRegion
+
+ALTO_LINE = ('<TextLine ID="l{0}" HPOS="10" VPOS="{0}" WIDTH="500" HEIGHT="20">'
+             '<String CONTENT="Protokoll"/><SP/><String CONTENT="fört"/><SP/><String CONTENT="vid"/><SP/>'
+             '<String CONTENT="sammanträde"/><SP/><String CONTENT="{0}"/></TextLine>')
+PAGE_LINE = ('<TextLine id="l{0}"><Coords points="10,{0} 510,{0} 510,{1} 10,{1}"/>'
+             '<Baseline points="10,{1} 510,{1}"/><TextEquiv><Unicode>Protokoll fört vid sammanträde {0}</Unicode>'
+             '</TextEquiv></TextLine>')
+
+
+def __syntheticAlto(path: Path, lines: int):
+    with path.open("w") as outFile:
+        outFile.write('<alto xmlns="http://www.loc.gov/standards/alto/ns-v4#"><Layout><Page><PrintSpace>')
+        for block in range(0, lines, 50):
+            outFile.write(f'<TextBlock ID="b{block}">')
+            outFile.writelines(ALTO_LINE.format(i) for i in range(block, min(block + 50, lines)))
+            outFile.write("</TextBlock>")
+        outFile.write("</PrintSpace></Page></Layout></alto>")
+
+
+def __syntheticPage(path: Path, lines: int):
+    with path.open("w") as outFile:
+        outFile.write('<PcGts xmlns="http://schema.primaresearch.org/PAGE/gts/pagecontent/2019-07-15">'
+                      '<Page imageFilename="page.jpg" imageWidth="2000" imageHeight="3000">')
+        for region in range(0, lines, 50):
+            outFile.write(f'<TextRegion id="r{region}"><Coords points="0,{region} 600,{region} 600,{region + 50} '
+                          f'0,{region + 50}"/>')
+            outFile.writelines(PAGE_LINE.format(i, i + 20) for i in range(region, min(region + 50, lines)))
+            outFile.write("</TextRegion>")
+        outFile.write("</Page></PcGts>")
+
+
+def __legacyText(path: Path):
+    # what NER did before: an ElementTree parse of the whole file
+    root = ET.parse(path).getroot()
+    if "alto" in root.tag:
+        namespace = {"": root.tag.split("}")[0].strip("{")}
+        return ["".join(" " if entry.tag.endswith("SP") else entry.attrib["CONTENT"] for entry in line
+                        if entry.tag.endswith("SP") or entry.tag.endswith("String"))
+                for line in root.findall(".//TextLine", namespace)]
+    elif "PcGts" in root.tag:
+        namespace = {"": root.tag.replace("PcGts", "").strip("{}")}
+        return [line.text or "" for line in root.findall(".//TextLine/TextEquiv/Unicode", namespace)]
+    return []
+
+
+def __legacyExport(path: Path):
+    # what the export did before: a format check and an lxml parse of the whole file for the geometry of PAGE files
+    page = Page()
+    if transcriptionFormat(path) == "PAGE":
+        root = etree.parse(str(path)).getroot()
+        namespace = pageNamespace(root.tag)
+        for textRegion in root.find("Page", namespace).findall("TextRegion", namespace):
+            page.regions.append(parseTextRegion(textRegion, namespace))
+    return page
+
+
+METHODS = [("old text", __legacyText),
+           ("new text", lambda path: extractTranscription(path, geometry=False)),
+           ("old geometry", __legacyExport),
+           ("new geometry", lambda path: extractTranscription(path, text=False)),
+           ("new text + geometry", extractTranscription)]
+
+
+def syntheticFiles(directory: Path, lines: int) -> list:
+    files = [directory / "alto.xml", directory / "page.xml"]
+    __syntheticAlto(files[0], lines)
+    __syntheticPage(files[1], lines)
+    return files
+
+
+def __measureIn(connection, function, path: Path):
+    Path("/proc/self/clear_refs").write_text("5")
+    before = __status("VmRSS")
+    start = perf_counter()
+    function(path)
+    seconds = perf_counter() - start
+    connection.send((seconds, max(0, __status("VmHWM") - before) / 1024))
+    connection.close()
+
+
+def measure(function, path: Path):
+    """
+    Runs the function in a forked process and returns its duration and the growth of the peak resident set size in
+    MiB. The peak is reset through ``/proc/self/clear_refs`` first, so this only works on Linux.
+    """
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=__measureIn, args=(sender, function, path))
+    process.start()
+    result = receiver.recv()
+    process.join()
+    return result
+
+
+def __status(key: str) -> int:
+    for line in Path("/proc/self/status").read_text().splitlines():
+        if line.startswith(key):
+            return int(line.split()[1])
+    raise CommandError("/proc/self/status is not available, memory can only be measured on Linux.")
+
+
+class Command(BaseCommand):
+    help = ("Compares the old transcription reading (separate ElementTree/lxml parses of the whole file) with the "
+            "single-pass extractor used by NER and the exports, on given files or on generated ALTO and PAGE files.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="*", type=Path, help="transcription files (default: generated ones)")
+        parser.add_argument("--lines", type=int, default=200000, help="text lines of the generated files")
+        parser.add_argument("--repeat", type=int, default=3, help="runs per file, the fastest one is reported")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            files = options["files"]
+            if not files:
+                files = syntheticFiles(Path(tmpDir), options["lines"])
+
+            for path in files:
+                if not path.is_file():
+                    raise CommandError(f"{path} does not exist.")
+                fileFormat = transcriptionFormat(path)
+                self.stdout.write(f"{path.name} ({path.stat().st_size / 2 ** 20:.1f} MiB, {fileFormat})")
+                for name, function in METHODS:
+                    if "geometry" in name and fileFormat != "PAGE":
+                        continue
+                    runs = [measure(function, path) for _ in range(options["repeat"])]
+                    seconds = min(run[0] for run in runs)
+                    memory = min(run[1] for run in runs)
+                    self.stdout.write(f"  {name:>19}: {seconds:.2f}s, peak memory +{memory:.1f} MiB")
@@ -0,0 +1,91 @@
+import tempfile
+from time import perf_counter
+
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from metadata.ingest import importOmekaTransfer, indexRows
+from metadata.models import Status, Pipeline
+from metadata.partials import FAC_PROCESSING_STEP_INITIAL
+
+STEP_CONFIG = [{"stepType": step["label"], "mode": step["mode"], "humanValidation": False, "status": Status.COMPLETE}
+               for step in FAC_PROCESSING_STEP_INITIAL]
+
+ITEM_COLUMNS = {"dcterms:title": "title", "dcterms:creator": "creator", "dcterms:date": "1990",
+                "dcterms:coverage": "section", "dcterms:language": "sv", "dcterms:spatial": "",
+                "dcterms:type": "annual report", "dcterms:license": "", "dcterms:isVersionOf": "",
+                "dcterms:isFormatOf": "printed", "dcterms:accessRights": "not restricted", "dcterms:relation": "",
+                "dcterms:created": "1991", "dcterms:available": "2024-01-01", "dcterms:source": "",
+                "dcterms:description": "", "dcterms:coverage.sv": "sektion", "dcterms:type.sv": "årsberättelse",
+                "dcterms:isFormatOf.sv": "tryckt", "dcterms:accessRights.sv": "ej begränsad",
+                "dcterms:description.sv": ""}
+MEDIA_COLUMNS = {"lm:transcription": "text", "lm:normalised": "", "lm:person": "", "lm:organisation": "",
+                 "lm:location": "", "lm:time": "", "lm:work": "", "lm:event": "", "lm:object": "",
+                 "lm:measure": "False"}
+
+
+def omekaExport(pages: int, pagesPerReport: int):
+    structure, items, media = {}, [], []
+    for i in range(pages):
+        reportNoid, pageNoid = f"r{i // pagesPerReport:06d}", f"p{i:07d}"
+        filename = f"fac_{i // pagesPerReport:05d}_arsberattelse_1990_sid-{i % pagesPerReport + 1:02d}.xml"
+        if reportNoid not in structure:
+            structure[reportNoid] = {"title": "title", "pages": []}
+            identifier = f"https://ark.example.org/ark:/12345/{reportNoid}"
+            items.append(dict(ITEM_COLUMNS, **{"dcterms:identifier": f"{identifier} {identifier}"}))
+        structure[reportNoid]["pages"].append({"id": pageNoid, "filename": filename,
+                                               "order": str(i % pagesPerReport + 1)})
+        pageIdentifier = f"https://iiif.example.org/iiif/image/{pageNoid}/info.json"
+        media.append(dict(MEDIA_COLUMNS, **{"dcterms:identifier": pageIdentifier}))
+    return structure, pd.DataFrame(items), pd.DataFrame(media)
+
+
+def __columnScan(structure, items, media) -> int:
+    # what importTransfer did before: a regular expression search through the identifier column per report and page
+    found = 0
+    for reportId, reportStructure in structure.items():
+        found += len(items[items["dcterms:identifier"].str.contains(reportId)].iloc[:1])
+        for page in reportStructure["pages"]:
+            found += len(media[media["dcterms:identifier"].str.contains(page["id"])].iloc[:1])
+    return found
+
+
+def __noidIndex(structure, items, media) -> int:
+    itemIndex, mediaIndex = indexRows(items.to_dict("records")), indexRows(media.to_dict("records"))
+    return sum((reportId in itemIndex) + sum(page["id"] in mediaIndex for page in reportStructure["pages"])
+               for reportId, reportStructure in structure.items())
+
+
+METHODS = [("column scan", __columnScan), ("noid index", __noidIndex)]
+
+
+class Command(BaseCommand):
+    help = ("Measures how long looking up the rows of an Omeka export takes, the old way (a column scan per report and "
+            "page) and with noid indexes, and how long and how many queries the whole import takes. Nothing is kept in "
+            "the database or on disk.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=10000)
+        parser.add_argument("--pages-per-report", type=int, default=10)
+
+    def handle(self, *args, **options):
+        structure, items, media = omekaExport(options["pages"], options["pages_per_report"])
+        for name, function in METHODS:
+            start = perf_counter()
+            found = function(structure, items, media)
+            self.stdout.write(f"{name:>12}: {perf_counter() - start:.2f}s to find {found} rows")
+
+        files = {page["filename"]: SimpleUploadedFile(page["filename"], b"<xml/>")
+                 for reportStructure in structure.values() for page in reportStructure["pages"]}
+        with tempfile.TemporaryDirectory() as mediaRoot, override_settings(MEDIA_ROOT=mediaRoot):
+            with transaction.atomic():
+                start = perf_counter()
+                with CaptureQueriesContext(connection) as queries:
+                    importOmekaTransfer("import benchmark", "", Pipeline.FAC, structure, items, media, files,
+                                        STEP_CONFIG)
+                elapsed = perf_counter() - start
+                transaction.set_rollback(True)
+        self.stdout.write(f"{'import':>12}: {len(queries):6d} queries, {elapsed:.2f}s for {len(files)} pages")
@@ -0,0 +1,64 @@
+import tempfile
+from time import perf_counter
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from metadata.ingest import ingestTransfer, groupTranscriptionFiles
+from metadata.models import ExtractionTransfer, Report, Page, Job, Status, Pipeline
+from metadata.partials import FAC_PROCESSING_STEP_INITIAL
+from metadata.utils import buildProcessingSteps
+
+STEP_CONFIG = [{"stepType": step["label"], "mode": step["mode"], "humanValidation": step["humanValidation"]}
+               for step in FAC_PROCESSING_STEP_INITIAL]
+
+
+def uploads(count: int, pagesPerReport: int):
+    return [SimpleUploadedFile(f"fac_{i // pagesPerReport:05d}_arsberattelse_1991_sid-{i % pagesPerReport + 1:02d}.xml",
+                               b"<xml/>") for i in range(count)]
+
+
+def __perObject(files):
+    # what createTransfer did before: one insert and one status cascade per report, job and step
+    transfer = ExtractionTransfer.objects.create(name="ingest benchmark", status=Status.AWAITING_HUMAN_VALIDATION,
+                                                 pipeline=Pipeline.FAC)
+    for pages in groupTranscriptionFiles(files).values():
+        dates = sorted(set(d for p in pages for d in p["date"]))
+        r = Report.objects.create(transfer=transfer, unionId=pages[0]["union_id"],
+                                  type=list(set(p["type"] for p in pages)), date=dates)
+        Page.objects.bulk_create([Page(report=r, order=int(page["page"]), transcriptionFile=page["file"],
+                                       originalFileName=page["file"]) for page in pages])
+        j = Job.objects.create(transfer=transfer, report=r)
+        buildProcessingSteps(STEP_CONFIG, j)
+        r.job = j
+        r.save()
+
+
+def __bulk(files):
+    ingestTransfer("ingest benchmark", "", Pipeline.FAC, files, STEP_CONFIG)
+
+
+METHODS = [("per object", __perObject), ("bulk", __bulk)]
+
+
+class Command(BaseCommand):
+    help = ("Counts the queries and time needed to create a transfer from many uploaded files, the old way (one insert "
+            "and status cascade per object) and with bulk inserts. Nothing is kept in the database or on disk.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--files", type=int, default=800)
+        parser.add_argument("--pages-per-report", type=int, default=4)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as mediaRoot, override_settings(MEDIA_ROOT=mediaRoot):
+            for name, function in METHODS:
+                files = uploads(options["files"], options["pages_per_report"])
+                with transaction.atomic():
+                    start = perf_counter()
+                    with CaptureQueriesContext(connection) as queries:
+                        function(files)
+                    elapsed = perf_counter() - start
+                    transaction.set_rollback(True)
+                self.stdout.write(f"{name:>10}: {len(queries):6d} queries, {elapsed:.2f}s for {len(files)} files")
@@ -0,0 +1,74 @@
+from pathlib import Path
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from metadata.nlp.hf_utils import Backend, export
+from metadata.nlp.ner import NER_HELPER, findEntities, normalize, extractText
+
+CATEGORIES = ["persons", "organisations", "locations", "times", "works", "events", "objects"]
+
+
+class Command(BaseCommand):
+    help = ("Compares throughput and entity output of the NER backends over a sample of pages, using the fp32 PyTorch "
+            "backend as reference.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", type=Path, help="transcription files or directories containing them")
+        parser.add_argument("--limit", type=int, default=50, help="maximum number of pages to process")
+        parser.add_argument("--backends", nargs="+", choices=[b.value for b in Backend if b != Backend.TORCH],
+                            default=[Backend.QUANTISED.value, Backend.ONNX.value])
+        parser.add_argument("--no-normalise", action="store_true")
+
+    def handle(self, *args, **options):
+        pages = []
+        for path in options["paths"]:
+            if path.is_dir():
+                pages.extend(sorted(p for p in path.rglob("*") if p.suffix in [".xml", ".txt"]))
+            elif path.exists():
+                pages.append(path)
+        pages = pages[:options["limit"]]
+        if not pages:
+            raise CommandError("No transcription files found.")
+
+        texts = [extractText(page) for page in pages]
+        if not options["no_normalise"]:
+            texts = [normalize(text) for text in texts]
+        if Backend.ONNX.value in options["backends"]:
+            export()
+
+        reference = None
+        self.stdout.write(f"{len(pages)} pages")
+        for backend in [Backend.TORCH] + [Backend(b) for b in options["backends"]]:
+            with NER_HELPER.useBackend(backend):
+                # warm up, so that lazy initialisation is not timed
+                findEntities(texts[:1])
+                start = perf_counter()
+                results = findEntities(texts)
+                elapsed = perf_counter() - start
+
+            line = f"{backend.value:>10}: {len(pages) / elapsed:8.2f} pages/s"
+            if reference is None:
+                reference = results
+            else:
+                line += self.__agreement(reference, results)
+            self.stdout.write(line)
+
+    @staticmethod
+    def __agreement(reference, results) -> str:
+        identicalPages = 0
+        truePositives = expected = found = 0
+        for expectedResult, result in zip(reference, results):
+            pageIdentical = True
+            for category in CATEGORIES:
+                expectedEntities = set(getattr(expectedResult, category))
+                foundEntities = set(getattr(result, category))
+                truePositives += len(expectedEntities & foundEntities)
+                expected += len(expectedEntities)
+                found += len(foundEntities)
+                pageIdentical &= expectedEntities == foundEntities
+            identicalPages += pageIdentical
+        precision = truePositives / found if found else 1.0
+        recall = truePositives / expected if expected else 1.0
+        return (f", identical pages {identicalPages}/{len(reference)}, "
+                f"precision {precision:.3f}, recall {recall:.3f} (vs torch)")
@@ -0,0 +1,47 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from metadata.alto_conversion import convertTree, convertTransfers
+from metadata.models import ExtractionTransfer
+
+
+class Command(BaseCommand):
+    help = ("Converts PAGE XML transcriptions to ALTO with a pool of worker processes, either for a directory tree or "
+            "for the pages of transfers (filling the cache used by the exports). Up to date outputs are skipped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", type=Path, help="directory containing PAGE files")
+        parser.add_argument("--target", type=Path, help="directory the ALTO files are written to (with --source)")
+        parser.add_argument("--transfer", type=int, action="append", default=[],
+                            help="id of a transfer to convert, can be given several times")
+        parser.add_argument("--all-transfers", action="store_true")
+        parser.add_argument("--workers", type=int, default=None, help="number of processes (default: CPU count)")
+        parser.add_argument("--force", action="store_true", help="convert files even if they are up to date")
+
+    def handle(self, *args, **options):
+        if options["source"]:
+            if not options["target"]:
+                raise CommandError("--target is required with --source.")
+            if not options["source"].is_dir():
+                raise CommandError(f"{options['source']} is not a directory.")
+            result = convertTree(options["source"], options["target"], options["workers"], options["force"],
+                                 self.progress)
+        elif options["transfer"] or options["all_transfers"]:
+            transfers = ExtractionTransfer.objects.all()
+            if not options["all_transfers"]:
+                transfers = transfers.filter(pk__in=options["transfer"])
+            result = convertTransfers(transfers, options["workers"], options["force"], self.progress)
+        else:
+            raise CommandError("Either --source/--target, --transfer or --all-transfers is required.")
+
+        self.stdout.write("")
+        for source, error in result.failed:
+            self.stderr.write(f"{source}: {error}")
+        self.stdout.write(f"{result.converted} converted, {result.skipped} up to date, {len(result.failed)} failed "
+                          f"in {result.seconds:.1f}s ({result.filesPerSecond:.1f} files/s)")
+
+    def progress(self, done: int, total: int):
+        if done == total or done % 50 == 0:
+            self.stdout.write(f"\r{done}/{total} files", ending="")
+            self.stdout.flush()
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from metadata.nlp.server import NerServer
+
+
+class Command(BaseCommand):
+    help = "Runs the NER server, which keeps one copy of the NER models in memory and serves all workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--address", default=settings.NER_SERVER_ADDRESS,
+                            help="host:port or path of a unix socket, defaults to NER_SERVER_ADDRESS")
+        parser.add_argument("--max-texts", type=int, default=settings.NER_SERVER_MAX_TEXTS)
+
+    def handle(self, *args, **options):
+        if not options["address"]:
+            raise CommandError("No address given and NER_SERVER_ADDRESS is not set.")
+        NerServer(options["address"], options["max_texts"]).serveForever()
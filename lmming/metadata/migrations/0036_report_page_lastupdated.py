@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-17 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metadata', '0035_alter_processingstep_processingsteptype_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='lastUpdated',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='lastUpdated',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
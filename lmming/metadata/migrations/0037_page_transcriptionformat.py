@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-17 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metadata', '0036_report_page_lastupdated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='transcriptionFormat',
+            field=models.CharField(blank=True, choices=[('ALTO', 'ALTO XML'), ('PAGE', 'PAGE XML'), ('OTHER', 'other')], default=''),
+        ),
+    ]
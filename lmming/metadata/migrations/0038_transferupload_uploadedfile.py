@@ -0,0 +1,42 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:05
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metadata', '0037_page_transcriptionformat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField()),
+                ('handler', models.CharField(blank=True, null=True)),
+                ('pipeline', models.CharField(choices=[('FAC', 'Fac'), ('ARAB_LM', 'Arab Lm'), ('ARAB_OTHER', 'Arab Other')])),
+                ('stepConfig', models.JSONField(default=list)),
+                ('dateCreated', models.DateTimeField(auto_now_add=True)),
+                ('lastUpdated', models.DateTimeField(auto_now=True)),
+                ('transfer', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='metadata.extractiontransfer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UploadedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField()),
+                ('size', models.BigIntegerField()),
+                ('received', models.BigIntegerField(default=0)),
+                ('reportIdentifier', models.CharField()),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='metadata.transferupload')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('upload', 'name'), name='unique_uploaded_file_name')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metadata', '0038_transferupload_uploadedfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservedNoid',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField()),
+                ('noid', models.CharField()),
+                ('dateCreated', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('namespace', 'noid'), name='unique_reserved_noid')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metadata', '0039_reservednoid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='registeredHash',
+            field=models.CharField(blank=True, default=''),
+        ),
+    ]
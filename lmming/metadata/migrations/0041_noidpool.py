@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metadata', '0040_page_registeredhash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoidPool',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField(unique=True)),
+                ('refillStarted', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -1,8 +1,16 @@
+import shutil
+import threading
 import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Set, Iterable
 
+from django.contrib.postgres.aggregates import ArrayAgg
 from django.contrib.postgres.fields import ArrayField
 from django.db.models import Model, PositiveIntegerField, FileField, BooleanField, CharField, TextField, \
-    ForeignKey, DateField, TextChoices, DateTimeField, CASCADE, OneToOneField, URLField, IntegerField, Q, Choices
+    ForeignKey, DateField, TextChoices, DateTimeField, CASCADE, OneToOneField, URLField, IntegerField, Q, Choices, \
+    Value, UUIDField, JSONField, BigIntegerField, SET_NULL, UniqueConstraint
+from django.conf import settings
 from django.db.models.signals import pre_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
@@ -34,8 +42,10 @@ class ExtractionTransfer(Model):
     handler = CharField(null=True, blank=True)
 
     def updateTransferStatus(self):
-        jobStatuses = set([job.status for job in self.jobs.all()])
+        self.applyJobStatuses(set(self.jobs.values_list("status", flat=True).distinct()))
+        self.save()
 
+    def applyJobStatuses(self, jobStatuses: Set[str]):
         if self.status == Status.PENDING and len(jobStatuses) > 1:
             self.started()
         elif Status.AWAITING_HUMAN_INPUT in jobStatuses:
@@ -54,7 +64,6 @@ class ExtractionTransfer(Model):
                 self.status = Status.IN_PROGRESS
             else:  # status is a mix of complete and error
                 self.status = Status.ERROR
-        self.save()
 
     def started(self):
         self.startDate = timezone.now()
@@ -129,6 +138,8 @@ class Report(Model):
     medium = ArrayField(CharField(), blank=True, null=True,  default=list)
     type_other = CharField(blank=True, default="")
 
+    lastUpdated = DateTimeField(auto_now=True, null=True)
+
     def dateString(self) -> str:
         if len(self.date) == 0:
             return ""
@@ -190,9 +201,15 @@ class ReportTranslation(Model):
 
 
 class Page(Model):
+    class TranscriptionFormat(TextChoices):
+        ALTO = "ALTO", "ALTO XML"
+        PAGE = "PAGE", "PAGE XML"
+        OTHER = "OTHER", "other"
+
     report = ForeignKey(Report, on_delete=CASCADE)
     order = PositiveIntegerField(default=1)  # internal use, not for CSV
     transcriptionFile = FileField(blank=False, null=True)  # mandatory, file type can be plain text or ALTO xml
+    transcriptionFormat = CharField(choices=TranscriptionFormat.choices, blank=True, default="")  # set on first export
     originalFileName = CharField(blank=False, null=True)
 
     identifier = URLField(blank=True, null=True)  # URL
@@ -211,12 +228,8 @@ class Page(Model):
     noid = CharField(blank=True, default="")
     source = CharField(blank=True, default="")
     bibCitation = CharField(blank=True, default="")
-
-
-# noinspection PyUnusedLocal
-@receiver(pre_delete, sender=Page, weak=False)
-def pageFileDeleteHandler(sender, instance, **_kwargs):
-    instance.transcriptionFile.delete(save=False)
+    registeredHash = CharField(blank=True, default="")  # what was last registered for noid, empty = pending
+    lastUpdated = DateTimeField(auto_now=True, null=True)
 
 
 class Job(Model):
@@ -230,7 +243,10 @@ class Job(Model):
     lastUpdated = DateTimeField(auto_now=True, null=True)
 
     def updateStatus(self):
-        stepStatuses = set([s.status for s in self.processingSteps.all()])
+        self.applyStepStatuses(set(self.processingSteps.values_list("status", flat=True).distinct()))
+        self.save()
+
+    def applyStepStatuses(self, stepStatuses: Set[str]):
         if Status.ERROR in stepStatuses:
             self.status = Status.ERROR
         elif Status.AWAITING_HUMAN_INPUT in stepStatuses:
@@ -248,7 +264,6 @@ class Job(Model):
                 self.started()
             else:
                 self.status = Status.IN_PROGRESS
-        self.save()
 
     def started(self):
         self.startDate = timezone.now()
@@ -267,7 +282,10 @@ class Job(Model):
 # noinspection PyUnusedLocal
 @receiver(post_save, sender=Job, weak=False)
 def statusUpdateTransfer(sender, instance, **_kwargs):  # pylint: disable=unused-argument
-    instance.transfer.updateTransferStatus()
+    if getattr(_deferredStatus, "transfers", None) is not None:
+        _deferredStatus.transfers.add(instance.transfer_id)
+    else:
+        instance.transfer.updateTransferStatus()
 
 
 class ProcessingStep(Model):
@@ -326,7 +344,62 @@ def processLog(sender, instance, **_kwargs):  # pylint: disable=unused-argument
 # noinspection PyUnusedLocal
 @receiver(post_save, sender=ProcessingStep, weak=False)
 def statusUpdate(sender, instance, **_kwargs):  # pylint: disable=unused-argument
-    instance.job.updateStatus()
+    if getattr(_deferredStatus, "jobs", None) is not None:
+        _deferredStatus.jobs.add(instance.job_id)
+    else:
+        instance.job.updateStatus()
+
+
+_deferredStatus = threading.local()
+
+
+def updateStatuses(jobPks: Iterable[int] = (), transferPks: Iterable[int] = ()):
+    """
+    Recomputes the status of the given jobs from their processing steps, and that of the given transfers (plus those
+    of the jobs) from their jobs. Independent of the number of jobs, this takes one grouped query and one bulk update
+    for the jobs, and the same for the transfers.
+    """
+    now = timezone.now()
+    transferPks = set(transferPks)
+
+    jobs = list(Job.objects.filter(pk__in=set(jobPks)).annotate(
+        stepStatuses=ArrayAgg("processingSteps__status", distinct=True, filter=Q(processingSteps__isnull=False),
+                              default=Value([]))))
+    for job in jobs:
+        job.applyStepStatuses(set(job.stepStatuses))
+        job.lastUpdated = now
+        transferPks.add(job.transfer_id)
+    Job.objects.bulk_update(jobs, ["status", "startDate", "endDate", "lastUpdated"])
+
+    transfers = list(ExtractionTransfer.objects.filter(pk__in=transferPks).annotate(
+        jobStatuses=ArrayAgg("jobs__status", distinct=True, filter=Q(jobs__isnull=False), default=Value([]))))
+    for transfer in transfers:
+        transfer.applyJobStatuses(set(transfer.jobStatuses))
+        transfer.lastUpdated = now
+    ExtractionTransfer.objects.bulk_update(transfers, ["status", "startDate", "endDate", "lastUpdated"])
+
+
+@contextmanager
+def deferredStatusUpdates():
+    """
+    Within this context, saving processing steps or jobs does not update the status of their job and transfer right
+    away. Instead, all affected jobs and transfers are updated at once with ``updateStatuses`` when the (outermost)
+    context is left.
+    """
+    if getattr(_deferredStatus, "jobs", None) is not None:
+        yield
+        return
+
+    _deferredStatus.jobs = set()
+    _deferredStatus.transfers = set()
+    try:
+        yield
+    finally:
+        jobPks, transferPks = _deferredStatus.jobs, _deferredStatus.transfers
+        _deferredStatus.jobs = None
+        _deferredStatus.transfers = None
+        if jobPks or transferPks:
+            updateStatuses(jobPks, transferPks)
 
 
 class DefaultValueSettings(Model):
@@ -409,3 +482,66 @@ class InstituteSpecificData(Model):
 class FacSpecificData(InstituteSpecificData):
     seriesVolumeName = CharField(blank=True, default="")
     seriesVolumeSignum = CharField(blank=True, default="")
+
+
+class TransferUpload(Model):
+    """
+    A transfer whose transcription files are uploaded in chunks (see ``metadata.uploads``). The transfer itself is only
+    created once every file has arrived.
+    """
+    id = UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = CharField()
+    handler = CharField(null=True, blank=True)
+    pipeline = CharField(choices=Pipeline.choices)
+    stepConfig = JSONField(default=list)
+    dateCreated = DateTimeField(auto_now_add=True)
+    lastUpdated = DateTimeField(auto_now=True)
+    transfer = OneToOneField(ExtractionTransfer, on_delete=SET_NULL, null=True, blank=True)
+
+    @property
+    def directory(self) -> Path:
+        return Path(settings.UPLOAD_DIR) / str(self.pk)
+
+
+class UploadedFile(Model):
+    class Meta:
+        constraints = [UniqueConstraint(fields=["upload", "name"], name="unique_uploaded_file_name")]
+
+    upload = ForeignKey(TransferUpload, on_delete=CASCADE, related_name="files")
+    name = CharField()
+    size = BigIntegerField()
+    received = BigIntegerField(default=0)
+    reportIdentifier = CharField()
+
+    @property
+    def complete(self) -> bool:
+        return self.received == self.size
+
+
+# noinspection PyUnusedLocal
+@receiver(pre_delete, sender=TransferUpload, weak=False)
+def uploadDirectoryDeleteHandler(sender, instance, **_kwargs):
+    shutil.rmtree(instance.directory, ignore_errors=True)
+
+
+class ReservedNoid(Model):
+    """
+    A noid that is known to be free (handles), resp. already minted but not yet pointing anywhere (ARKs), and that waits
+    to be claimed by a minting task. ``namespace`` is the handle prefix, resp. the ARK shoulder, it belongs to (see
+    ``metadata.tasks.minting``).
+    """
+    class Meta:
+        constraints = [UniqueConstraint(fields=["namespace", "noid"], name="unique_reserved_noid")]
+
+    namespace = CharField()
+    noid = CharField()
+    dateCreated = DateTimeField(auto_now_add=True)
+
+
+class NoidPool(Model):
+    """
+    Bookkeeping of the pool of ``ReservedNoid`` of a namespace: ``refillStarted`` is set while a refill is queued or
+    running, so that there is only one at a time (see ``metadata.tasks.minting.scheduleRefill``).
+    """
+    namespace = CharField(unique=True)
+    refillStarted = DateTimeField(null=True, blank=True)
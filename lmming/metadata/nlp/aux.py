@@ -29,6 +29,18 @@ def loadSynonyms() -> Tuple[Dict[str, Set[str]], List]:
     return dalin, dalin_values_flat
 
 
+def buildSynonymIndex(dalin: Dict[str, Set[str]]) -> Dict[str, str]:
+    """
+    Inverts the synonym dictionary, mapping every historical spelling variant to its normalised form. If a variant is
+    listed for several normalised forms, the first one (in file order) is kept, matching the behaviour of ``get_key``.
+    """
+    index = {}
+    for key, variants in dalin.items():
+        for variant in variants:
+            index.setdefault(variant, key)
+    return index
+
+
 def get_key(val, dalin):
     for key, value in dalin.items():
         if val in value:
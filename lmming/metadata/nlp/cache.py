@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import time
+from dataclasses import asdict
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+
+from .ner import NlpResult, NORMALISATION_RULES
+
+NLP_DIR = Path(__file__).resolve().parent
+EVICTION_INTERVAL = 600  # seconds between two evictions, as an eviction looks at every entry of the cache
+
+
+@lru_cache(maxsize=1)
+def resourcesHash() -> str:
+    """
+    Hash of everything besides the models that changes the normalised text: the abbreviation and synonym lists and the
+    normalisation rules.
+    """
+    digest = hashlib.sha256()
+    for name in ["abbreviations.txt", "synonyms.txt"]:
+        digest.update((NLP_DIR / name).read_bytes())
+    for pattern, replacement in NORMALISATION_RULES:
+        digest.update(f"{pattern.pattern}\0{replacement}\0".encode())
+    return digest.hexdigest()
+
+
+def cacheKey(pagePath: Path, normalise: bool) -> str:
+    """
+    Content address of the NER result for the given transcription file: besides the file content, the key covers
+    everything the result depends on, so that a changed setting or model revision never returns a stale result.
+    """
+    digest = hashlib.sha256()
+    with pagePath.open("rb") as inFile:
+        for chunk in iter(lambda: inFile.read(1 << 16), b""):
+            digest.update(chunk)
+    digest.update(json.dumps([normalise, settings.HF_CRINA_HASH, settings.HF_KB_HASH, settings.NER_BACKEND,
+                              settings.NER_WINDOW_SIZE, settings.NER_WINDOW_STRIDE, resourcesHash()]).encode())
+    return digest.hexdigest()
+
+
+def __entryPath(key: str) -> Path:
+    return Path(settings.NER_CACHE_DIR) / key[:2] / f"{key}.json"
+
+
+def load(key: str) -> Optional[NlpResult]:
+    entry = __entryPath(key)
+    try:
+        with entry.open("r") as inFile:
+            result = NlpResult(**json.load(inFile))
+    except (OSError, ValueError, TypeError):
+        return None
+    # entries are evicted least recently used first
+    os.utime(entry)
+    return result
+
+
+def store(key: str, result: NlpResult):
+    if settings.NER_CACHE_MAX_SIZE <= 0:
+        return
+    entry = __entryPath(key)
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file first, so that concurrent workers never read a partial entry
+    temporary = entry.with_suffix(f".{os.getpid()}.tmp")
+    with temporary.open("w") as outFile:
+        json.dump(asdict(result), outFile, default=list)
+    temporary.replace(entry)
+
+
+def evict(maxSize: int = None):
+    """
+    Deletes the least recently used entries until the cache takes up at most ``maxSize`` bytes (default
+    ``NER_CACHE_MAX_SIZE``).
+    """
+    maxSize = settings.NER_CACHE_MAX_SIZE if maxSize is None else maxSize
+    cacheDir = Path(settings.NER_CACHE_DIR)
+    if not cacheDir.exists():
+        return
+
+    entries = []
+    for entry in cacheDir.glob("*/*.json"):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries, key=lambda e: e[0]):
+        if total <= maxSize:
+            break
+        entry.unlink(missing_ok=True)
+        total -= size
+
+
+def evictIfDue():
+    """
+    Runs ``evict`` unless it already ran within the last ``EVICTION_INTERVAL`` seconds in any process sharing the cache
+    directory, as tracked by the modification time of a marker file.
+    """
+    marker = Path(settings.NER_CACHE_DIR) / ".evicted"
+    try:
+        if time.time() - marker.stat().st_mtime < EVICTION_INTERVAL:
+            return
+    except FileNotFoundError:
+        marker.parent.mkdir(parents=True, exist_ok=True)
+    marker.touch()
+    evict()
@@ -7,20 +7,66 @@ from huggingface_hub import snapshot_download
 from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
 
 
+class Backend(str, Enum):
+    TORCH = "torch"  # fp32 PyTorch, on the GPU if there is one
+    QUANTISED = "quantised"  # PyTorch with dynamically quantised int8 linear layers, CPU only
+    ONNX = "onnx"  # ONNX Runtime graph exported from the checkpoint, CPU only
+
+
+def models():
+    return [("crina-t/histbert-finetuned-ner", settings.HF_CRINA_HASH),
+            ("KBLab/bert-base-swedish-cased-ner", settings.HF_KB_HASH)]
+
+
+def __isUpToDate(directory: Path, revision: str) -> bool:
+    versionFile = directory / "version.txt"
+    if versionFile.exists():
+        with versionFile.open("r") as inFile:
+            return inFile.read() == revision
+    return False
+
+
+def __writeVersion(directory: Path, revision: str):
+    with (directory / "version.txt").open("w") as outFile:
+        outFile.write(revision)
+
+
 def download():
-    for modelName, revision in [("crina-t/histbert-finetuned-ner", settings.HF_CRINA_HASH),
-                                ("KBLab/bert-base-swedish-cased-ner", settings.HF_KB_HASH)]:
+    for modelName, revision in models():
         modelDir = Path(settings.NER_BASE_DIR) / "checkpoints" / modelName.replace("/", "_")
-        versionFile = modelDir / "version.txt"
-        if versionFile.exists():
-            with versionFile.open("r") as inFile:
-                existingRevision = inFile.read()
-                if existingRevision == revision:
-                    continue
+        if __isUpToDate(modelDir, revision):
+            continue
 
         snapshot_download(repo_id=modelName, revision=revision, local_dir=modelDir)
-        with versionFile.open("w") as outFile:
-            outFile.write(revision)
+        __writeVersion(modelDir, revision)
+
+    if Backend(settings.NER_BACKEND) == Backend.ONNX:
+        export()
+
+
+def export():
+    """
+    Exports both downloaded checkpoints to ONNX. Like the checkpoints, the exported graphs are tagged with the revision
+    they were built from and only re-exported when ``HF_CRINA_HASH`` or ``HF_KB_HASH`` change.
+    """
+    from optimum.onnxruntime import ORTModelForTokenClassification
+
+    for modelName, revision in models():
+        exportDir = onnxDir(modelName)
+        if __isUpToDate(exportDir, revision):
+            continue
+
+        model = ORTModelForTokenClassification.from_pretrained(checkpointDir(modelName), export=True)
+        model.save_pretrained(exportDir)
+        __writeVersion(exportDir, revision)
+
+
+def checkpointDir(modelName: str) -> Path:
+    return Path(settings.NER_BASE_DIR) / "checkpoints" / modelName.replace("/", "_")
+
+
+def onnxDir(modelName: str) -> Path:
+    return Path(settings.NER_BASE_DIR) / "onnx" / modelName.replace("/", "_")
 
 
 class Model(Enum):
@@ -28,18 +74,27 @@ class Model(Enum):
     KB = Path(settings.NER_BASE_DIR) / "checkpoints" / "KBLab_bert-base-swedish-cased-ner"
 
 
-def __getPipeline__(path: Path):
+def __getPipeline__(path: Path, backend: Backend = None):
+    backend = Backend(backend or settings.NER_BACKEND)
     tokenizer = AutoTokenizer.from_pretrained(path, truncation=True, padding=True, model_max_length=512)
-    model = AutoModelForTokenClassification.from_pretrained(path)
 
-    if torch.cuda.is_available():
+    if backend == Backend.ONNX:
+        from optimum.onnxruntime import ORTModelForTokenClassification
+
+        model = ORTModelForTokenClassification.from_pretrained(onnxDir(path.name))
+        return pipeline("ner", model=model, tokenizer=tokenizer, aggregation_strategy="first")
+
+    model = AutoModelForTokenClassification.from_pretrained(path)
+    if backend == Backend.QUANTISED:
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif torch.cuda.is_available():
         return pipeline("ner", model=model, tokenizer=tokenizer, aggregation_strategy="first", device="cuda")
     return pipeline("ner", model=model, tokenizer=tokenizer, aggregation_strategy="first")
 
 
-def getHistbertPipeline():
-    return __getPipeline__(Model.HISTBERT.value)
+def getHistbertPipeline(backend: Backend = None):
+    return __getPipeline__(Model.HISTBERT.value, backend)
 
 
-def getKBPipeline():
-    return __getPipeline__(Model.KB.value)
+def getKBPipeline(backend: Backend = None):
+    return __getPipeline__(Model.KB.value, backend)
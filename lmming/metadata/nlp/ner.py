@@ -1,15 +1,20 @@
+import logging
 import re
+from contextlib import contextmanager
 from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
 from string import capwords
-from typing import List
+from typing import List, Dict, Any
 
 import nltk
+from django.conf import settings
 
 nltk.download('punkt_tab')
-from .aux import loadAbbreviations, loadSynonyms, get_key
-from .hf_utils import getKBPipeline, getHistbertPipeline
-from .utils import correction, handleLinebreakChars, extractTranscriptionsFromXml
+from metadata.transcription import extractTranscription
+from .aux import loadAbbreviations, loadSynonyms, buildSynonymIndex
+from .hf_utils import Backend, getKBPipeline, getHistbertPipeline
+from .utils import correction, handleLinebreakChars
 
 TIME_EXPRESSIONS = ["Januari", "januari", "Jan", "jan", "Februari", "februari", "Feb", "feb", "Mars", "mars", "Mar",
                     "mar", "April", "april", "Apr", "apr", "Maj", "maj", "Juni", "juni", "Jun", "jun", "Juli", "juli",
@@ -21,6 +26,8 @@ CONSONANTS = "[bcdfghjklmnpqrstvwxyz]"
 
 EMPTY = ""
 
+logger = logging.getLogger(settings.WORKER_LOG_NAME)
+
 
 @dataclass
 class NlpResult:
@@ -35,6 +42,16 @@ class NlpResult:
     objects: List[str] = field(default_factory=list)
     measures: bool = False
 
+    def addEntities(self, other: "NlpResult"):
+        self.persons.extend(other.persons)
+        self.organisations.extend(other.organisations)
+        self.locations.extend(other.locations)
+        self.times.extend(other.times)
+        self.works.extend(other.works)
+        self.events.extend(other.events)
+        self.objects.extend(other.objects)
+        self.measures = self.measures or other.measures
+
     def removeDuplicates(self):
         self.persons = list(dict.fromkeys(self.persons))
         self.organisations = list(dict.fromkeys(self.organisations))
@@ -49,7 +66,8 @@ class NerHelper:
 
     def __init__(self):
         self.ABBREVIATIONS = loadAbbreviations()
-        self.DALIN, self.DALIN_VALUES_FLAT = loadSynonyms()
+        self.DALIN, _ = loadSynonyms()
+        self.DALIN_INDEX = buildSynonymIndex(self.DALIN)
 
         self._ner_ra = None
         self._ner_kb = None
@@ -66,87 +84,115 @@ class NerHelper:
             self._ner_kb = getKBPipeline()
         return self._ner_kb
 
+    @contextmanager
+    def useBackend(self, backend: Backend):
+        """
+        Runs NER with the pipelines of the given backend inside the ``with`` block instead of the ``NER_BACKEND`` ones,
+        e.g. to compare backends in one process. The previous pipelines are restored afterwards.
+        """
+        previous = self._ner_ra, self._ner_kb
+        self._ner_ra, self._ner_kb = getHistbertPipeline(backend), getKBPipeline(backend)
+        try:
+            yield
+        finally:
+            self._ner_ra, self._ner_kb = previous
+
 
 NER_HELPER = NerHelper()
 
 
+NORMALISATION_RULES = [(re.compile(pattern), replacement) for pattern, replacement in [
+    # Rule #1 qvart > kvart
+    (r"(Qv)", r"Kv"),
+    (r"(qv)", r"kv"),
+    # Rule #2 hvilket > vilket, wid > vid
+    (r"^(hv|w)", r"v"),
+    (r"^(Hv|W)", r"V"),
+    # Rule #3 lefuer > lever, hafva > hava
+    (r"(%s)ff?[uv](%s)" % (VOWELS, VOWELS), r"\1v\2"),
+    # Rule #4 fördärfvat > fördärvat, blijfva > bliva
+    (r"j?fv", r"v"),
+    # Rule #5 een > en, saak > sak
+    (r"(%s)\1{1}" % VOWELS, r"\1"),
+    # Rule #6 ähr > är, ahntaga > antaga
+    (r"(%s)h([nr])" % VOWELS, r"\1\2"),
+    # Rule #7 uthfhöra > utföra, sägher > säger
+    # (r"([dtfgk])h", r"\1"),
+    # Rule #8 elliest > eljest, bevilliat > beviljat
+    (r"lli([ae])", r"lj\1"),
+    # Rule #9 varidt > varit
+    (r"födt", r"fött"),
+    (r"dt", r"t"),
+    # Rule #10 dömbt > dömt, benämbdh > benämnd
+    (r"m[bp]t", r"mt"),
+    (r"m[bp]d", r"mnd"),
+    # Rule #11 slogz > slogs, skötz > sköts
+    (r"z", r"s"),
+    # Rule #12 försöria > försörja
+    # (r"([^a])ria([^t]|$)", r"\1rja\2"),
+    # Rule #13 vijka > vika, bevijsa > bevisa
+    (r"iji", r"j"),
+    (r"ij", r"i"),
+    # Rule #14 häfdar > hävdar
+    (r"(%s)fd" % VOWELS, r"\1vd"),
+    # Rule #15 föregaf > föregav
+    (r"gaff?($|\s)", r"gav\1"),
+    # Rule #16 blef > blev
+    (r"eff?($|\s)", r"ev\1"),
+    # Rule #17 affsagt > avsagt
+    (r"^([Aa])ff", r"\1v"),
+    # Rule #18 schall > skall
+    (r"sch", r"sk"),
+    # Rule #19 kiöpt > köpt
+    (r"kiö", r"kö"),
+    # Rule #20 prætenderat > pretenderat
+    (r"(æ|ae)", r"e"),
+    # Rule #21 ehrläggia > erlägga, sökia > söka
+    (r"(gg|k)ia", r"\1a"),
+    # Rule #22 huilken > vilken
+    (r"hui", r"vi"),
+    # Rule #23 avsachnat > avsaknat
+    (r"ch(%s)" % CONSONANTS, r"k\1"),
+    # Rule #24 giort > gjort
+    (r"giort", r"gjort"),
+    # Rule #25 voro > vore
+    (r"voro", r"vore"),
+    # Rule #26 effter > efter, offta > ofta
+    (r"fft", r"ft"),
+    # Rule #27 givess > gives, avdömass > avdömas
+    (r"([^o])ss($|\s)", r"\1s\2"),
+    # Rule #28 af > av
+    (r"([Aa])f([^ft]|$)", r"\1v\2"),
+    # Rule #29 iemte > jämte, sielf > själv
+    (r"ie(l|r|mt)", r"jä\1"),
+    (r"Ie(l|r|mt)", r"Jä\1"),
+    (r"(T|t)ien", r"\1jän"),
+]]
+
+
+def applyNormalisationRules(word: str) -> str:
+    normalized = word
+    for pattern, replacement in NORMALISATION_RULES:
+        normalized = pattern.sub(replacement, normalized)
+    return normalized
+
+
+@lru_cache(maxsize=2 ** 16)
+def normalizeWord(word: str) -> str:
+    if word in NER_HELPER.ABBREVIATIONS:
+        word = NER_HELPER.ABBREVIATIONS[word][0]
+    normalized = NER_HELPER.DALIN_INDEX.get(word)
+    if normalized is not None:
+        return normalized
+    return applyNormalisationRules(word)
+
+
+def normalizeTokens(tokens: List[str]) -> str:
+    return "".join(normalizeWord(word) + " " for word in tokens)
+
+
 def normalize(document):
-    edited = ''
-    processed = nltk.word_tokenize(document)
-    for word in processed:
-        if word in NER_HELPER.ABBREVIATIONS.keys():
-            word = NER_HELPER.ABBREVIATIONS[word][0]
-        if word in NER_HELPER.DALIN_VALUES_FLAT:
-            normalized = get_key(word, NER_HELPER.DALIN)
-            edited += normalized + ' '
-        else:
-            # Rule #1 qvart > kvart
-            normalized = re.sub(r"(Qv)", r"Kv", word)
-            normalized = re.sub(r"(qv)", r"kv", normalized)
-            # Rule #2 hvilket > vilket, wid > vid
-            normalized = re.sub(r"^(hv|w)", r"v", normalized)
-            normalized = re.sub(r"^(Hv|W)", r"V", normalized)
-            # Rule #3 lefuer > lever, hafva > hava
-            normalized = re.sub(r"(%s)ff?[uv](%s)" % (VOWELS, VOWELS), r"\1v\2", normalized)
-            # Rule #4 fördärfvat > fördärvat, blijfva > bliva
-            normalized = re.sub(r"j?fv", r"v", normalized)
-            # Rule #5 een > en, saak > sak
-            normalized = re.sub(r"(%s)\1{1}" % VOWELS, r"\1", normalized)
-            # Rule #6 ähr > är, ahntaga > antaga
-            normalized = re.sub(r"(%s)h([nr])" % VOWELS, r"\1\2", normalized)
-            # Rule #7 uthfhöra > utföra, sägher > säger
-            # normalized = re.sub(r"([dtfgk])h", r"\1", normalized)
-            # Rule #8 elliest > eljest, bevilliat > beviljat
-            normalized = re.sub(r"lli([ae])", r"lj\1", normalized)
-            # Rule #9 varidt > varit
-            normalized = re.sub(r"födt", r"fött", normalized)
-            normalized = re.sub(r"dt", r"t", normalized)
-            # Rule #10 dömbt > dömt, benämbdh > benämnd
-            normalized = re.sub(r"m[bp]t", r"mt", normalized)
-            normalized = re.sub(r"m[bp]d", r"mnd", normalized)
-            # Rule #11 slogz > slogs, skötz > sköts
-            normalized = re.sub(r"z", r"s", normalized)
-            # Rule #12 försöria > försörja
-            # normalized = re.sub(r"([^a])ria([^t]|$)", r"\1rja\2", normalized)
-            # Rule #13 vijka > vika, bevijsa > bevisa
-            normalized = re.sub(r"iji", r"j", normalized)
-            normalized = re.sub(r"ij", r"i", normalized)
-            # Rule #14 häfdar > hävdar
-            normalized = re.sub(r"(%s)fd" % VOWELS, r"\1vd", normalized)
-            # Rule #15 föregaf > föregav
-            normalized = re.sub(r"gaff?($|\s)", r"gav\1", normalized)
-            # Rule #16 blef > blev
-            normalized = re.sub(r"eff?($|\s)", r"ev\1", normalized)
-            # Rule #17 affsagt > avsagt
-            normalized = re.sub(r"^([Aa])ff", r"\1v", normalized)
-            # Rule #18 schall > skall
-            normalized = re.sub(r"sch", r"sk", normalized)
-            # Rule #19 kiöpt > köpt
-            normalized = re.sub(r"kiö", r"kö", normalized)
-            # Rule #20 prætenderat > pretenderat
-            normalized = re.sub(r"(æ|ae)", r"e", normalized)
-            # Rule #21 ehrläggia > erlägga, sökia > söka
-            normalized = re.sub(r"(gg|k)ia", r"\1a", normalized)
-            # Rule #22 huilken > vilken
-            normalized = re.sub(r"hui", r"vi", normalized)
-            # Rule #23 avsachnat > avsaknat
-            normalized = re.sub(r"ch(%s)" % CONSONANTS, r"k\1", normalized)
-            # Rule #24 giort > gjort
-            normalized = re.sub(r"giort", r"gjort", normalized)
-            # Rule #25 voro > vore
-            normalized = re.sub(r"voro", r"vore", normalized)
-            # Rule #26 effter > efter, offta > ofta
-            normalized = re.sub(r"fft", r"ft", normalized)
-            # Rule #27 givess > gives, avdömass > avdömas
-            normalized = re.sub(r"([^o])ss($|\s)", r"\1s\2", normalized)
-            # Rule #28 af > av
-            normalized = re.sub(r"([Aa])f([^ft]|$)", r"\1v\2", normalized)
-            # Rule #29 iemte > jämte, sielf > själv
-            normalized = re.sub(r"ie(l|r|mt)", r"jä\1", normalized)
-            normalized = re.sub(r"Ie(l|r|mt)", r"Jä\1", normalized)
-            normalized = re.sub(r"(T|t)ien", r"\1jän", normalized)
-            edited += normalized + ' '
-    return edited
+    return normalizeTokens(nltk.word_tokenize(document))
 
 
 def __cutAddress(person: str) -> str:
@@ -161,10 +207,8 @@ def __allCapsToPascal(person: str) -> str:
     return capwords(person)
 
 
-def filtered_entities(text: str, result: NlpResult):
+def __collectEntities(processed_ra, processed_kb, result: NlpResult):
     msr = 0
-    processed_ra = NER_HELPER.NER_RA(text)
-    processed_kb = NER_HELPER.NER_KB(text)
     for element in processed_ra:
         entity = correction(element["word"])
         label = element["entity_group"]
@@ -213,10 +257,147 @@ def filtered_entities(text: str, result: NlpResult):
                     result.events.append(entity)
 
 
-def processPage(pagePath: Path, normalise: bool = True) -> NlpResult:
-    result = NlpResult()
+@dataclass
+class TextWindow:
+    start: int
+    end: int
+    coreStart: int = 0
+    coreEnd: int = 0
+
+
+def __windows(text: str, tokenizer, windowSize: int, stride: int) -> List[TextWindow]:
+    """
+    Splits the text into overlapping windows of at most ``windowSize`` model tokens. Consecutive windows share at least
+    ``stride`` tokens (capped at half the window size), and windows are only cut between words, never inside one
+    (unless a single word exceeds the window size). Each window's core is the part of its text that is closer to its
+    own centre than to that of its neighbours; entities are only taken from a window's core.
+    """
+    if not text.strip():
+        return []
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    if not offsets:
+        return []
+
+    stride = min(stride, windowSize // 2)
+    tokenCount = len(offsets)
+    wordStart = [i == 0 or offsets[i][0] != offsets[i - 1][1] for i in range(tokenCount)]
+
+    def backToWordStart(index: int, lowerBound: int) -> int:
+        candidate = index
+        while candidate > lowerBound and not wordStart[candidate]:
+            candidate -= 1
+        return candidate if wordStart[candidate] else index
+
+    windows = []
+    start = 0
+    while True:
+        end = min(start + windowSize, tokenCount)
+        if end < tokenCount:
+            end = backToWordStart(end, start + 1)
+        windows.append(TextWindow(offsets[start][0], offsets[end - 1][1]))
+        if end >= tokenCount:
+            break
+        start = backToWordStart(max(end - stride, start + 1), start + 1)
+
+    windows[0].coreStart = 0
+    windows[-1].coreEnd = len(text)
+    for previous, current in zip(windows, windows[1:]):
+        boundary = (current.start + previous.end) // 2
+        previous.coreEnd = boundary
+        current.coreStart = boundary
+    return windows
+
+
+def __mergeEntities(entities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Sorts entities by position and removes duplicates, i.e. entities that overlap one that was already found. Of two
+    overlapping entities, the longer one is kept.
+    """
+    merged = []
+    for entity in sorted(entities, key=lambda e: (e["start"], -e["end"])):
+        if merged and entity["start"] < merged[-1]["end"]:
+            if entity["end"] - entity["start"] > merged[-1]["end"] - merged[-1]["start"]:
+                merged[-1] = entity
+            continue
+        merged.append(entity)
+    return merged
+
+
+def __batchedEntities(ner, texts: List[str], batchSize: int, windowSize: int,
+                      stride: int) -> List[List[Dict[str, Any]]]:
+    """
+    Runs the given pipeline over all windows of all texts at once and maps the entities back to the text they were
+    found in. Entity offsets are relative to the full text.
+    """
+    windows = []
+    owners = []
+    for index, text in enumerate(texts):
+        for window in __windows(text, ner.tokenizer, windowSize, stride):
+            windows.append(text[window.start:window.end])
+            owners.append((index, window))
+
+    entities = [[] for _ in texts]
+    if not windows:
+        return entities
+
+    for (index, window), found in zip(owners, ner(windows, batch_size=batchSize)):
+        for entity in found:
+            entity["start"] += window.start
+            entity["end"] += window.start
+            if window.coreStart <= entity["start"] < window.coreEnd:
+                entities[index].append(entity)
+    return [__mergeEntities(e) for e in entities]
+
+
+def findEntities(texts: List[str], batchSize: int = None, windowSize: int = None,
+                 stride: int = None) -> List[NlpResult]:
+    """
+    Runs both NER models in this process over the given texts, each split into overlapping windows that fit the models'
+    input size. Window size and stride (overlap) are given in model tokens and default to ``NER_WINDOW_SIZE`` and
+    ``NER_WINDOW_STRIDE``.
+
+    :return: one result per text, holding only the entities found
+    """
+    windowSize = windowSize or settings.NER_WINDOW_SIZE
+    stride = settings.NER_WINDOW_STRIDE if stride is None else stride
+    batchSize = batchSize or settings.NER_BATCH_SIZE
+    processed_ra = __batchedEntities(NER_HELPER.NER_RA, texts, batchSize, windowSize, stride)
+    processed_kb = __batchedEntities(NER_HELPER.NER_KB, texts, batchSize, windowSize, stride)
+
+    results = [NlpResult() for _ in texts]
+    for result, ra, kb in zip(results, processed_ra, processed_kb):
+        __collectEntities(ra, kb, result)
+    return results
+
+
+def __entities(texts: List[str], batchSize: int = None, windowSize: int = None,
+               stride: int = None) -> List[NlpResult]:
+    """
+    Sends the texts to the NER server if ``NER_SERVER_ADDRESS`` is set, otherwise (or if the server cannot be reached)
+    runs the models in this process.
+    """
+    if settings.NER_SERVER_ADDRESS:
+        from .server import NerClient, NerServerUnavailable
+        try:
+            return NerClient(settings.NER_SERVER_ADDRESS).findEntities(texts, batchSize, windowSize, stride)
+        except NerServerUnavailable as e:
+            logger.warning(f"NER server at {settings.NER_SERVER_ADDRESS} not available, running NER locally: {e}")
+    return findEntities(texts, batchSize, windowSize, stride)
+
+
+def filtered_entities(text: str, result: NlpResult, windowSize: int = None, stride: int = None,
+                      batchSize: int = None):
+    """
+    Runs both NER models over the text, split into overlapping windows that fit the models' input size, and adds the
+    entities found to the given result. Window size and stride (overlap) are given in model tokens and default to
+    ``NER_WINDOW_SIZE`` and ``NER_WINDOW_STRIDE``.
+    """
+    result.addEntities(__entities([text], batchSize, windowSize, stride)[0])
+
+
+def extractText(pagePath: Path) -> str:
     if pagePath.suffix == ".xml":
-        lines = extractTranscriptionsFromXml(pagePath)
+        lines = extractTranscription(pagePath, geometry=False).lines
     elif pagePath.suffix == ".txt":
         with pagePath.open("r") as inFile:
             lines = list(filter(None, inFile.read().splitlines()))
@@ -226,11 +407,43 @@ def processPage(pagePath: Path, normalise: bool = True) -> NlpResult:
     text = ""
     for line in lines:
         text += handleLinebreakChars(line)
-    result.text = text
+    return text
+
+
+def __prepare(pagePath: Path, normalise: bool) -> NlpResult:
+    result = NlpResult()
+    result.text = extractText(pagePath)
     if normalise:
-        result.normalised = normalize(text)
+        result.normalised = normalize(result.text)
     else:
-        result.normalised = text
+        result.normalised = result.text
+    return result
+
+
+def processPage(pagePath: Path, normalise: bool = True) -> NlpResult:
+    result = __prepare(pagePath, normalise)
     filtered_entities(result.normalised, result)
     result.removeDuplicates()
     return result
+
+
+def processPages(pagePaths: List[Path], normalise: bool = True, batchSize: int = None, windowSize: int = None,
+                 stride: int = None) -> List[NlpResult]:
+    """
+    Batched variant of ``processPage``: the (normalised) text of all given pages is split into windows of at most
+    ``windowSize`` tokens, which are passed through both NER pipelines in batches of ``batchSize``.
+
+    :param pagePaths: transcription files, may belong to one or several reports
+    :param normalise: whether spelling normalisation should be applied before NER
+    :param batchSize: number of windows per forward pass
+    :param windowSize: maximum number of model tokens per window, excluding special tokens
+    :param stride: number of tokens shared by consecutive windows of the same page
+    :return: one result per page, in the same order as ``pagePaths``
+    """
+    results = [__prepare(pagePath, normalise) for pagePath in pagePaths]
+    entities = __entities([result.normalised for result in results], batchSize, windowSize, stride)
+
+    for result, found in zip(results, entities):
+        result.addEntities(found)
+        result.removeDuplicates()
+    return results
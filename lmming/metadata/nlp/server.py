@@ -0,0 +1,151 @@
+import logging
+import queue
+import threading
+from dataclasses import dataclass, field, asdict
+from multiprocessing.connection import Listener, Client
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(settings.WORKER_LOG_NAME)
+
+
+class NerServerUnavailable(Exception):
+    pass
+
+
+def parseAddress(address: str):
+    """
+    Turns ``NER_SERVER_ADDRESS`` into an address usable by ``multiprocessing.connection``: ``host:port`` becomes a TCP
+    address, anything else (e.g. ``/run/lmming/ner.sock``) is taken as the path of a unix socket.
+    """
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def authKey() -> bytes:
+    return settings.SECRET_KEY.encode()
+
+
+class NerClient:
+    """
+    Sends texts to a running NER server and returns the entities found, in the same form as ``findEntities``.
+    """
+
+    def __init__(self, address: str):
+        self.address = parseAddress(address)
+
+    def findEntities(self, texts: List[str], batchSize: int = None, windowSize: int = None, stride: int = None):
+        from .ner import NlpResult
+
+        try:
+            with Client(self.address, authkey=authKey()) as connection:
+                connection.send({"texts": texts, "batchSize": batchSize, "windowSize": windowSize, "stride": stride})
+                response = connection.recv()
+        except (OSError, EOFError) as e:
+            raise NerServerUnavailable(str(e)) from e
+        if "error" in response:
+            raise RuntimeError(f"NER server failed: {response['error']}")
+        return [NlpResult(**result) for result in response["results"]]
+
+
+@dataclass
+class PendingRequest:
+    texts: List[str]
+    parameters: Tuple[Optional[int], Optional[int], Optional[int]]
+    done: threading.Event = field(default_factory=threading.Event)
+    results: List[dict] = field(default_factory=list)
+    error: str = ""
+
+
+class NerServer:
+    """
+    Owns a single copy of both NER pipelines and serves requests from all workers. Every connection is handled by its
+    own thread, while inference runs in one thread that collects the texts of all requests waiting at that moment (up
+    to ``maxTexts``) into a single batch.
+    """
+
+    def __init__(self, address: str, maxTexts: int = None):
+        self.address = parseAddress(address)
+        self.maxTexts = maxTexts or settings.NER_SERVER_MAX_TEXTS
+        self.pending = queue.Queue()
+        self.listener = None
+        self.stopped = threading.Event()
+
+    def serveForever(self):
+        from .ner import NER_HELPER
+
+        # load both models before accepting requests
+        NER_HELPER.NER_RA("")
+        NER_HELPER.NER_KB("")
+        threading.Thread(target=self.__inferenceLoop, daemon=True).start()
+
+        self.listener = Listener(self.address, authkey=authKey())
+        logger.info(f"NER server listening on {self.listener.address}")
+        while not self.stopped.is_set():
+            try:
+                connection = self.listener.accept()
+            except Exception as e:
+                if not self.stopped.is_set():
+                    logger.warning(f"NER server rejected a connection: {e}")
+                continue
+            threading.Thread(target=self.__handle, args=(connection,), daemon=True).start()
+
+    def shutdown(self):
+        self.stopped.set()
+        if self.listener:
+            self.listener.close()
+
+    def __handle(self, connection):
+        with connection:
+            try:
+                request = connection.recv()
+                pending = PendingRequest(request["texts"],
+                                         (request.get("batchSize"), request.get("windowSize"), request.get("stride")))
+                self.pending.put(pending)
+                pending.done.wait()
+                if pending.error:
+                    connection.send({"error": pending.error})
+                else:
+                    connection.send({"results": pending.results})
+            except (OSError, EOFError) as e:
+                logger.warning(f"NER server lost a connection: {e}")
+
+    def __nextBatch(self) -> List[PendingRequest]:
+        batch = [self.pending.get()]
+        textCount = len(batch[0].texts)
+        while textCount < self.maxTexts:
+            try:
+                request = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            textCount += len(request.texts)
+        return batch
+
+    def __inferenceLoop(self):
+        from .ner import findEntities
+
+        while True:
+            batch = self.__nextBatch()
+            # requests can only share a forward pass if they ask for the same windowing
+            groups = {}
+            for request in batch:
+                groups.setdefault(request.parameters, []).append(request)
+            for (batchSize, windowSize, stride), requests in groups.items():
+                texts = [text for request in requests for text in request.texts]
+                try:
+                    results = [asdict(result) for result in findEntities(texts, batchSize, windowSize, stride)]
+                except Exception as e:
+                    logger.exception("NER server failed to process a batch")
+                    results = None
+                    for request in requests:
+                        request.error = str(e)
+                offset = 0
+                for request in requests:
+                    if results is not None:
+                        request.results = results[offset:offset + len(request.texts)]
+                        offset += len(request.texts)
+                    request.done.set()
@@ -1,8 +1,3 @@
-import xml.etree.ElementTree as ET
-from pathlib import Path
-from typing import List
-
-
 def correction(entity):
     if len(entity) == 1:  # removes initials and single digits
         # (R): should this return an empty string? It would still evaluate to false on the outside but would allow this
@@ -59,43 +54,3 @@ def handleLinebreakChars(line: str) -> str:
             return line + " "
     else:
         return line + " "
-
-
-def __extractFromAlto__(root):
-    namespace = {"": root.tag.split("}")[0].strip("{")}
-    textLines = root.findall(".//TextLine", namespace)
-    lines = []
-    for tL in textLines:
-        content = []
-        for entry in tL:
-            if entry.tag.endswith("SP"):
-                content.append(" ")
-            elif entry.tag.endswith("String"):
-                content.append(entry.attrib["CONTENT"])
-        lines.append("".join(content))
-    return lines
-
-
-def __extractFromPage__(root):
-    namespace = {"": root.tag.replace("PcGts", "").strip("{}")}
-    textLines = root.findall(".//TextLine/TextEquiv/Unicode", namespace)
-    lines = []
-    for line in textLines:
-        text = line.text
-        if not text:
-            text = ""
-        lines.append(text)
-
-    return lines
-
-
-def extractTranscriptionsFromXml(xmlFile: Path) -> List[str]:
-    root = ET.parse(xmlFile).getroot()
-    rootTag = root.tag
-    if "alto" in rootTag:
-        return __extractFromAlto__(root)
-    elif "PcGts" in rootTag:
-        return __extractFromPage__(root)
-    else:
-        # log issue
-        return []
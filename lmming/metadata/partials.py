@@ -1,23 +1,27 @@
+import json
+import re
 from copy import deepcopy
-from datetime import datetime
 from typing import List
 
 import pandas as pd
 from django.conf import settings
+from django.contrib import messages
 from django.db.models import Q
 from django.forms import formset_factory
-from django.http import QueryDict, HttpResponse, HttpResponseRedirect
+from django.http import QueryDict, HttpResponse, HttpResponseRedirect, JsonResponse, HttpResponseNotAllowed
 from django.shortcuts import render, get_object_or_404, redirect, resolve_url
 from django.urls import reverse
+from django.views.decorators.http import require_POST, require_GET
 
+from metadata import uploads
 from metadata.forms.shared import ExtractionTransferDetailForm, SettingsForm, ExternalRecordsSettingsForm, \
-    ProcessingStepForm, TransferImportForm
-from metadata.models import ExtractionTransfer, Report, Page, Status, Job, ProcessingStep, DefaultValueSettings, \
-    DefaultNumberSettings, ReportTranslation, Pipeline
+    ProcessingStepForm, TransferImportForm, TransferUploadForm, ZipForm
+from metadata.ingest import ingestTransfer, ingestZipTransfer, importOmekaTransfer
+from metadata.models import ExtractionTransfer, Status, Job, ProcessingStep, DefaultValueSettings, \
+    DefaultNumberSettings, Pipeline, deferredStatusUpdates, TransferUpload, UploadedFile
 from metadata.pipeline_views.fac import bulkFacManual
 from metadata.tasks.manage import restartTask, scheduleTask
-from metadata.utils import parseFilename, buildReportIdentifier, updateExternalRecords, buildProcessingSteps, \
-    getStructureFromStructMap, parseUnionId
+from metadata.utils import updateExternalRecords, getStructureFromStructMap
 
 FAC_PROCESSING_STEP_INITIAL = [{"label": ProcessingStep.ProcessingStepType.FILENAME,
                                 "tooltip": "Extracts 'date' and 'type' information, as well as the organisation's id, "
@@ -143,8 +147,9 @@ def batchRestart(request):
     if not step:
         return redirect("metadata:batch_run_table")
 
-    for job in Job.objects.filter(transfer__id__in=ids):
-        restartTask(job.pk, ProcessingStep.ProcessingStepType[step.upper()])
+    with deferredStatusUpdates():
+        for job in Job.objects.filter(transfer__id__in=ids):
+            restartTask(job.pk, ProcessingStep.ProcessingStepType[step.upper()])
 
     if mode == "arab":
         redirectTo = resolve_url("metadata:arab_index")
@@ -166,15 +171,6 @@ def batchDeleteModal(request):
                   {"ids": result, "jobs": (ExtractionTransfer.objects.filter(id__in=ids))})
 
 
-def batchDownloadRedirect(request):
-    # redirect is needed so that HTMX + file download work properly
-    ids = request.GET.getlist('ids')
-    response = HttpResponse()
-    redirectTo = resolve_url("metadata:transfer_batch_export")
-    response["HX-Redirect"] = f"{redirectTo}?ids={'&ids='.join(ids)}"
-    return response
-
-
 def deleteModal(request, transfer_id):
     transfer = get_object_or_404(ExtractionTransfer, pk=transfer_id)
     return render(request, "modal/delete_transfer.html", {"transfer": transfer})
@@ -272,88 +268,125 @@ def verifyTransfer(request, transfer_id):
     return render(request, "partial/verify_transfer.html", {"transfer": transferInstance})
 
 
-def createTransfer(request):
-    mode = request.GET.get("mode", request.POST.get("mode"))
-
-    detailform = ExtractionTransferDetailForm()
-    StepFormSet = formset_factory(ProcessingStepForm, extra=0)
-
+def __pipelineSteps(mode: str):
     if mode == "arab":
-        initial = deepcopy(ARAB_OTHER_PROCESSING_STEP_INITIAL)
-        pipeline = Pipeline.ARAB_OTHER
+        return deepcopy(ARAB_OTHER_PROCESSING_STEP_INITIAL), Pipeline.ARAB_OTHER
+    elif settings.ARCHIVE_INST == "FAC":
+        return deepcopy(FAC_PROCESSING_STEP_INITIAL), Pipeline.FAC
     else:
-        if settings.ARCHIVE_INST == "FAC":
-            initial = deepcopy(FAC_PROCESSING_STEP_INITIAL)
-            pipeline = Pipeline.FAC
-        else:
-            initial = deepcopy(ARAB_PROCESSING_STEP_INITIAL)
-            pipeline = Pipeline.ARAB_LM
+        return deepcopy(ARAB_PROCESSING_STEP_INITIAL), Pipeline.ARAB_LM
 
-    if request.method == 'POST':
-        detailform = ExtractionTransferDetailForm(request.POST, request.FILES)
-        stepForm = StepFormSet(request.POST, initial=initial)
 
-        if detailform.is_valid() and stepForm.is_valid():
-            collectionName = detailform.cleaned_data['processName']
-            handlerName = detailform.cleaned_data["handlerName"]
-            transferInstance = ExtractionTransfer.objects.create(name=collectionName,
-                                                                 status=Status.AWAITING_HUMAN_VALIDATION,
-                                                                 pipeline=pipeline, handler=handlerName)
-            transcriptionFiles = detailform.cleaned_data["file_field"]
-            pagesToReports = {}
-            for file in transcriptionFiles:
-                originalFilename = str(file)
-                try:
-                    data = parseFilename(originalFilename)
-                    data["file"] = file
-                    reportIdentifier = buildReportIdentifier(data)
-                    if reportIdentifier not in pagesToReports:
-                        pagesToReports[reportIdentifier] = []
-
-                    pagesToReports[reportIdentifier].append(data)
-                except SyntaxError as _e:
-                    # TODO
-                    pass
-
-            for reportIdentifier in pagesToReports:
-                pages = pagesToReports[reportIdentifier]
-                unionId = set(p["union_id"] for p in pages).pop()  # TODO: can there be multiple?
-                reportType = list(set(p["type"] for p in pages))
-                typeName = set(p["typeName"] for p in pages).pop()
-
-                dates = set()
-                for p in pages:
-                    dates.update(p["date"])
-                dateList = sorted(list(dates))
-
-                if mode == "arab":
-                    r = Report.objects.create(transfer=transferInstance, unionId=unionId, type=reportType,
-                                              date=dateList, type_other=typeName, publisher="SE/ARAB")
-                else:
-                    if settings.ARCHIVE_INST == "FAC":
-                        r = Report.objects.create(transfer=transferInstance, unionId=unionId, type=reportType,
-                                                  date=dateList)
-                    else:
-                        r = Report.objects.create(transfer=transferInstance, unionId=unionId, date=dateList)
-                Page.objects.bulk_create([Page(report=r, order=int(page["page"]), transcriptionFile=page["file"],
-                                               originalFileName=page["file"]) for page in pages])
+def __stepConfig(stepForm) -> List[dict]:
+    config = []
+    for f in stepForm:
+        config.append({"stepType": f.label, "mode": f.cleaned_data["mode"],
+                       "humanValidation": f.cleaned_data["humanValidation"]})
+    return config
 
-                j = Job.objects.create(transfer=transferInstance, report=r)
 
-                config = []
-                for f in stepForm:
-                    config.append({"stepType": f.label, "mode": f.cleaned_data["mode"],
-                                   "humanValidation": f.cleaned_data["humanValidation"]})
+def createTransfer(request):
+    mode = request.GET.get("mode", request.POST.get("mode"))
+    # "zip": the transcription files are uploaded as one or more ZIP archives
+    source = request.GET.get("source", "")
 
-                buildProcessingSteps(config, j)
-                r.job = j
-                r.save()
+    if source == "zip":
+        detailform, zipform = TransferUploadForm(), ZipForm()
+    else:
+        detailform, zipform = ExtractionTransferDetailForm(), None
+    StepFormSet = formset_factory(ProcessingStepForm, extra=0)
+    initial, pipeline = __pipelineSteps(mode)
 
+    if request.method == 'POST':
+        stepForm = StepFormSet(request.POST, initial=initial)
+        if zipform is not None:
+            detailform, zipform = TransferUploadForm(request.POST), ZipForm(request.POST, request.FILES)
+            filesValid = zipform.is_valid()
+        else:
+            detailform = ExtractionTransferDetailForm(request.POST, request.FILES)
+            filesValid = True
+
+        if detailform.is_valid() and filesValid and stepForm.is_valid():
+            if zipform is not None:
+                transferInstance, skipped = ingestZipTransfer(detailform.cleaned_data['processName'],
+                                                              detailform.cleaned_data["handlerName"], pipeline,
+                                                              zipform.cleaned_data["zipFile"], __stepConfig(stepForm))
+                if skipped:
+                    messages.warning(request, f"Skipped {len(skipped)} file(s) with unexpected names: "
+                                              f"{', '.join(skipped)}")
+            else:
+                transferInstance = ingestTransfer(detailform.cleaned_data['processName'],
+                                                  detailform.cleaned_data["handlerName"], pipeline,
+                                                  detailform.cleaned_data["file_field"], __stepConfig(stepForm))
             return redirect("metadata:verify_transfer", transfer_id=transferInstance.pk)
 
     stepForm = StepFormSet(initial=initial)
-    return render(request, 'partial/create_transfer.html', {"detailform": detailform,
-                                                            "steps": stepForm, "mode": mode})
+    return render(request, 'partial/create_transfer.html', {"detailform": detailform, "zipform": zipform,
+                                                            "steps": stepForm, "mode": mode, "source": source,
+                                                            "chunkSize": settings.UPLOAD_CHUNK_SIZE})
+
+
+@require_POST
+def uploadStart(request):
+    """
+    Starts a chunked upload (see ``uploads``) for the transfer described by the form fields and the JSON list of
+    ``{"name": ..., "size": ...}`` objects in ``files``.
+    """
+    mode = request.GET.get("mode", request.POST.get("mode"))
+    initial, pipeline = __pipelineSteps(mode)
+    detailform = TransferUploadForm(request.POST)
+    stepForm = formset_factory(ProcessingStepForm, extra=0)(request.POST, initial=initial)
+    try:
+        files = [(str(f["name"]), int(f["size"])) for f in json.loads(request.POST.get("files", ""))]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": "invalid list of files"}, status=400)
+    if not detailform.is_valid() or not stepForm.is_valid():
+        return JsonResponse({"error": "invalid form", "errors": detailform.errors}, status=400)
+
+    upload = uploads.startUpload(detailform.cleaned_data["processName"], detailform.cleaned_data["handlerName"],
+                                 pipeline, __stepConfig(stepForm))
+    rejected = uploads.addFiles(upload, files)
+    return JsonResponse(dict(uploads.uploadProgress(upload), rejected=rejected))
+
+
+@require_GET
+def uploadStatus(request, upload_id):
+    return JsonResponse(uploads.uploadProgress(get_object_or_404(TransferUpload, pk=upload_id)))
+
+
+def uploadChunk(request, upload_id):
+    """
+    Stores the request body (``Content-Range: bytes <start>-<end>/<size>``) as part of the file ``name``, without
+    reading it into memory. A chunk that does not continue the data received so far is refused with 409 and the
+    expected offset.
+    """
+    if request.method != "PUT":
+        return HttpResponseNotAllowed(["PUT"])
+    upload = get_object_or_404(TransferUpload, pk=upload_id, transfer=None)
+    contentRange = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+)", request.headers.get("Content-Range", "").strip())
+    if not contentRange:
+        return JsonResponse({"error": "missing Content-Range"}, status=400)
+
+    start, end, _size = map(int, contentRange.groups())
+    try:
+        received = uploads.writeChunk(upload, request.GET.get("name", ""), start, end - start + 1, request)
+    except UploadedFile.DoesNotExist:
+        return JsonResponse({"error": "unknown file"}, status=404)
+    except uploads.UploadConflict as e:
+        return JsonResponse({"error": str(e), "received": e.received}, status=409)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"received": received})
+
+
+@require_POST
+def uploadFinish(request, upload_id):
+    upload = get_object_or_404(TransferUpload, pk=upload_id)
+    try:
+        transferInstance = uploads.finishUpload(upload)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=409)
+    return JsonResponse({"redirect": reverse("metadata:verify_transfer", args=[transferInstance.pk])})
 
 
 def awaitingHumanInteraction(request):
@@ -434,10 +467,6 @@ def bulkEditJobs(request, step: str, jobs: str):
         return HttpResponseRedirect(reverse('metadata:waiting_jobs'))
 
 
-def __splitAndStrip(text: str) -> List[str]:
-    return [x.strip() for x in text.split("|")]
-
-
 def importTransfer(request):
     importForm = TransferImportForm()
 
@@ -453,139 +482,22 @@ def importTransfer(request):
     if request.method == 'POST':
         importForm = TransferImportForm(request.POST, request.FILES)
 
-        errors = []
-
         if importForm.is_valid():
-            transferName = importForm.cleaned_data["processName"]
-            handlerName = importForm.cleaned_data["handler"]
-            transferInstance = ExtractionTransfer.objects.create(name=transferName, status=Status.COMPLETE,
-                                                                 handler=handlerName, pipeline=pipeline)
-
-            itemsFile = importForm.cleaned_data["itemsFile"]
-            mediaFile = importForm.cleaned_data["mediaFile"]
-            structMapFile = importForm.cleaned_data["structMapFile"]
-
-            structure = getStructureFromStructMap(structMapFile)
-            reportData = pd.read_csv(itemsFile, dtype=str, keep_default_na=False)
-            mediaData = pd.read_csv(mediaFile, dtype=str, keep_default_na=False)
-            if "dcterms:source" not in mediaData.columns:
-                mediaData["dcterms:source"] = ""
-            if "dcterms:bibliographicCitation" not in mediaData.columns:
-                mediaData["dcterms:bibliographicCitation"] = ""
-
-            transcriptionFiles = importForm.cleaned_data["transcriptionFiles"]
-            files = {str(f): f for f in transcriptionFiles}
-
-            for reportId in structure:
-                rows = reportData[reportData["dcterms:identifier"].str.contains(reportId)]
-                if len(rows) == 0:
-                    errors.append(f"No entry for report ID {reportId} in items.csv")
-                    continue
-                reportRow = rows.iloc[0]
-                unionId = parseUnionId(structure[reportId]["pages"][0]["filename"])
-
-                coverage = [x for x in Report.UnionLevel if x.label == reportRow["dcterms:coverage"]][0]
-                docType = [x for x in Report.DocumentType if x.label in reportRow["dcterms:type"]]
-                isFormatOf = [x for x in Report.DocumentFormat if x.label in reportRow["dcterms:isFormatOf"]]
-                accessRights = [x for x in Report.AccessRights if x.label == reportRow["dcterms:accessRights"]][0]
-                dateString = reportRow["dcterms:date"]
-                if "/" in dateString:
-                    date = [datetime(int(x), 1, 1) for x in dateString.split("/")]
-                else:
-                    date = []
-                    ds = dateString.split("|")
-                    for d in ds:
-                        if "--" in d:
-                            dateRange = d.split("--")
-                            start = int(dateRange[0].strip())
-                            end = int(dateRange[1].strip())
-                            for year in range(start, end + 1):
-                                date.append(datetime(year, 1, 1))
-                        else:
-                            date.append(datetime(int(d.strip()), 1, 1))
-
-                available = datetime.strptime(reportRow["dcterms:available"], '%Y-%m-%d')
-                created = datetime(int(reportRow["dcterms:created"]), 1, 1)
-
-                r = Report.objects.create(transfer=transferInstance, unionId=unionId, noid=reportId, date=date,
-                                          description=reportRow["dcterms:description"], created=created,
-                                          title=reportRow["dcterms:title"].strip(), available=available,
-                                          creator=reportRow["dcterms:creator"].strip(),
-                                          language=__splitAndStrip(reportRow["dcterms:language"]),
-                                          spatial=__splitAndStrip(reportRow["dcterms:spatial"]),
-                                          license=__splitAndStrip(reportRow["dcterms:license"]),
-                                          isVersionOf=reportRow["dcterms:isVersionOf"].strip(),
-                                          accessRights=accessRights,
-                                          identifier=reportRow["dcterms:identifier"].strip(), isFormatOf=isFormatOf,
-                                          source=__splitAndStrip(reportRow["dcterms:source"]), type=docType,
-                                          relation=__splitAndStrip(reportRow["dcterms:relation"]), coverage=coverage)
-
-                if "." in "".join(reportRow.index.to_list()):
-                    sortedTranslations = {}
-
-                    for colName in reportRow.index.to_list():
-                        if "." in colName:
-                            s = colName.split(".")
-                            language = s[-1]
-                            if language not in sortedTranslations:
-                                sortedTranslations[language] = {}
-                            key = s[0].split(":")[-1]
-                            sortedTranslations[language][key] = reportRow[colName]
-
-                    for language in sortedTranslations:
-                        ReportTranslation.objects.create(report=r, language=language,
-                                                         coverage=sortedTranslations[language]["coverage"].strip(),
-                                                         isFormatOf=__splitAndStrip(
-                                                             sortedTranslations[language]["isFormatOf"]),
-                                                         type=__splitAndStrip(sortedTranslations[language]["type"]),
-                                                         accessRights=sortedTranslations[language][
-                                                             "accessRights"].strip(),
-                                                         description=sortedTranslations[language][
-                                                             "description"].strip())
-
-                for pageData in structure[reportId]["pages"]:
-                    pageId = pageData["id"]
-                    filename = pageData["filename"]
-                    order = pageData["order"]
-                    pageRows = mediaData[mediaData["dcterms:identifier"].str.contains(pageId)]
-                    if len(pageRows) == 0:
-                        errors.append(f"No entry for report ID {pageId} in media.csv")
-                        continue
-                    pageRow = pageRows.iloc[0]
-
-                    persons = __splitAndStrip(pageRow["lm:person"])
-                    organisations = __splitAndStrip(pageRow["lm:organisation"])
-                    location = __splitAndStrip(pageRow["lm:location"])
-                    times = __splitAndStrip(pageRow["lm:time"])
-                    works = __splitAndStrip(pageRow["lm:work"])
-                    events = __splitAndStrip(pageRow["lm:event"])
-                    ner_objects = __splitAndStrip(pageRow["lm:object"])
-                    measure = True if pageRow["lm:measure"].lower() == "true" else False
-
-                    Page.objects.create(report=r, order=int(order), transcriptionFile=files[filename],
-                                        originalFileName=filename,
-                                        identifier=pageRow["dcterms:identifier"].strip(),
-                                        transcription=pageRow["lm:transcription"].strip(),
-                                        normalisedTranscription=pageRow["lm:normalised"].strip(), persons=persons,
-                                        organisations=organisations, locations=location, times=times, works=works,
-                                        events=events, ner_objects=ner_objects, measures=measure, iiifId=pageId,
-                                        source=pageRow["dcterms:source"],
-                                        bibCitation=pageRow["dcterms:bibliographicCitation"])
-
-                # Page.objects.bulk_create([Page(report=r, order=int(page["page"]), transcriptionFile=page["file"],
-                #                                originalFileName=page["file"]) for page in pages])
-
-                if settings.ARCHIVE_INST == "FAC":
-                    config = [{"stepType": f["label"], "mode": f["mode"], "humanValidation": False,
-                               "status": Status.COMPLETE} for f in FAC_PROCESSING_STEP_INITIAL]
-                else:
-                    config = [{"stepType": f["label"], "mode": f["mode"], "humanValidation": False,
-                               "status": Status.COMPLETE} for f in ARAB_PROCESSING_STEP_INITIAL]
-
-                j = Job.objects.create(transfer=transferInstance, report=r)
-                buildProcessingSteps(config, j)
-                r.job = j
-                r.save()
+            structure = getStructureFromStructMap(importForm.cleaned_data["structMapFile"])
+            reportData = pd.read_csv(importForm.cleaned_data["itemsFile"], dtype=str, keep_default_na=False)
+            mediaData = pd.read_csv(importForm.cleaned_data["mediaFile"], dtype=str, keep_default_na=False)
+            files = {str(f): f for f in importForm.cleaned_data["transcriptionFiles"]}
+
+            if settings.ARCHIVE_INST == "FAC":
+                config = [{"stepType": f["label"], "mode": f["mode"], "humanValidation": False,
+                           "status": Status.COMPLETE} for f in FAC_PROCESSING_STEP_INITIAL]
+            else:
+                config = [{"stepType": f["label"], "mode": f["mode"], "humanValidation": False,
+                           "status": Status.COMPLETE} for f in ARAB_PROCESSING_STEP_INITIAL]
+
+            transferInstance, errors = importOmekaTransfer(importForm.cleaned_data["processName"],
+                                                           importForm.cleaned_data["handlerName"], pipeline,
+                                                           structure, reportData, mediaData, files, config)
 
             # TODO: error handling
 
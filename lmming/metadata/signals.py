@@ -0,0 +1,12 @@
+from pathlib import Path
+
+from metadata.xml_utils import convertedAltoFiles
+
+
+# noinspection PyUnusedLocal
+def pageFileDeleteHandler(sender, instance, **_kwargs):
+    # connected in MetadataConfig.ready, so that the models do not depend on the ALTO conversion
+    if instance.transcriptionFile:
+        for converted in convertedAltoFiles(Path(instance.transcriptionFile.path)):
+            converted.unlink(missing_ok=True)
+    instance.transcriptionFile.delete(save=False)
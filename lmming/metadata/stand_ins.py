@@ -0,0 +1,157 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import sleep
+from urllib.parse import urlsplit, parse_qs
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Base class of the local stand-ins for the external services, serving on a random port in a background thread.
+    Every request waits ``latency`` seconds to mimic the round trip to the real service.
+    """
+    daemon_threads = True
+
+    def __init__(self, handlerClass, latency: float = 0):
+        super().__init__(("127.0.0.1", 0), handlerClass)
+        self.latency = latency
+        self.requests = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def address(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1  # sends the headers and the body of a response together
+
+    def log_message(self, *args):
+        pass
+
+    def body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def respond(self, status: int, content=None):
+        data = json.dumps(content if content is not None else {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def parse_request(self):
+        parsed = super().parse_request()
+        if parsed:
+            with self.server.lock:
+                self.server.requests.append((self.command, self.path))
+            sleep(self.server.latency)
+        return parsed
+
+
+class HandleRequestHandler(StandInHandler):
+
+    def do_POST(self):
+        if self.path == "/api/sessions":
+            with self.server.lock:
+                self.server.sessionCount += 1
+                sessionId = f"session{self.server.sessionCount}"
+                self.server.sessions.add(sessionId)
+            self.respond(201, {"sessionId": sessionId, "nonce": "c2VydmVybm9uY2U="})
+        elif self.path == "/api/sessions/this":
+            self.respond(200, {"authenticated": True})
+        else:
+            self.respond(404)
+
+    def do_GET(self):
+        handle = self.path.removeprefix("/api/handles/")
+        if handle in self.server.handles:
+            self.respond(200, {"responseCode": 1, "handle": handle, "values": self.server.handles[handle]})
+        else:
+            self.respond(404, {"responseCode": 100})
+
+    def do_PUT(self):
+        url = urlsplit(self.path)
+        handle = url.path.removeprefix("/api/handles/")
+        record = self.body()
+        sessionId = self.headers.get("Authorization", "").split('"')[1]
+        if sessionId not in self.server.sessions:
+            self.respond(401, {"responseCode": 402})
+            return
+        with self.server.lock:
+            if handle in self.server.handles and parse_qs(url.query).get("overwrite") == ["false"]:
+                self.respond(409, {"responseCode": 101, "handle": handle})
+                return
+            self.server.handles[handle] = record["values"]
+        self.respond(200, {"responseCode": 1, "handle": handle})
+
+
+class HandleServer(StandInServer):
+    """
+    Stand-in for the Handle.net REST API: sessions are accepted without checking signatures, handles are kept in
+    ``handles`` by ``prefix/noid``. Like the real server, handles that exist are only overwritten if the request does
+    not ask for ``overwrite=false``.
+    """
+
+    def __init__(self, latency: float = 0, handles: dict = None):
+        super().__init__(HandleRequestHandler, latency)
+        self.handles = dict(handles or {})
+        self.sessions = set()
+        self.sessionCount = 0
+
+
+class ArkletRequestHandler(StandInHandler):
+
+    def authorised(self) -> bool:
+        if self.headers.get("Authorization") != f"Bearer {self.server.token}":
+            self.respond(403)
+            return False
+        return True
+
+    def do_POST(self):
+        if self.path != "/mint":
+            self.respond(404)
+        elif self.authorised():
+            body = self.body()
+            with self.server.lock:
+                self.server.mintCount += 1
+                ark = f"ark:/{body['naan']}/{body['shoulder'].strip('/')}{self.server.mintCount}"
+                self.server.arks[ark] = body
+            self.respond(200, {"ark": ark})
+
+    def do_PUT(self):
+        if self.path != "/update":
+            self.respond(404)
+        elif self.authorised():
+            body = self.body()
+            with self.server.lock:
+                if body["ark"] in self.server.failing:
+                    self.respond(409)
+                    return
+                self.server.arks[body["ark"]] = body
+            self.respond(200)
+
+
+class ArkletServer(StandInServer):
+    """
+    Stand-in for Arklet: minted ARKs are numbered per server, and the last details sent for every ARK are kept in
+    ``arks``. Updates of the ARKs in ``failing`` are rejected.
+    """
+
+    def __init__(self, latency: float = 0, token: str = "auth", failing=()):
+        super().__init__(ArkletRequestHandler, latency)
+        self.token = token
+        self.failing = set(failing)
+        self.arks = {}
+        self.mintCount = 0
@@ -69,3 +69,91 @@ function batchChange(){
     }
 };
 
+
+// Uploads the files of the "create transfer" form in chunks (see partials.uploadStart), so that transfers are not
+// limited by the size of a single request. Interrupted chunks are retried from the offset the server has received, and
+// an upload of the same files can be resumed after reloading the page.
+async function chunkedUpload(form) {
+    const files = Array.from(form.querySelector("input[type=file]").files);
+    const chunkSize = parseInt(form.dataset.chunkSize);
+    const csrfToken = form.querySelector("[name=csrfmiddlewaretoken]").value;
+    const manifest = JSON.stringify(files.map(f => ({name: f.name, size: f.size})));
+    const storageKey = "upload:" + manifest;
+    const progressBar = form.querySelector("#uploadProgress .progress-bar");
+    const statusText = form.querySelector("#uploadStatus");
+
+    async function request(url, options) {
+        options.headers = Object.assign({"X-CSRFToken": csrfToken}, options.headers || {});
+        for (let attempt = 0; ; attempt++) {
+            try {
+                return await fetch(url, options);
+            } catch (error) {
+                if (attempt >= 5) throw error;
+                await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+            }
+        }
+    }
+
+    let progress = null;
+    const previous = localStorage.getItem(storageKey);
+    if (previous) {
+        const response = await request(previous, {method: "GET"});
+        if (response.ok) progress = await response.json();
+    }
+    if (!progress || progress.transfer) {
+        const data = new FormData(form);
+        data.delete(form.querySelector("input[type=file]").name);
+        data.set("files", manifest);
+        const response = await request(form.dataset.uploadUrl, {method: "POST", body: data});
+        progress = await response.json();
+        if (!response.ok) throw new Error(progress.error);
+        if (progress.rejected.length) {
+            statusText.textContent = "Skipped files with unexpected names: " + progress.rejected.join(", ");
+        }
+    }
+    const statusUrl = form.dataset.uploadUrl.split("?")[0] + "/" + progress.upload;
+    localStorage.setItem(storageKey, statusUrl);
+
+    let received = progress.received;
+    const update = () => progressBar.style.width = (progress.size ? 100 * received / progress.size : 100) + "%";
+    update();
+    for (const file of files) {
+        const state = progress.files[file.name];
+        if (!state) continue;
+        let offset = state.received;
+        while (offset < file.size) {
+            const end = Math.min(offset + chunkSize, file.size);
+            const response = await request(statusUrl + "/chunk?name=" + encodeURIComponent(file.name), {
+                method: "PUT", body: file.slice(offset, end),
+                headers: {"Content-Type": "application/octet-stream",
+                          "Content-Range": `bytes ${offset}-${end - 1}/${file.size}`}
+            });
+            const result = await response.json();
+            if (!response.ok && response.status !== 409) throw new Error(result.error);
+            received += result.received - offset;
+            offset = result.received;
+            update();
+        }
+    }
+
+    const response = await request(statusUrl + "/finish", {method: "POST"});
+    const result = await response.json();
+    if (!response.ok) throw new Error(result.error);
+    localStorage.removeItem(storageKey);
+    window.location = result.redirect;
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+    const form = document.getElementById("createTransferForm");
+    if (!form || !window.fetch) return;
+    form.addEventListener("submit", event => {
+        event.preventDefault();
+        const button = form.querySelector("[type=submit]");
+        button.disabled = true;
+        form.querySelector("#uploadProgress").style.display = "";
+        chunkedUpload(form).catch(error => {
+            form.querySelector("#uploadStatus").textContent = "Upload interrupted, submit again to resume: " + error.message;
+            button.disabled = false;
+        });
+    });
+});
@@ -1,6 +1,5 @@
 import datetime
 import logging
-import secrets
 
 from celery import shared_task
 from dateutil.relativedelta import relativedelta
@@ -9,15 +8,14 @@ from django.conf import settings
 from metadata.i18n import SWEDISH
 from metadata.models import ProcessingStep, Status, Report, DefaultNumberSettings, DefaultValueSettings, \
     ReportTranslation
-from metadata.tasks.utils import resumePipeline, HandleAdapter, HandleError, HandleLocation
+from metadata.tasks.minting import mintPageHandles, mintPlainHandle, scheduleRefill, handleNamespace, \
+    refillHandleNoids
+from metadata.tasks.utils import resumePipeline, HandleAdapter, HandleError
 from metadata.tasks.utils import splitIfNotNone
 from metadata.utils import formatDateString
 
 logger = logging.getLogger(settings.WORKER_LOG_NAME)
 
-BETANUMERIC = "0123456789bcdfghjkmnpqrstvwxz"
-BETA = "bcdfghjkmnpqrstvwxz"
-
 
 @shared_task()
 def arabComputeFromExistingFields(jobPk: int, pipeline: bool = True):
@@ -128,32 +126,17 @@ def arabMintHandle(jobPk: int, pipeline: bool = True):
             step.save()
             return
     else:
-        retries = 0
-        while retries < settings.ARAB_RETRIES:
-            try:
-                # OBS: xml:IDs may not start with a digit!
-                noid = "".join([secrets.choice(BETA)] + [secrets.choice(BETANUMERIC) for _ in range(14)])
-                if handleAdapter.doesHandleAlreadyExist(noid):
-                    retries += 1
-                    continue
-
-                handle = handleAdapter.createPlainHandle(noid, iiifBase + f"iiif/presentation/{noid}/manifest")
-
-                if handle:
-                    report.noid = noid
-                    report.identifier = f"https://hdl.handle.net/{handle}"
-                    report.save()
-                    break
-            except HandleError as handleError:
-                step.log = handleError.userMessage
-                logger.warning(handleError.adminMessage)
-                step.status = Status.ERROR
-                step.save()
-                return
-        else:
-            step.log = f"Could not generate unique handle. Made {retries} attempt(s)."
+        try:
+            handle = mintPlainHandle(handleAdapter, report, "noid", iiifBase + "iiif/presentation/{}/manifest",
+                                     settings.ARAB_RETRIES)
+            report.identifier = f"https://hdl.handle.net/{handle}"
+            report.save()
+        except HandleError as handleError:
+            step.log = handleError.userMessage
+            logger.warning(handleError.adminMessage)
             step.status = Status.ERROR
             step.save()
+            return
 
     viewerLink = viewerHandle + "?urlappend=?manifest=" + iiifBase + f"iiif/presentation/{report.noid}/manifest"
 
@@ -169,95 +152,34 @@ def arabMintHandle(jobPk: int, pipeline: bool = True):
             step.save()
             return
     else:
-        retries = 0
-        while retries < settings.ARAB_RETRIES:
-            try:
-                # OBS: xml:IDs may not start with a digit!
-                referencesNoid = "".join([secrets.choice(BETA)] + [secrets.choice(BETANUMERIC) for _ in range(14)])
-                if handleAdapter.doesHandleAlreadyExist(referencesNoid):
-                    retries += 1
-                    continue
-
-                handle = handleAdapter.createPlainHandle(referencesNoid, viewerLink)
-
-                if handle:
-                    report.referencesNoid = referencesNoid
-                    report.references = f"https://hdl.handle.net/{handle}"
-                    report.save()
-                    break
-            except HandleError as handleError:
-                step.log = handleError.userMessage
-                logger.warning(handleError.adminMessage)
-                step.status = Status.ERROR
-                step.save()
-                return
-        else:
-            step.log = f"Could not generate unique handle. Made {retries} attempt(s)."
+        try:
+            handle = mintPlainHandle(handleAdapter, report, "referencesNoid", viewerLink, settings.ARAB_RETRIES)
+            report.references = f"https://hdl.handle.net/{handle}"
+            report.save()
+        except HandleError as handleError:
+            step.log = handleError.userMessage
+            logger.warning(handleError.adminMessage)
             step.status = Status.ERROR
             step.save()
+            return
 
     bibCitationBase = f"{report.title} (SE/ARAB/{report.unionId}) "
 
-    for page in report.page_set.all():
-        if page.noid:
-            resolveToBase = iiifBase + f"iiif/image/{page.noid}"
-
-            locations = [HandleLocation(1, resolveToBase + "/info.json"),
-                         HandleLocation(0, resolveToBase + "/full/full/0/default.jpg", "jpgfull"),
-                         HandleLocation(0, resolveToBase + "/info.json", "manifest")]
-
-            try:
-                handle = handleAdapter.updateLocationBasedHandle(page.noid, locations)
-
-                page.iiifId = page.noid
-                page.identifier = f"https://hdl.handle.net/{handle}?locatt=view:manifest"
-                sourceUrl = f"https://hdl.handle.net/{handle}?locatt=view:jpgfull"
-                page.source = f"{sourceUrl} Direct link to image"
-                page.bibCitation = bibCitationBase + f"({sourceUrl})"
-                page.save()
-            except HandleError as handleError:
-                step.log = handleError.userMessage
-                logger.warning(handleError.adminMessage)
-                step.status = Status.ERROR
-                step.save()
-                return
-        else:
-            retries = 0
-            while retries < settings.ARAB_RETRIES:
-                try:
-                    # OBS: xml:IDs may not start with a digit!
-                    noid = "".join([secrets.choice(BETA)] + [secrets.choice(BETANUMERIC) for _ in range(14)])
-                    if handleAdapter.doesHandleAlreadyExist(noid):
-                        retries += 1
-                        continue
-
-                    page.noid = noid
-
-                    resolveToBase = iiifBase + f"iiif/image/{page.noid}"
-
-                    locations = [HandleLocation(1, resolveToBase + "/info.json"),
-                                 HandleLocation(0, resolveToBase + "/full/full/0/default.jpg", "jpgfull"),
-                                 HandleLocation(0, resolveToBase + "/info.json", "manifest")]
-
-                    handle = handleAdapter.updateLocationBasedHandle(page.noid, locations)
-                    page.iiifId = page.noid
-                    page.identifier = f"https://hdl.handle.net/{handle}?locatt=view:manifest"
-                    sourceUrl = f"https://hdl.handle.net/{handle}?locatt=view:jpgfull"
-                    page.source = f"{sourceUrl} Direct link to image"
-
-                    page.bibCitation = bibCitationBase + f"({sourceUrl})"
-                    page.save()
-                    break
-                except HandleError as handleError:
-                    step.log = handleError.userMessage
-                    logger.warning(handleError.adminMessage)
-                    step.status = Status.ERROR
-                    step.save()
-                    return
-            else:
-                step.log = f"Could not generate unique handle. Made {retries} attempt(s)."
-                step.status = Status.ERROR
-                step.save()
+    def describe(page, handle):
+        sourceUrl = f"https://hdl.handle.net/{handle}?locatt=view:jpgfull"
+        page.source = f"{sourceUrl} Direct link to image"
+        page.bibCitation = bibCitationBase + f"({sourceUrl})"
+
+    errors = mintPageHandles(handleAdapter, list(report.page_set.all()), iiifBase, describe, settings.ARAB_RETRIES,
+                             settings.ARAB_HANDLE_WORKERS, settings.ARAB_HANDLE_RATE)
+    scheduleRefill(handleNamespace(prefix), settings.ARAB_NOID_POOL_SIZE, refillHandleNoids)
+    if errors:
+        for handleError in errors:
+            logger.warning(handleError.adminMessage)
+        step.log = errors[0].userMessage
+        step.status = Status.ERROR
+        step.save()
+        return
 
     if step.humanValidation:
         step.status = Status.AWAITING_HUMAN_VALIDATION
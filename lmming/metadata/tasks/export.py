@@ -0,0 +1,18 @@
+import logging
+from pathlib import Path
+from typing import List
+
+from celery import shared_task
+from django.conf import settings
+
+from metadata.exports import ExportRequest, writeExport
+
+logger = logging.getLogger(settings.WORKER_LOG_NAME)
+
+
+@shared_task()
+def buildExport(filetype: str, transferIds: List[int], forArab: bool, arabOther: bool, artefact: str):
+    try:
+        writeExport(ExportRequest(filetype, transferIds, forArab, arabOther), Path(artefact))
+    except Exception as e:
+        logger.error(f"{type(e).__name__} occurred while exporting transfer(s) {transferIds} as {filetype}. {e.args}")
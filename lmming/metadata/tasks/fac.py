@@ -8,6 +8,7 @@ from django.conf import settings
 from metadata.i18n import SWEDISH
 from metadata.models import ProcessingStep, Status, Report, DefaultNumberSettings, DefaultValueSettings, \
     ReportTranslation
+from metadata.tasks.minting import mintPageArks, mintArk, scheduleRefill, arkNamespace, refillArkNoids
 from metadata.tasks.utils import resumePipeline, ArkletAdapter, ArkError
 from metadata.tasks.utils import splitIfNotNone
 from metadata.utils import formatDateString
@@ -149,7 +150,7 @@ def mintArks(jobPk: int, pipeline: bool = True):
         return
 
     arkAdapter = ArkletAdapter(address=settings.MINTER_URL, naan=settings.MINTER_ORG_ID,
-                               authenticationToken=settings.MINTER_AUTH)
+                               authenticationToken=settings.MINTER_AUTH, poolSize=settings.MINTER_WORKERS)
 
     iiifBase = settings.IIIF_BASE_URL
 
@@ -163,6 +164,11 @@ def mintArks(jobPk: int, pipeline: bool = True):
         try:
             arkAdapter.updateArk(report.noid, {"url": resolveTo, "title": report.title})
             # OBS: if added, source has to be a *valid* URL, otherwise ARKlet will reject the request with a "Bad Request" response!
+            if not report.identifier:
+                # the noid was saved, but its ARK could not be updated in an earlier run
+                # TODO: remove hardcoding once arklet is set up properly
+                report.identifier = f"https://ark.fauppsala.se/ark:/{arkAdapter.naan}/{report.noid}"
+                report.save()
         except ArkError as e:
             step.status = Status.ERROR
             step.log = e.userMessage
@@ -172,9 +178,7 @@ def mintArks(jobPk: int, pipeline: bool = True):
     else:
         try:
             resolveToFormat = iiifBase + "iiif/presentation/{}/manifest"
-            ark = arkAdapter.createArkWithDependentUrl(reportShoulder, resolveToFormat, {"title": report.title})
-            noid = ark.split("/")[-1]
-            report.noid = noid
+            ark = mintArk(arkAdapter, report, "noid", reportShoulder, resolveToFormat, {"title": report.title})
             report.identifier = f"https://ark.fauppsala.se/{ark}"  # TODO: remove hardcoding once arklet is set up properly
             report.save()
         except ArkError as e:
@@ -218,34 +222,23 @@ def mintArks(jobPk: int, pipeline: bool = True):
     bibCitation = ", ".join(
         [f"{report.creator} ({report.unionId})", volumeSeriesInfo, formatDateString(report.date, ",")])
 
-    for page in report.page_set.all():
-        if page.noid:
-            resolveToFormat = iiifBase + f"iiif/image/{page.noid}"
-            arkAdapter.updateArk(page.noid, {"url": resolveToFormat, "title": f"Page from '{report.title}'"})
-            ark = f"ark:/{settings.MINTER_ORG_ID}/{page.noid}"
-            arkLink = f"https://ark.fauppsala.se/{ark}"  # TODO: remove hardcoding once arklet is set up properly
-            page.identifier = arkLink + "/info.json"
-            page.source = arkLink + "/full/full/0/default.jpg"
-            page.bibCitation = f"{bibCitation} ({report.identifier}, page ID: {page.noid})"
-            page.save()
-        else:
-            try:
-                resolveToFormat = iiifBase + "iiif/image/{}"
-                ark = arkAdapter.createArkWithDependentUrl(pageShoulder, resolveToFormat,
-                                                           {"title": f"Page from '{report.title}'"})
-                noid = ark.split("/")[-1]
-                page.noid = noid
-                arkLink = f"https://ark.fauppsala.se/{ark}"  # TODO: remove hardcoding once arklet is set up properly
-                page.identifier = arkLink + "/info.json"
-                page.source = arkLink + "/full/full/0/default.jpg"
-                page.bibCitation = f"{bibCitation} ({report.identifier}, page ID: {page.noid})"
-                page.save()
-            except ArkError as e:
-                step.status = Status.ERROR
-                step.log = e.userMessage
-                step.save()
-                logger.warning(f"{report.title} (job: {jobPk}): {e.adminMessage}")
-                return
+    def describe(page, ark):
+        arkLink = f"https://ark.fauppsala.se/{ark}"  # TODO: remove hardcoding once arklet is set up properly
+        page.identifier = arkLink + "/info.json"
+        page.source = arkLink + "/full/full/0/default.jpg"
+        page.bibCitation = f"{bibCitation} ({report.identifier}, page ID: {page.noid})"
+
+    errors = mintPageArks(arkAdapter, list(report.page_set.all()), pageShoulder, iiifBase,
+                          f"Page from '{report.title}'", describe, settings.MINTER_WORKERS, settings.MINTER_RATE)
+    for shoulder in {reportShoulder, pageShoulder}:
+        scheduleRefill(arkNamespace(arkAdapter.naan, shoulder), settings.MINTER_NOID_POOL_SIZE, refillArkNoids, shoulder)
+    if errors:
+        for e in errors:
+            logger.warning(f"{report.title} (job: {jobPk}): {e.adminMessage}")
+        step.status = Status.ERROR
+        step.log = "\n".join(e.userMessage for e in errors)
+        step.save()
+        return
 
     if step.humanValidation:
         step.status = Status.AWAITING_HUMAN_VALIDATION
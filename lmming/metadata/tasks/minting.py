@@ -0,0 +1,455 @@
+import hashlib
+import json
+import logging
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+from typing import List, Callable, Tuple, Any, Optional, Dict
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Model, Q
+from django.utils import timezone
+from requests import RequestException
+
+from metadata.models import Page, ReservedNoid, NoidPool
+from metadata.tasks.utils import HandleAdapter, HandleError, HandleExistsError, HandleLocation, generateNoid, \
+    ArkletAdapter, ArkError
+
+logger = logging.getLogger(settings.WORKER_LOG_NAME)
+
+RESERVED_ARK_TITLE = "Reserved by LMMing"
+PAGE_HANDLE_FIELDS = ["noid", "iiifId", "identifier", "source", "bibCitation", "registeredHash", "lastUpdated"]
+PAGE_ARK_FIELDS = ["noid", "identifier", "source", "bibCitation", "registeredHash", "lastUpdated"]
+REFILL_TIMEOUT = timedelta(hours=1)
+CHECKPOINT_SIZE = 50  # minted pages are saved in batches of this size, so that a crash loses at most one batch
+
+
+class RateLimiter:
+    """
+    Spaces out the calls of any number of threads to at most ``rate`` per second (no limit if ``rate`` is 0).
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.nextSlot = monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = monotonic()
+            slot = max(now, self.nextSlot)
+            self.nextSlot = slot + self.interval
+        if slot > now:
+            sleep(slot - now)
+
+
+def pageLocations(iiifBase: str, noid: str) -> List[HandleLocation]:
+    resolveToBase = iiifBase + f"iiif/image/{noid}"
+    return [HandleLocation(1, resolveToBase + "/info.json"),
+            HandleLocation(0, resolveToBase + "/full/full/0/default.jpg", "jpgfull"),
+            HandleLocation(0, resolveToBase + "/info.json", "manifest")]
+
+
+def recordHash(*parts) -> str:
+    """
+    Fingerprint of what was registered for an identifier, see ``Page.registeredHash``.
+    """
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+def __handleRecordHash(prefix: str, noid: str, iiifBase: str) -> str:
+    return recordHash(prefix, noid, [location.toXml() for location in pageLocations(iiifBase, noid)])
+
+
+def __arkRecordHash(naan: str, noid: str, iiifBase: str, title: str) -> str:
+    return recordHash(naan, noid, iiifBase + f"iiif/image/{noid}", title)
+
+
+def __redescribed(page: Page, identifier: str, describe: Callable[[Page, str], None]) -> bool:
+    # for pages that are already registered: only their local fields may have to follow changes of the report
+    before = (page.identifier, page.source, page.bibCitation)
+    describe(page, identifier)
+    return before != (page.identifier, page.source, page.bibCitation)
+
+
+class __Checkpoints:
+    """
+    Collects the pages that got their identifier and saves them in batches of ``CHECKPOINT_SIZE``.
+    """
+
+    def __init__(self, fields: List[str]):
+        self.fields = fields
+        self.pages = []
+
+    def add(self, page: Page):
+        page.lastUpdated = timezone.now()
+        self.pages.append(page)
+        if len(self.pages) >= CHECKPOINT_SIZE:
+            self.save()
+
+    def save(self):
+        Page.objects.bulk_update(self.pages, self.fields)
+        self.pages = []
+
+
+def __limitedCall(limiter: RateLimiter, function: Callable, *args) -> Tuple[Any, Optional[Exception]]:
+    limiter.wait()
+    try:
+        return function(*args), None
+    except (HandleError, ArkError) as error:
+        return None, error
+    except RequestException as exception:
+        return None, ArkError("Connectivity issues occurred. Please try again later, and contact your admin if the "
+                              "issue persists.", f"{type(exception).__name__} - {exception}")
+
+
+def handleNamespace(prefix: str) -> str:
+    return f"hdl:{prefix}"
+
+
+def arkNamespace(naan: str, shoulder: str) -> str:
+    return f"ark:/{naan}{shoulder}"
+
+
+def claimNoids(namespace: str, count: int, assign: Callable[[List[str]], None]) -> List[str]:
+    """
+    Takes up to ``count`` reserved noids out of the pool of ``namespace`` and hands them to ``assign``, which saves them
+    where they are used. Both happen in one transaction, so that a claimed noid is never lost: if registering it fails
+    later on, the restart finds it where it was assigned. Rows that are locked by a concurrent claim are skipped, so
+    that minting tasks running in parallel neither wait for each other nor get the same noid.
+    """
+    if count <= 0:
+        return []
+    with transaction.atomic():
+        claimed = list(ReservedNoid.objects.select_for_update(skip_locked=True).filter(namespace=namespace)
+                       .order_by("pk").values_list("pk", "noid")[:count])
+        noids = [noid for _, noid in claimed]
+        if noids:
+            assign(noids)
+            ReservedNoid.objects.filter(pk__in=[pk for pk, _ in claimed]).delete()
+    return noids
+
+
+def __assignToPages(pages: List[Page]) -> Callable[[List[str]], None]:
+    def assign(noids: List[str]):
+        claimedPages = pages[:len(noids)]
+        for page, noid in zip(claimedPages, noids):
+            page.noid = noid
+            page.registeredHash = ""
+        Page.objects.bulk_update(claimedPages, ["noid", "registeredHash"])
+
+    return assign
+
+
+def __assignTo(record: Model, field: str) -> Callable[[List[str]], None]:
+    def assign(noids: List[str]):
+        setattr(record, field, noids[0])
+        record.save()
+
+    return assign
+
+
+def scheduleRefill(namespace: str, poolSize: int, task, *args):
+    """
+    Queues ``task`` once the pool of ``namespace`` is less than half full (never if ``poolSize`` is 0), unless a refill
+    of the pool is already queued or running. The task has to call ``finishRefill`` when it is done.
+    """
+    if poolSize <= 0 or ReservedNoid.objects.filter(namespace=namespace).count() >= poolSize / 2:
+        return
+    NoidPool.objects.get_or_create(namespace=namespace)
+    # a refill that did not finish within REFILL_TIMEOUT is considered dead
+    started = NoidPool.objects.filter(Q(refillStarted__isnull=True) |
+                                      Q(refillStarted__lt=timezone.now() - REFILL_TIMEOUT),
+                                      namespace=namespace).update(refillStarted=timezone.now())
+    if started:
+        transaction.on_commit(lambda: task.delay(*args))
+
+
+def finishRefill(namespace: str):
+    NoidPool.objects.filter(namespace=namespace).update(refillStarted=None)
+
+
+def __candidateNoids(keys: List[Any], taken: set, handleAdapter: HandleAdapter, executor: ThreadPoolExecutor,
+                     limiter: RateLimiter, retries: int) -> Tuple[dict, List[HandleError], List[Any]]:
+    # generates a noid for every key at once and checks them concurrently; only the taken ones are drawn again.
+    # ``taken`` holds the noids that are already in use locally, so that no two keys get the same one
+    noids, errors = {}, []
+    pending = list(keys)
+    for _ in range(retries):
+        if not pending:
+            break
+        toCheck, stillPending = [], []
+        for key in pending:
+            noid = generateNoid()
+            if noid in taken:
+                stillPending.append(key)
+                continue
+            taken.add(noid)
+            noids[key] = noid
+            toCheck.append(key)
+        results = list(executor.map(lambda k: __limitedCall(limiter, handleAdapter.doesHandleAlreadyExist,
+                                                            noids[k]), toCheck))
+        for key, (exists, error) in zip(toCheck, results):
+            if error or exists:
+                taken.discard(noids.pop(key))
+            if error:
+                errors.append(error)
+            elif exists:
+                stillPending.append(key)
+        pending = stillPending
+    return noids, errors, pending
+
+
+def __uniqueHandleError(retries: int, key: str) -> HandleError:
+    message = f"Could not generate unique handle. Made {retries} attempt(s)."
+    return HandleError(message, f"{message} ({key})")
+
+
+def reserveHandleNoids(handleAdapter: HandleAdapter, count: int, retries: int, workers: int,
+                       rate: float) -> List[HandleError]:
+    """
+    Adds ``count`` noids that are not registered at the handle server yet to the pool of the adapter's prefix.
+
+    :return: the errors of the noids that could not be reserved
+    """
+    namespace = handleNamespace(handleAdapter.prefix)
+    taken = set(ReservedNoid.objects.filter(namespace=namespace).values_list("noid", flat=True))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        noids, errors, pending = __candidateNoids(list(range(count)), taken, handleAdapter, executor,
+                                                  RateLimiter(rate), retries)
+    ReservedNoid.objects.bulk_create([ReservedNoid(namespace=namespace, noid=noid) for noid in noids.values()],
+                                     ignore_conflicts=True)
+    return errors + [__uniqueHandleError(retries, "reservation") for _ in pending]
+
+
+def reserveArkNoids(arkAdapter: ArkletAdapter, shoulder: str, count: int, workers: int,
+                    rate: float) -> List[ArkError]:
+    """
+    Mints ``count`` ARKs without a URL on ``shoulder`` and adds their noids to the pool of the shoulder, so that a
+    minting task only has to point them to their target.
+
+    :return: the errors of the ARKs that could not be minted
+    """
+    limiter = RateLimiter(rate)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(lambda _: __limitedCall(limiter, arkAdapter.createArk, shoulder,
+                                                            {"title": RESERVED_ARK_TITLE}), range(count)))
+    namespace = arkNamespace(arkAdapter.naan, shoulder)
+    ReservedNoid.objects.bulk_create([ReservedNoid(namespace=namespace, noid=ark.split("/")[-1])
+                                      for ark, error in results if not error], ignore_conflicts=True)
+    return [error for _, error in results if error]
+
+
+def mintPlainHandle(handleAdapter: HandleAdapter, record: Model, field: str, urlFormat: str, retries: int) -> str:
+    """
+    Registers a plain handle that resolves to ``urlFormat`` (formatted with the noid) under a reserved noid, resp.
+    under a newly generated one if the pool of the adapter's prefix is empty. The handle is registered without
+    overwriting: a reserved noid may have been registered by someone else since it was reserved, in which case it is
+    dropped and another one is taken. The noid is saved to ``field`` of ``record`` once the handle is registered; if
+    registering fails, it goes back into the pool.
+
+    :return: the handle
+    :raises HandleError: if the handle could not be registered
+    """
+    namespace = handleNamespace(handleAdapter.prefix)
+    for _ in range(retries):
+        noids = claimNoids(namespace, 1, __assignTo(record, field))
+        if not noids:
+            noid = generateNoid()
+            if handleAdapter.doesHandleAlreadyExist(noid):
+                continue
+            __assignTo(record, field)([noid])
+        noid = getattr(record, field)
+        try:
+            return handleAdapter.updatePlainHandle(noid, urlFormat.format(noid), overwrite=False)
+        except HandleExistsError:
+            logger.warning(f"Handle {handleAdapter.prefix}/{noid} was registered elsewhere, taking another noid")
+            __assignTo(record, field)([""])
+        except HandleError:
+            with transaction.atomic():
+                ReservedNoid.objects.get_or_create(namespace=namespace, noid=noid)
+                __assignTo(record, field)([""])
+            raise
+    raise __uniqueHandleError(retries, urlFormat)
+
+
+def mintArk(arkAdapter: ArkletAdapter, record: Model, field: str, shoulder: str, urlFormat: str,
+            details: Dict[str, str]) -> str:
+    """
+    Points a reserved ARK of ``shoulder`` to ``urlFormat`` (formatted with the noid), resp. mints a new one if the pool
+    of the shoulder is empty. The noid is saved to ``field`` of ``record`` before the ARK is pointed to its URL, so
+    that a restart updates the same ARK instead of minting another one.
+
+    :return: the ARK
+    :raises ArkError: if the ARK could not be minted or updated
+    """
+    claimNoids(arkNamespace(arkAdapter.naan, shoulder), 1, __assignTo(record, field))
+    if not getattr(record, field):
+        __assignTo(record, field)([arkAdapter.createArk(shoulder, details).split("/")[-1]])
+    noid = getattr(record, field)
+    arkAdapter.updateArk(noid, dict(details, url=urlFormat.format(noid)))
+    return f"ark:/{arkAdapter.naan}/{noid}"
+
+
+def mintPageHandles(handleAdapter: HandleAdapter, pages: List[Page], iiifBase: str,
+                    describe: Callable[[Page, str], None], retries: int, workers: int,
+                    rate: float) -> List[HandleError]:
+    """
+    Registers a location based handle for every page, giving pages that do not have a noid yet a reserved one, resp. a
+    newly generated one once the pool of the adapter's prefix is empty. Pages whose handle was already registered with
+    the same locations (see ``Page.registeredHash``) are skipped, so that a restart only retries the pending ones.
+    A noid is registered for the first time (``Page.iiifId`` is only set afterwards) without overwriting: if it was
+    registered by someone else since it was reserved, the page gets another one, at most ``retries`` times.
+    Existence checks and registrations run concurrently in ``workers`` threads, at most ``rate`` requests per second,
+    and the pages are saved in batches of ``CHECKPOINT_SIZE``, also those whose registration failed, so that a restart
+    registers their noid again. ``describe`` fills the pipeline specific fields (``source`` and ``bibCitation``) of a
+    page from its handle.
+
+    :return: the errors of the pages that did not get a handle
+    """
+    prefix = handleAdapter.prefix
+    checkpoints = __Checkpoints(PAGE_HANDLE_FIELDS)
+    pending = []
+    for page in pages:
+        if not page.noid or page.registeredHash != __handleRecordHash(prefix, page.noid, iiifBase):
+            pending.append(page)
+        elif __redescribed(page, f"{prefix}/{page.noid}", describe):
+            checkpoints.add(page)
+
+    limiter = RateLimiter(rate)
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for _ in range(max(1, retries)):
+            unminted = [page for page in pending if not page.noid]
+            claimNoids(handleNamespace(prefix), len(unminted), __assignToPages(unminted))
+            noids = {page.pk: page.noid for page in pages if page.noid}
+            generated, candidateErrors, exhausted = __candidateNoids(
+                [page.pk for page in unminted if not page.noid], set(noids.values()), handleAdapter, executor,
+                limiter, retries)
+            errors += candidateErrors + [__uniqueHandleError(retries, f"page {pk}") for pk in exhausted]
+            noids.update(generated)
+            toRegister = [page for page in pending if page.pk in noids]
+            results = executor.map(lambda p: __limitedCall(limiter, handleAdapter.updateLocationBasedHandle,
+                                                           noids[p.pk], pageLocations(iiifBase, noids[p.pk]),
+                                                           p.iiifId == noids[p.pk]), toRegister)
+
+            pending = []
+            for page, (handle, error) in zip(toRegister, results):
+                page.noid = noids[page.pk]
+                if isinstance(error, HandleExistsError):
+                    logger.warning(f"Handle {prefix}/{page.noid} was registered elsewhere, taking another noid")
+                    page.noid = ""
+                    page.registeredHash = ""
+                    checkpoints.add(page)
+                    pending.append(page)
+                    continue
+                if error:
+                    # keeps the noid pending, so that a restart registers the same one again
+                    errors.append(error)
+                    page.registeredHash = ""
+                    checkpoints.add(page)
+                    continue
+                page.iiifId = page.noid
+                page.identifier = f"https://hdl.handle.net/{handle}?locatt=view:manifest"
+                page.registeredHash = __handleRecordHash(prefix, page.noid, iiifBase)
+                describe(page, handle)
+                checkpoints.add(page)
+            if not pending:
+                break
+        errors += [__uniqueHandleError(retries, f"page {page.pk}") for page in pending]
+
+    checkpoints.save()
+    return errors
+
+
+def mintPageArks(arkAdapter: ArkletAdapter, pages: List[Page], shoulder: str, iiifBase: str, title: str,
+                 describe: Callable[[Page, str], None], workers: int, rate: float) -> List[ArkError]:
+    """
+    Points the ARK of every page to its IIIF image. Pages without a noid get a reserved ARK of ``shoulder``, resp. a
+    newly minted one once the pool is empty. Pages whose
+    ARK already points to the same URL with the same title (see ``Page.registeredHash``) are skipped, so that a restart
+    only retries the pending ones. All requests run concurrently in ``workers`` threads, at most ``rate`` per second,
+    and the pages are saved in batches of ``CHECKPOINT_SIZE``, also those whose ARK was minted, but could not be
+    updated, so that a restart reuses it. ``describe`` fills the remaining fields of a page from its ARK.
+
+    :return: one error per page that did not get an ARK, naming the page
+    """
+    naan = arkAdapter.naan
+    checkpoints = __Checkpoints(PAGE_ARK_FIELDS)
+    pending = []
+    for page in pages:
+        if not page.noid or page.registeredHash != __arkRecordHash(naan, page.noid, iiifBase, title):
+            pending.append(page)
+        elif __redescribed(page, f"ark:/{naan}/{page.noid}", describe):
+            checkpoints.add(page)
+
+    unminted = [page for page in pending if not page.noid]
+    claimNoids(arkNamespace(naan, shoulder), len(unminted), __assignToPages(unminted))
+    minted = {}
+
+    limiter = RateLimiter(rate)
+
+    def mint(page: Page) -> str:
+        # the URL depends on the noid, so new ARKs are minted first and then pointed to their image; both requests
+        # count against the rate
+        noid = page.noid
+        if not noid:
+            noid = minted[page.pk] = arkAdapter.createArk(shoulder, {"title": title}).split("/")[-1]
+            limiter.wait()
+        arkAdapter.updateArk(noid, {"url": iiifBase + f"iiif/image/{noid}", "title": title})
+        return f"ark:/{naan}/{noid}"
+
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for page, (ark, error) in zip(pending, executor.map(lambda p: __limitedCall(limiter, mint, p), pending)):
+            if error:
+                errors.append(ArkError(f"Page {page.order}: {error.userMessage}",
+                                       f"page {page.pk}: {error.adminMessage}"))
+                noid = page.noid or minted.get(page.pk)
+                if noid:
+                    # keeps an ARK that already exists pending, so that a restart updates it instead of minting another
+                    page.noid = noid
+                    page.registeredHash = ""
+                    checkpoints.add(page)
+                continue
+            page.noid = ark.split("/")[-1]
+            page.registeredHash = __arkRecordHash(naan, page.noid, iiifBase, title)
+            describe(page, ark)
+            checkpoints.add(page)
+
+    checkpoints.save()
+    return errors
+
+
+@shared_task()
+def refillHandleNoids():
+    handleAdapter = HandleAdapter(address=settings.ARAB_HANDLE_ADDRESS, port=settings.ARAB_HANDLE_PORT,
+                                  prefix=settings.ARAB_HANDLE_PREFIX, user=settings.ARAB_HANDLE_ADMIN,
+                                  userKeyFile=settings.ARAB_PRIVATE_KEY_FILE, certificateFile=settings.ARAB_CERT_FILE)
+    namespace = handleNamespace(handleAdapter.prefix)
+    try:
+        missing = settings.ARAB_NOID_POOL_SIZE - ReservedNoid.objects.filter(namespace=namespace).count()
+        if missing > 0:
+            for error in reserveHandleNoids(handleAdapter, missing, settings.ARAB_RETRIES,
+                                            settings.ARAB_HANDLE_WORKERS, settings.ARAB_HANDLE_RATE):
+                logger.warning(f"Reserving handle noids: {error.adminMessage}")
+    finally:
+        finishRefill(namespace)
+
+
+@shared_task()
+def refillArkNoids(shoulder: str):
+    arkAdapter = ArkletAdapter(address=settings.MINTER_URL, naan=settings.MINTER_ORG_ID,
+                               authenticationToken=settings.MINTER_AUTH, poolSize=settings.MINTER_WORKERS)
+    namespace = arkNamespace(arkAdapter.naan, shoulder)
+    try:
+        missing = settings.MINTER_NOID_POOL_SIZE - ReservedNoid.objects.filter(namespace=namespace).count()
+        if missing > 0:
+            for error in reserveArkNoids(arkAdapter, shoulder, missing, settings.MINTER_WORKERS,
+                                         settings.MINTER_RATE):
+                logger.warning(f"Reserving ARKs on {shoulder}: {error.adminMessage}")
+    finally:
+        finishRefill(namespace)
@@ -1,12 +1,16 @@
+import dataclasses
 import logging
 from pathlib import Path
+from typing import List, Tuple, Optional, Dict, Any
 
-from celery import shared_task, signals
+from celery import shared_task, signals, chord
 from django.conf import settings
+from django.utils import timezone
 
-from metadata.models import ProcessingStep, Status, ExternalRecord, Report, DefaultNumberSettings
+from metadata.models import ProcessingStep, Status, ExternalRecord, Report, DefaultNumberSettings, Page
+from metadata.nlp import cache
 from metadata.nlp.hf_utils import download
-from metadata.nlp.ner import processPage, NlpResult
+from metadata.nlp.ner import processPage, processPages, NlpResult
 from metadata.tasks.utils import resumePipeline, getFacCoverage
 
 logger = logging.getLogger(settings.WORKER_LOG_NAME)
@@ -103,7 +107,165 @@ def fileMakerLookup(jobPk: int, pipeline: bool = True):
         resumePipeline(jobPk)
 
 
+def __pageNer(page: Page, normalise: bool) -> Optional[NlpResult]:
+    try:
+        return processPage(Path(page.transcriptionFile.path), normalise) or NlpResult()
+    except Exception as e:
+        logger.error(f"{type(e).__name__} occurred during NER of page {page.pk}. {e.args}")
+        return None
+
+
+def __batchedNer(pages: List[Page], normalise: bool) -> List[Optional[NlpResult]]:
+    try:
+        return processPages([Path(page.transcriptionFile.path) for page in pages], normalise)
+    except Exception as e:
+        # fall back to page-wise processing, so that a single faulty page does not fail the entire report
+        logger.warning(f"{type(e).__name__} occurred during batched NER, processing pages individually. {e.args}")
+        return [__pageNer(page, normalise) for page in pages]
+
+
+def __cacheKey(page: Page, normalise: bool):
+    if settings.NER_CACHE_MAX_SIZE <= 0:
+        return None
+    try:
+        return cache.cacheKey(Path(page.transcriptionFile.path), normalise)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not compute NER cache key for page {page.pk}. {e.args}")
+        return None
+
+
+def __cachedNer(pages: List[Page], normalise: bool) -> List[Optional[NlpResult]]:
+    """
+    Returns cached results for all pages whose transcription, normalisation flag, models and normalisation lists are
+    unchanged, and runs NER on the remaining ones. Pages for which NER failed get ``None``.
+    """
+    keys = [__cacheKey(page, normalise) for page in pages]
+    results = [cache.load(key) if key else None for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if not missing:
+        return results
+
+    missingPages = [pages[i] for i in missing]
+    if settings.NER_BATCHED and len(missingPages) > 1:
+        found = __batchedNer(missingPages, normalise)
+    else:
+        found = [__pageNer(page, normalise) for page in missingPages]
+
+    stored = False
+    for i, result in zip(missing, found):
+        results[i] = result
+        # empty results may stem from errors, which should not be cached
+        if result is not None and keys[i] and result.text:
+            cache.store(keys[i], result)
+            stored = True
+    if stored:
+        cache.evictIfDue()
+    return results
+
+
+NER_PAGE_FIELDS = ["transcription", "normalisedTranscription", "persons", "organisations", "locations", "works",
+                   "events", "ner_objects", "times", "measures", "lastUpdated"]
+
+
+def __applyNerResult(page: Page, result: NlpResult):
+    page.transcription = result.text
+    page.normalisedTranscription = result.normalised
+    page.persons = list(result.persons)
+    page.organisations = list(result.organisations)
+    page.locations = list(result.locations)
+    page.works = list(result.works)
+    page.events = list(result.events)
+    page.ner_objects = list(result.objects)
+    page.times = list(result.times)
+    page.measures = result.measures
+    # bulk_update does not set auto_now fields
+    page.lastUpdated = timezone.now()
+
+
+def __completeNerStep(jobPk: int, pipeline: bool):
+    step = ProcessingStep.objects.filter(job__pk=jobPk,
+                                         processingStepType=ProcessingStep.ProcessingStepType.NER.value).first()
+    if step.humanValidation:
+        step.status = Status.AWAITING_HUMAN_VALIDATION
+        step.save()
+    else:
+        step.status = Status.COMPLETE
+        step.save()
+
+    if pipeline:
+        resumePipeline(jobPk)
+
+
+def __fanOutNer(jobPk: int, pagePks: List[int], normalise: bool, pipeline: bool, attempt: int, pagesPerTask: int):
+    chunks = [pagePks[i:i + pagesPerTask] for i in range(0, len(pagePks), pagesPerTask)]
+    callback = completeNer.s(jobPk, normalise, pipeline, attempt).on_error(failNer.si(jobPk))
+    chord(nerPages.s(chunk, normalise) for chunk in chunks)(callback)
+
+
+@shared_task(acks_late=True)
+def nerPages(pagePks: List[int], normalise: bool) -> List[Tuple[int, Optional[Dict[str, Any]]]]:
+    """
+    Runs NER on a part of a report's pages. Pages that fail are returned without result, so that they can be retried
+    individually instead of failing the whole report.
+    """
+    try:
+        pages = list(Page.objects.filter(pk__in=pagePks).order_by("order"))
+        results = __cachedNer(pages, normalise)
+    except Exception as e:
+        # anything raised here would keep the chord callback from running
+        logger.error(f"{type(e).__name__} occurred during NER of pages {pagePks}. {e.args}")
+        return [(pagePk, None) for pagePk in pagePks]
+    return [(page.pk, dataclasses.asdict(result) if result is not None else None)
+            for page, result in zip(pages, results)]
+
+
 @shared_task()
+def failNer(jobPk: int):
+    """
+    Error callback of the NER fan-out, so that the step does not stay in progress if the chord fails.
+    """
+    step = ProcessingStep.objects.filter(job__pk=jobPk,
+                                         processingStepType=ProcessingStep.ProcessingStepType.NER.value).first()
+    step.status = Status.ERROR
+    step.log = "Named entity recognition could not be completed. Please restart the step."
+    step.save()
+    logger.error(f"NER fan-out of job {jobPk} failed.")
+
+
+@shared_task()
+def completeNer(chunkResults: List[List[Tuple[int, Optional[Dict[str, Any]]]]], jobPk: int, normalise: bool,
+                pipeline: bool = True, attempt: int = 0):
+    """
+    Chord callback of the NER fan-out: writes the results of all pages at once, starts another round for the pages that
+    failed (one page per task) and completes the step once no retries are left.
+    """
+    pages = {page.pk: page for page in Page.objects.filter(report__job__pk=jobPk)}
+    updated = []
+    failed = []
+    for chunk in chunkResults:
+        for pagePk, result in chunk:
+            if pagePk not in pages:
+                continue
+            if result is None:
+                failed.append(pagePk)
+            else:
+                __applyNerResult(pages[pagePk], NlpResult(**result))
+                updated.append(pages[pagePk])
+
+    if failed and attempt < settings.NER_PAGE_RETRIES:
+        Page.objects.bulk_update(updated, NER_PAGE_FIELDS)
+        logger.warning(f"NER failed for {len(failed)} page(s) of job {jobPk}, retrying (attempt {attempt + 1}).")
+        __fanOutNer(jobPk, failed, normalise, pipeline, attempt + 1, 1)
+        return
+
+    for pagePk in failed:
+        __applyNerResult(pages[pagePk], NlpResult())
+        updated.append(pages[pagePk])
+    Page.objects.bulk_update(updated, NER_PAGE_FIELDS)
+    __completeNerStep(jobPk, pipeline)
+
+
+@shared_task(acks_late=True)
 def namedEntityRecognition(jobPk: int, pipeline: bool = True):
     # fields: everything in page, except minting
     report = Report.objects.get(job__pk=jobPk)
@@ -123,39 +285,26 @@ def namedEntityRecognition(jobPk: int, pipeline: bool = True):
         step.save()
         return
 
-    for page in report.page_set.all():
-        try:
-            result = processPage(Path(page.transcriptionFile.path), normalise)
-            if not result:
-                result = NlpResult()
-        except Exception as e:
-            logger.error(f"{type(e).__name__} occurred during NER. {e.args}")
-            result = NlpResult()
-
-        page.transcription = result.text
-        page.normalisedTranscription = result.normalised
-        page.persons = list(result.persons)
-        page.organisations = list(result.organisations)
-        page.locations = list(result.locations)
-        page.works = list(result.works)
-        page.events = list(result.events)
-        page.ner_objects = list(result.objects)
-        page.times = list(result.times)
-        page.measures = result.measures
-        page.save()
+    pages = list(report.page_set.all())
+    if settings.NER_PAGES_PER_TASK > 0 and pages:
+        # the step is completed by the chord callback
+        __fanOutNer(jobPk, [page.pk for page in pages], normalise, pipeline, 0, settings.NER_PAGES_PER_TASK)
+        return
 
-    if step.humanValidation:
-        step.status = Status.AWAITING_HUMAN_VALIDATION
-        step.save()
-    else:
-        step.status = Status.COMPLETE
-        step.save()
+    results = __cachedNer(pages, normalise)
+    for page, result in zip(pages, results):
+        # without a fan-out, there are no retries for failed pages
+        __applyNerResult(page, result if result is not None else NlpResult())
+    Page.objects.bulk_update(pages, NER_PAGE_FIELDS)
 
-    if pipeline:
-        resumePipeline(jobPk)
+    __completeNerStep(jobPk, pipeline)
 
 
 @signals.worker_ready.connect
-def prepareNLP(**_kwargs):
+def prepareNLP(sender=None, **_kwargs):
+    # workers that do not run NER (e.g. the I/O pool) do not need the models
+    queues = [queue.name for queue in sender.task_consumer.queues] if sender and sender.task_consumer else []
+    if queues and settings.WORKER_NER_QUEUE not in queues:
+        return
     download()
     logger.info("Model download complete")
@@ -1,9 +1,13 @@
 import dataclasses
 import json
 import os
+import secrets
+import threading
 from base64 import b64encode, b64decode
 from datetime import date
+from functools import lru_cache
 from pathlib import Path
+from time import monotonic
 from typing import List, Dict
 
 import requests
@@ -11,9 +15,14 @@ from Crypto.Hash import SHA256
 from Crypto.PublicKey import RSA
 from Crypto.Signature import PKCS1_v1_5
 from requests import Timeout, ConnectionError, TooManyRedirects
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 from metadata.models import Report
 
+BETANUMERIC = "0123456789bcdfghjkmnpqrstvwxz"
+BETA = "bcdfghjkmnpqrstvwxz"
+
 
 def resumePipeline(jobPk):
     from metadata.tasks.manage import scheduleTask
@@ -88,14 +97,26 @@ class Singleton(type):
         return cls._instances[cls]
 
 
+def generateNoid() -> str:
+    # OBS: xml:IDs may not start with a digit!
+    return "".join([secrets.choice(BETA)] + [secrets.choice(BETANUMERIC) for _ in range(14)])
+
+
 def generateClientNonceBytes():
     return bytearray(os.urandom(16))
 
 
+@lru_cache(maxsize=None)
+def loadPrivateKey(pathToPrivateKeyPemFile) -> RSA.RsaKey:
+    """
+    Reads and parses a PEM private key once per process.
+    """
+    with open(pathToPrivateKeyPemFile, "r") as keyFile:
+        return RSA.importKey(keyFile.read())
+
+
 def signBytesSHA256(bytesArray, pathToPrivateKeyPemFile):
-    key = open(pathToPrivateKeyPemFile, "r").read()
-    rsakey = RSA.importKey(key)
-    signer = PKCS1_v1_5.new(rsakey)
+    signer = PKCS1_v1_5.new(loadPrivateKey(pathToPrivateKeyPemFile))
     digest = SHA256.new()
     digest.update(bytesArray)
     sign = signer.sign(digest)
@@ -113,6 +134,20 @@ def createAuthenticationString(user, userKeyFile, sessionId, serverNonceBytes):
             f'alg="SHA256", signature="{signatureString}"')
 
 
+def createPooledSession(poolSize: int = 10, retries: int = 3) -> requests.Session:
+    """
+    Returns a session that keeps connections alive between requests and retries idempotent requests (GET and PUT) on
+    connection errors and temporary server errors, backing off exponentially.
+    """
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset({"GET", "PUT"}), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 @dataclasses.dataclass
 class HandleLocation:
     weight: int
@@ -136,7 +171,16 @@ class HandleError(Exception):
         self.adminMessage = adminMessage
 
 
+class HandleExistsError(HandleError):
+    """
+    Raised if a handle that must not be overwritten is already registered.
+    """
+
+
 class HandleAdapter(metaclass=Singleton):
+    # seconds an authenticated session is used without contacting the server; the server keeps idle sessions longer
+    SESSION_LIFETIME = 300
+    TIMEOUT = (10, 60)
 
     def __init__(self, address: str, port: int, prefix: str, user: str, userKeyFile: Path, certificateFile: Path,
                  userIndex: int = 300):
@@ -148,42 +192,34 @@ class HandleAdapter(metaclass=Singleton):
         self.sessionId = ""
         self.serverNonce = ""
         self.serverNonceBytes = b""
+        self.sessionExpiry = 0.0
+        self.sessionLock = threading.Lock()
+        self.session = createPooledSession()
 
-        if address.startswith("https://"):
+        if address.startswith(("https://", "http://")):
             self.baseUrl = f"{address}:{port}"
         else:
             self.baseUrl = f"https://{address}:{port}"
 
     def __isHandleSessionActive(self):
-        if not self.sessionId or not self.serverNonce:
-            return False
-
-        try:
-            response = requests.get(url=f"{self.baseUrl}/api/sessions/this", verify=self.certificateFile,
-                                    headers={"Authorization": f'Handle sessionId="{self.sessionId}"'})
-
-            if response.ok:
-                responseJson = response.json()
-                if "sessionId" in responseJson and "nonce" in responseJson:
-                    if responseJson["sessionId"] == self.sessionId and responseJson["nonce"] == self.serverNonce:
-                        return True
-                return False
-            else:
-                return False
-        except (ConnectionError, Timeout, TooManyRedirects) as exception:
-            raise HandleError(
-                "Connectivity issues occurred. Please try again later, and contact your admin if the issue persists.",
-                f"{type(exception).__name__} - {exception}")
-        except Exception as exception:
-            raise HandleError("An issue occurred, Please try again later.",
-                              f"{type(exception).__name__} - {exception}")
+        # tracked locally instead of asking the server before every request, see __authorisedPut for expired sessions
+        return bool(self.sessionId and self.serverNonce and monotonic() < self.sessionExpiry)
+
+    def __resetSession(self, sessionId: str):
+        # another thread may have established a new session in the meantime
+        with self.sessionLock:
+            if self.sessionId == sessionId:
+                self.sessionId = ""
+                self.serverNonce = ""
+                self.serverNonceBytes = b""
+                self.sessionExpiry = 0.0
 
     def __updateSession(self):
         url = f"{self.baseUrl}/api/sessions"
 
         try:
-            initialResponse = requests.post(url=url, headers={"Authorization": "Handle version=0"},
-                                            verify=self.certificateFile)
+            initialResponse = self.session.post(url=url, headers={"Authorization": "Handle version=0"},
+                                                verify=self.certificateFile, timeout=self.TIMEOUT)
 
             content = initialResponse.json()
             sessionId = content["sessionId"]
@@ -198,15 +234,19 @@ class HandleAdapter(metaclass=Singleton):
                 "Authorization": authorizationHeaderString
             }
 
-            response = requests.post(url=url + "/this", headers=headers, verify=self.certificateFile)
+            response = self.session.post(url=url + "/this", headers=headers, verify=self.certificateFile,
+                                         timeout=self.TIMEOUT)
             if response.ok:
                 self.sessionId = sessionId
                 self.serverNonce = serverNonce
                 self.serverNonceBytes = serverNonceBytes
+                self.sessionExpiry = monotonic() + self.SESSION_LIFETIME
             else:
                 raise HandleError("Could not authenticate at handle server. Please try again later, and contact your "
                                   "admin if the issue persists.",
                                   f"Session could not be established: {response.status_code} - {response.content}")
+        except HandleError as exception:
+            raise exception
         except (ConnectionError, Timeout, TooManyRedirects) as exception:
             raise HandleError(
                 "Connectivity issues occurred. Please try again later, and contact your admin if the issue persists.",
@@ -215,9 +255,34 @@ class HandleAdapter(metaclass=Singleton):
             raise HandleError("An issue occurred, Please try again later.",
                               f"{type(exception).__name__} - {exception}")
 
+    def __authorisedPut(self, noid: str, handleRecord: Dict, overwrite: bool = True) -> requests.Response:
+        """
+        Sends the handle record within the current session, establishing one first if needed. If the server no longer
+        knows the session (401), it is established again and the record is sent once more. Safe to call from several
+        threads at once. Unless ``overwrite`` is set, the server rejects the record (409) if the handle already exists.
+        """
+        for _ in range(2):
+            with self.sessionLock:
+                if not self.__isHandleSessionActive():
+                    self.__updateSession()
+                sessionId, serverNonceBytes = self.sessionId, self.serverNonceBytes
+
+            authorizationHeaderString = createAuthenticationString(self.user, self.userKeyFile, sessionId,
+                                                                   serverNonceBytes)
+            headers = {"Content-Type": "application/json", "Authorization": authorizationHeaderString}
+            response = self.session.put(url=f"{self.baseUrl}/api/handles/{self.prefix}/{noid}", headers=headers,
+                                        verify=self.certificateFile, data=json.dumps(handleRecord),
+                                        params=None if overwrite else {"overwrite": "false"}, timeout=self.TIMEOUT)
+            if response.status_code != 401:
+                self.sessionExpiry = monotonic() + self.SESSION_LIFETIME
+                return response
+            self.__resetSession(sessionId)
+        return response
+
     def doesHandleAlreadyExist(self, noid) -> bool:
         try:
-            response = requests.get(url=f"{self.baseUrl}/api/handles/{self.prefix}/{noid}", verify=self.certificateFile)
+            response = self.session.get(url=f"{self.baseUrl}/api/handles/{self.prefix}/{noid}",
+                                        verify=self.certificateFile, timeout=self.TIMEOUT)
             if response.ok:
                 return True
             else:
@@ -230,15 +295,8 @@ class HandleAdapter(metaclass=Singleton):
             raise HandleError("An issue occurred, Please try again later.",
                               f"{type(exception).__name__} - {exception}")
 
-    def updateLocationBasedHandle(self, noid: str, locations: List[HandleLocation]):
+    def updateLocationBasedHandle(self, noid: str, locations: List[HandleLocation], overwrite: bool = True):
         try:
-            if not self.__isHandleSessionActive():
-                self.__updateSession()
-
-            authorizationHeaderString = createAuthenticationString(self.user, self.userKeyFile, self.sessionId,
-                                                                   self.serverNonceBytes)
-            headers = {"Content-Type": "application/json", "Authorization": authorizationHeaderString}
-
             locationString = "<locations>" + "".join(x.toXml() for x in locations) + "</locations>"
 
             handleRecord = {"values": [{"index": 100, "type": "HS_ADMIN",
@@ -247,10 +305,12 @@ class HandleAdapter(metaclass=Singleton):
                                        {"index": 1000, "type": "10320/loc",
                                         "data": {"format": "string", "value": locationString}}
                                        ]}
-            response = requests.put(url=f"{self.baseUrl}/api/handles/{self.prefix}/{noid}", headers=headers,
-                                    verify=self.certificateFile, data=json.dumps(handleRecord))
+            response = self.__authorisedPut(noid, handleRecord, overwrite)
             if response.ok:
                 return f"{self.prefix}/{noid}"
+            elif response.status_code == 409 and not overwrite:
+                raise HandleExistsError(f"Handle '{self.prefix}/{noid}' already exists",
+                                        f"Handle '{self.prefix}/{noid}' already exists")
             else:
                 raise HandleError(f"Could not update handle {self.prefix}/{noid} - please try again, and contact your "
                                   f"admin if the issue persists.",
@@ -278,24 +338,19 @@ class HandleAdapter(metaclass=Singleton):
                 e.adminMessage.replace("update", "create")
             raise e
 
-    def updatePlainHandle(self, noid, resolveTo) -> str:
+    def updatePlainHandle(self, noid, resolveTo, overwrite: bool = True) -> str:
         try:
-            if not self.__isHandleSessionActive():
-                self.__updateSession()
-
-            authorizationHeaderString = createAuthenticationString(self.user, self.userKeyFile, self.sessionId,
-                                                                   self.serverNonceBytes)
-            headers = {"Content-Type": "application/json", "Authorization": authorizationHeaderString}
-
             handleRecord = {"values": [{"index": 1, "type": "URL", "data": {"format": "string", "value": resolveTo}},
                                        {"index": 100, "type": "HS_ADMIN", "data": {"format": "admin",
                                                                                    "value": {"handle": self.user,
                                                                                              "index": 200,
                                                                                              "permissions": "011111110011"}}}]}
-            response = requests.put(url=f"{self.baseUrl}/api/handles/{self.prefix}/{noid}", headers=headers,
-                                    verify=self.certificateFile, data=json.dumps(handleRecord))
+            response = self.__authorisedPut(noid, handleRecord, overwrite)
             if response.ok:
                 return f"{self.prefix}/{noid}"
+            elif response.status_code == 409 and not overwrite:
+                raise HandleExistsError(f"Handle '{self.prefix}/{noid}' already exists",
+                                        f"Handle '{self.prefix}/{noid}' already exists")
             else:
                 raise HandleError(f"Could not update handle {self.prefix}/{noid} - please try again, and contact your "
                                   f"admin if the issue persists.",
@@ -333,11 +388,14 @@ class ArkError(Exception):
 
 
 class ArkletAdapter:
+    TIMEOUT = (10, 60)
 
-    def __init__(self, address: str, naan: str, authenticationToken: str):
+    def __init__(self, address: str, naan: str, authenticationToken: str, poolSize: int = 10):
         self.arkletBaseUrl = address
         self.naan = naan
         self.headers = {"Authorization": f"Bearer {authenticationToken}"}
+        # minting is not idempotent, so only the updates are retried, see createPooledSession
+        self.session = createPooledSession(poolSize)
 
         if self.arkletBaseUrl.endswith("/"):
             self.arkletBaseUrl = self.arkletBaseUrl.rstrip("/")
@@ -346,7 +404,7 @@ class ArkletAdapter:
         mintUrl = self.arkletBaseUrl + "/mint"
         mintBody = {"naan": self.naan, "shoulder": shoulder}
         mintBody.update(details)
-        response = requests.post(mintUrl, headers=self.headers, json=mintBody)
+        response = self.session.post(mintUrl, headers=self.headers, json=mintBody, timeout=self.TIMEOUT)
         if response.ok:
             ark = response.json()["ark"]
             if ark:
@@ -364,7 +422,8 @@ class ArkletAdapter:
         ark = f"ark:/{self.naan}/{noid}"
         details["ark"] = ark
 
-        response = requests.put(url=self.arkletBaseUrl + "/update", headers=self.headers, json=details)
+        response = self.session.put(url=self.arkletBaseUrl + "/update", headers=self.headers, json=details,
+                                    timeout=self.TIMEOUT)
         if not response.ok:
             raise ArkError(
                 f"An error occurred while updating the ARK {ark} ({response.status_code} {response.reason}).",
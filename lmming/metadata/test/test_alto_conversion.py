@@ -0,0 +1,98 @@
+import os
+import tempfile
+from copy import deepcopy
+from pathlib import Path
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, SimpleTestCase
+from lxml import etree
+
+from metadata import xml_utils
+from metadata.alto_conversion import convertTree, convertTransfers
+from metadata.models import Job, Page, Report
+from metadata.test.utils import initDefaultValues, initDummyTransfer, TEST_REPORT, TEST_PAGES, PAGE_XML
+
+
+class ParsePageFileTests(SimpleTestCase):
+
+    def test_matchesTreeParser(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            source = Path(tmpDir) / "page.xml"
+            source.write_bytes(PAGE_XML.replace(b"</TextRegion>", b"</TextRegion><TextRegion id='r2'/><ImageRegion/>"
+                                                b"<TextRegion id='r3'><Coords points='1,2 3,4'/></TextRegion>"))
+            streamed = xml_utils.parsePageFile(source)
+            parsed = xml_utils.__dict__["__parsePage"](etree.parse(str(source)).getroot())
+        self.assertEqual(parsed, streamed)
+        self.assertEqual(["r1", "r3"], [region.id for region in streamed.regions])
+
+
+class ConvertTreeTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpDir.cleanup)
+        self.source = Path(self.tmpDir.name) / "page"
+        self.target = Path(self.tmpDir.name) / "alto"
+        (self.source / "nested").mkdir(parents=True)
+        for i in range(3):
+            (self.source / "nested" / f"page_{i}.xml").write_bytes(PAGE_XML)
+        (self.source / "already_alto.xml").write_bytes(b"<alto xmlns='http://www.loc.gov/standards/alto/ns-v4#'/>")
+
+    def test_convertAndSkip(self):
+        result = convertTree(self.source, self.target, workers=2)
+        self.assertEqual((3, 0, []), (result.converted, result.skipped, result.failed))
+        alto = (self.target / "nested" / "page_1.xml").read_text()
+        self.assertIn("<fileName>page_1.jpg</fileName>", alto)
+        self.assertFalse((self.target / "already_alto.xml").exists())
+
+        result = convertTree(self.source, self.target, workers=2)
+        self.assertEqual((0, 3), (result.converted, result.skipped))
+
+        changed = self.source / "nested" / "page_0.xml"
+        os.utime(changed, (changed.stat().st_mtime + 10, changed.stat().st_mtime + 10))
+        self.assertEqual(1, convertTree(self.source, self.target, workers=1).converted)
+
+    def test_failuresReported(self):
+        (self.source / "broken.xml").write_bytes(b"<PcGts><Page/></PcGts>")
+        result = convertTree(self.source, self.target, workers=1)
+        self.assertEqual(3, result.converted)
+        self.assertEqual([str(self.source / "broken.xml")], [source for source, _ in result.failed])
+
+
+class ConvertTransfersTests(TestCase):
+
+    def setUp(self):
+        initDefaultValues()
+        reportData = deepcopy(TEST_REPORT)
+        reportData.update({"coverage": Report.UnionLevel.WORKPLACE, "isFormatOf": [Report.DocumentFormat.PRINTED]})
+        pageData = deepcopy(TEST_PAGES)
+        pageData[0]["transcriptionFile"] = SimpleUploadedFile("page_01.xml", PAGE_XML)
+        pageData[1]["transcriptionFile"] = SimpleUploadedFile("alto_02.xml", b"<alto xmlns='x'/>")
+        self.transfer = Job.objects.get(pk=initDummyTransfer(reportData, pageData)).transfer
+
+    def tearDown(self):
+        for page in Page.objects.all():
+            page.delete()
+
+    def test_fillsExportCache(self):
+        result = convertTransfers([self.transfer], workers=1)
+        self.assertEqual((1, 0), (result.converted, result.skipped))
+        self.assertEqual([Page.TranscriptionFormat.PAGE, Page.TranscriptionFormat.ALTO],
+                         list(Page.objects.order_by("order").values_list("transcriptionFormat", flat=True)))
+
+        page = Page.objects.get(order=1)
+        source = Path(page.transcriptionFile.path)
+        self.assertTrue(xml_utils.convertedAltoPath(source, xml_utils.conversionKey(source)).exists())
+
+        result = convertTransfers([self.transfer], workers=1)
+        self.assertEqual((0, 1), (result.converted, result.skipped))
+
+    def test_deleteRemovesConvertedFiles(self):
+        convertTransfers([self.transfer], workers=1)
+        page = Page.objects.get(order=1)
+        source = Path(page.transcriptionFile.path)
+        converted = xml_utils.convertedAltoPath(source, xml_utils.conversionKey(source))
+
+        page.delete()
+        self.assertFalse(source.exists())
+        self.assertFalse(converted.exists())
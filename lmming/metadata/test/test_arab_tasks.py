@@ -151,15 +151,16 @@ class ArabMintHandleTests(TestCase):
             page.delete()
 
     @mock.patch("metadata.tasks.utils.signBytesSHA256", side_effect=mockSign)
-    @mock.patch("requests.get", side_effect=mockGet)
-    @mock.patch("requests.post", side_effect=mockPost)
-    @mock.patch("requests.put", side_effect=mockPut)
+    @mock.patch("requests.Session.get", side_effect=mockGet)
+    @mock.patch("requests.Session.post", side_effect=mockPost)
+    @mock.patch("requests.Session.put", side_effect=mockPut)
     @mock.patch("secrets.choice", side_effect=mockPIDGen)
     def test_mintSuccess(self, _mockPidGen, _mockPut, _mockPost, _mockGet, _mockSign):
         with self.settings(ARAB_HANDLE_PREFIX="12345", IIIF_BASE_URL="http://iiif.example.com",
                            ARAB_PRIVATE_KEY_FILE=str(Path("./metadata/test/cert_test.pem").resolve()),
                            ARAB_HANDLE_IP="127.0.0.1", ARAB_HANDLE_PORT=8000, ARAB_HANDLE_ADMIN="0.NA/6789",
-                           ARCHIVE_INST="ARAB", ARAB_RETRIES=3, ARAB_HANDLE_ADDRESS="hdl.example.com", ARAB_CERT_FILE="file.dummy"):
+                           ARCHIVE_INST="ARAB", ARAB_RETRIES=3, ARAB_HANDLE_ADDRESS="hdl.example.com", ARAB_CERT_FILE="file.dummy",
+                           ARAB_HANDLE_WORKERS=2, ARAB_HANDLE_RATE=0, ARAB_NOID_POOL_SIZE=0):
             initDefaultValues({"yearOffset": -1, "language": "test", "license": "license"})
             initDummyFilemaker()
             jobId = initDummyTransfer(archive="ARAB", reportData={})
@@ -175,13 +176,14 @@ class ArabMintHandleTests(TestCase):
                 self.assertEqual(f"http://iiif.example.com/iiif/image/xxxxxxxxxxxxxxx_{page.order}/info.json",
                                  page.identifier)
 
-    @mock.patch("requests.post", side_effect=mockPost)
-    @mock.patch("requests.get", side_effect=mockGetHandleExists)
+    @mock.patch("requests.Session.post", side_effect=mockPost)
+    @mock.patch("requests.Session.get", side_effect=mockGetHandleExists)
     def test_exceedRetries(self, _mockGet, _mockPost):
         with self.settings(ARCHIVE_INST="ARAB", ARAB_HANDLE_PREFIX="12345", IIIF_BASE_URL="http://iiif.example.com",
                            ARAB_PRIVATE_KEY_FILE=str(Path("./metadata/test/cert_test.pem").resolve()),
                            ARAB_HANDLE_IP="127.0.0.1", ARAB_HANDLE_PORT=8000, ARAB_HANDLE_ADMIN="0.NA/6789",
-                           ARAB_RETRIES=3, ARAB_HANDLE_ADDRESS="hdl.example.com", ARAB_CERT_FILE="file.dummy"):
+                           ARAB_RETRIES=3, ARAB_HANDLE_ADDRESS="hdl.example.com", ARAB_CERT_FILE="file.dummy",
+                           ARAB_HANDLE_WORKERS=2, ARAB_HANDLE_RATE=0, ARAB_NOID_POOL_SIZE=0):
             initDefaultValues({"yearOffset": -1, "language": "test", "license": "license"})
             initDummyFilemaker()
             jobId = initDummyTransfer(archive="ARAB", reportData={})
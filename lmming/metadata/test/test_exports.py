@@ -0,0 +1,129 @@
+import tempfile
+import zipfile
+from copy import deepcopy
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from metadata.exports import ExportRequest, fingerprint, artefactPath, claim, writeExport
+from metadata.models import Report, Job, Page, ReportTranslation, FacSpecificData
+from metadata.test.utils import initDefaultValues, initDummyTransfer, TEST_REPORT, TEST_PAGES
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpDir.cleanup)
+        exportSettings = override_settings(EXPORT_DIR=Path(self.tmpDir.name), ARCHIVE_INST="ARAB",
+                                           CELERY_TASK_ALWAYS_EAGER=True)
+        exportSettings.enable()
+        self.addCleanup(exportSettings.disable)
+
+        initDefaultValues()
+        reportData = deepcopy(TEST_REPORT)
+        reportData.update({"coverage": Report.UnionLevel.WORKPLACE, "isFormatOf": [Report.DocumentFormat.PRINTED]})
+        pageData = deepcopy(TEST_PAGES)
+        for page in pageData:
+            page["works"] = []
+        self.transfer = Job.objects.get(pk=initDummyTransfer(reportData, pageData)).transfer
+        self.export = ExportRequest("zip", [self.transfer.pk], forArab=True)
+        self.url = reverse("metadata:download_transfer", args=[self.transfer.pk, "zip"])
+
+    def tearDown(self):
+        for page in Page.objects.all():
+            page.delete()
+
+    def test_fingerprintChangesWithPages(self):
+        before = fingerprint(self.export)
+        self.assertEqual(before, fingerprint(self.export))
+        self.assertNotEqual(before, fingerprint(ExportRequest("zip_restricted", [self.transfer.pk], forArab=True)))
+
+        page = Page.objects.filter(report__transfer=self.transfer).first()
+        page.persons = ["Anna"]
+        page.save()
+        self.assertNotEqual(before, fingerprint(self.export))
+
+    def test_fingerprintChangesWithTranslations(self):
+        report = Report.objects.get(transfer=self.transfer)
+        translation = ReportTranslation.objects.create(report=report, language="en", description="first")
+        artefact = artefactPath(self.export, fingerprint(self.export))
+        claim(artefact)
+        writeExport(self.export, artefact)
+
+        translation.description = "second"
+        translation.save()
+        updated = artefactPath(self.export, fingerprint(self.export))
+        self.assertNotEqual(artefact, updated)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(self.url, HTTP_HX_REQUEST="true")
+        self.assertTrue(updated.exists())
+        self.assertFalse(artefact.exists())
+
+        before = fingerprint(self.export)
+        FacSpecificData.objects.create(report=report, seriesVolumeName="volume")
+        self.assertNotEqual(before, fingerprint(self.export))
+        before = fingerprint(self.export)
+        with self.settings(IIIF_BASE_URL="https://iiif.example.org/other/"):
+            self.assertNotEqual(before, fingerprint(self.export))
+
+    def test_htmxFlow(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(self.url, HTTP_HX_REQUEST="true")
+        self.assertTemplateUsed(response, "modal/export.html")
+        self.assertContains(response, 'hx-trigger="every 2s"')
+
+        response = self.client.get(self.url, HTTP_HX_REQUEST="true")
+        self.assertNotContains(response, 'hx-trigger="every 2s"')
+        self.assertContains(response, f'href="{self.url}"')
+
+        response = self.client.get(self.url)
+        self.assertEqual("bytes", response["Accept-Ranges"])
+        with zipfile.ZipFile(BytesIO(b"".join(response.streaming_content))) as zf:
+            self.assertIn("items.csv", zf.namelist())
+
+    def test_cachedArtefactNotRebuilt(self):
+        artefact = artefactPath(self.export, fingerprint(self.export))
+        self.assertTrue(claim(artefact))
+        writeExport(self.export, artefact)
+
+        with mock.patch("metadata.exports.buildFolderStructure") as build:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.get(self.url)
+        build.assert_not_called()
+        self.assertEqual(artefact.read_bytes(), b"".join(response.streaming_content))
+
+    def test_concurrentClaim(self):
+        artefact = artefactPath(self.export, fingerprint(self.export))
+        self.assertTrue(claim(artefact))
+        self.assertFalse(claim(artefact))
+        with self.settings(EXPORT_TIMEOUT=-1):
+            self.assertTrue(claim(artefact))
+
+    def test_rangeRequest(self):
+        artefact = artefactPath(self.export, fingerprint(self.export))
+        claim(artefact)
+        writeExport(self.export, artefact)
+        content = artefact.read_bytes()
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=100-")
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(f"bytes 100-{len(content) - 1}/{len(content)}", response["Content-Range"])
+        self.assertEqual(content[100:], b"".join(response.streaming_content))
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-10")
+        self.assertEqual(content[-10:], b"".join(response.streaming_content))
+
+        response = self.client.get(self.url, HTTP_RANGE=f"bytes={len(content)}-")
+        self.assertEqual(416, response.status_code)
+
+    def test_failedBuild(self):
+        with mock.patch("metadata.exports.buildFolderStructure", side_effect=ValueError("broken")):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.get(self.url, HTTP_HX_REQUEST="true")
+        response = self.client.get(self.url, HTTP_HX_REQUEST="true")
+        self.assertContains(response, "ValueError: broken")
+        self.assertFalse(artefactPath(self.export, fingerprint(self.export)).with_suffix(".part").exists())
@@ -5,8 +5,9 @@ from unittest import mock
 from django.test import TestCase
 
 from metadata.models import Report, ProcessingStep, Status, Page
+from metadata.stand_ins import ArkletServer
 from metadata.tasks.fac import computeFromExistingFields, mintArks
-from metadata.test.utils import initDefaultValues, initDummyTransfer, initDummyFilemaker, TEST_PAGES
+from metadata.test.utils import initDefaultValues, initDummyTransfer, initDummyFilemaker, TEST_PAGES, TEST_REPORT
 
 
 class ComputeFromExistingFieldsTests(TestCase):
@@ -131,167 +132,121 @@ class ComputeFromExistingFieldsTests(TestCase):
         self.assertIn("offset is negative", step.log)
 
 
-class MockResponse:
-    def __init__(self, json_data, status_code, ok):
-        self.json_data = json_data
-        self.status_code = status_code
-        self.ok = ok
-
-    def json(self):
-        return self.json_data
-
-
-def successfulPost(*_args, **_kwargs):
-    return MockResponse({"ark": "ark:/12345/testabc"}, 200, True)
-
-
-def successfulPut(*_args, **_kwargs):
-    return MockResponse({"ark": "ark:/12345/testabc"}, 200, True)
-
-
-def failedPost(*_args, **_kwargs):
-    return MockResponse({}, 404, False)
-
-
-def failedPut(*_args, **_kwargs):
-    return MockResponse({}, 404, False)
-
-
 class MintArkTests(TestCase):
 
     def setUp(self):
         logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        self.server = ArkletServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        minterSettings = self.settings(MINTER_URL=self.server.address, MINTER_ORG_ID="12345",
+                                       IIIF_BASE_URL="http://iiif.example.com/", MINTER_AUTH="auth",
+                                       MINTER_WORKERS=2, MINTER_RATE=0, MINTER_NOID_POOL_SIZE=0)
+        minterSettings.enable()
+        self.addCleanup(minterSettings.disable)
 
     def tearDown(self):
         for page in Page.objects.all():
             page.delete()
 
-    @mock.patch('requests.put', side_effect=successfulPut)
-    @mock.patch('requests.post', side_effect=successfulPost)
-    def test_task(self, mockPost, mockPut):
-        with self.settings(MINTER_URL="http://example.com", MINTER_ORG_ID="12345",
-                           IIIF_BASE_URL="http://iiif.example.com", MINTER_AUTH="auth"):
-            initDefaultValues()
-            initDummyFilemaker()
-            jobId = initDummyTransfer({"unionId": "1", "title": "test title"})
+    def __mint(self, reportData=None, pageCount: int = 2, values=None) -> int:
+        initDefaultValues(values)
+        initDummyFilemaker()
+        if reportData is None:
+            reportData = {"unionId": "1", "title": "test title"}
+        jobId = initDummyTransfer(reportData, pageData=[{"order": i + 1} for i in range(pageCount)])
+        mintArks(jobId, False)
+        return jobId
+
+    @staticmethod
+    def __step(jobId: int) -> ProcessingStep:
+        return ProcessingStep.objects.get(job_id=jobId,
+                                          processingStepType=ProcessingStep.ProcessingStepType.MINT_ARKS.value)
+
+    def test_task(self):
+        with self.settings(MINTER_NOID_POOL_SIZE=10), \
+                mock.patch("metadata.tasks.fac.refillArkNoids") as refill, \
+                self.captureOnCommitCallbacks(execute=True):
+            jobId = self.__mint()
+
+        self.assertEqual(Status.COMPLETE, self.__step(jobId).status, self.__step(jobId).log)
+        r = Report.objects.get(job=jobId)
+        self.assertEqual("r1", r.noid)
+        self.assertEqual("https://ark.fauppsala.se/ark:/12345/r1", r.identifier)
+        self.assertEqual("http://iiif.example.com/iiif/presentation/r1/manifest",
+                         self.server.arks["ark:/12345/r1"]["url"])
+        self.assertEqual(f"https://ark.fauppsala.se/ark:/12345/{r.referencesNoid}", r.references)
+        for page in r.page_set.all():
+            self.assertEqual(f"https://ark.fauppsala.se/ark:/12345/{page.noid}/info.json", page.identifier)
+            self.assertEqual(f"http://iiif.example.com/iiif/image/{page.noid}",
+                             self.server.arks[f"ark:/12345/{page.noid}"]["url"])
+            self.assertIn(f"page ID: {page.noid}", page.bibCitation)
+        self.assertEqual([mock.call("/r"), mock.call("/p")],
+                         sorted(refill.delay.call_args_list, key=lambda call: call.args, reverse=True))
 
-            mintArks(jobId, False)
+    def test_missingShoulder(self):
+        jobId = self.__mint(values={})
 
-            r = Report.objects.get(job=jobId)
-            self.assertEqual("testabc", r.noid)
-            self.assertEqual("https://ark.fauppsala.se/ark:/12345/testabc/manifest", r.identifier)
-            self.assertIn(mock.call('http://example.com/mint', headers={"Authorization": "Bearer auth"},
-                                    json={"naan": "12345", "shoulder": "/test"}), mockPost.call_args_list)
+        self.assertEqual(Status.ERROR, self.__step(jobId).status)
+        self.assertIn("ARK Shoulder for reports is not set", self.__step(jobId).log)
+        self.assertEqual([], self.server.requests)
 
-            self.assertIn(mock.call(url='http://example.com/update', headers={"Authorization": "Bearer auth"},
-                                    json={"ark": "ark:/12345/testabc", "title": "test title",
-                                          "url": "http://iiif.example.com/iiif/presentation/testabc"}),
-                          mockPut.call_args_list)
+    def test_missingPageShoulder(self):
+        jobId = self.__mint(values={"reportArkShoulder": "/r"})
 
-            for page in r.page_set.all():
-                self.assertEqual(f"testabc_{page.order}", page.iiifId)
+        self.assertEqual(Status.ERROR, self.__step(jobId).status)
+        self.assertIn("ARK Shoulder for pages is not set", self.__step(jobId).log)
 
-    def test_missingShoulder(self):
-        with self.settings(MINTER_URL="http://example.com", MINTER_ORG_ID="12345",
-                           IIIF_BASE_URL="http://iiif.example.com", MINTER_AUTH="auth"):
-            initDefaultValues({})
-            initDummyFilemaker()
-            jobId = initDummyTransfer({"unionId": "1", "title": "test title"})
+    def test_emptyShoulder(self):
+        jobId = self.__mint(values={"reportArkShoulder": "", "pageArkShoulder": "/p"})
 
-            mintArks(jobId, False)
+        self.assertEqual(Status.ERROR, self.__step(jobId).status)
+        self.assertIn("ARK Shoulder for reports is not set", self.__step(jobId).log)
 
-            step = ProcessingStep.objects.get(job_id=jobId,
-                                              processingStepType=ProcessingStep.ProcessingStepType.MINT_ARKS.value)
-            self.assertEqual(step.status, Status.ERROR)
-            self.assertIn("ARK Shoulder is not set", step.log)
+    def test_invalidShoulder(self):
+        jobId = self.__mint(values={"reportArkShoulder": "/r", "pageArkShoulder": "invalid"})
 
-    def test_emptyShoulder(self):
-        with self.settings(MINTER_URL="http://example.com", MINTER_ORG_ID="12345",
-                           IIIF_BASE_URL="http://iiif.example.com", MINTER_AUTH="auth"):
-            initDefaultValues({"arkShoulder": ""})
-            initDummyFilemaker()
-            jobId = initDummyTransfer({"unionId": "1", "title": "test title"})
+        self.assertEqual(Status.ERROR, self.__step(jobId).status)
+        self.assertIn("ARK Shoulder for pages should start with a slash", self.__step(jobId).log)
 
-            mintArks(jobId, False)
+    def test_mintingFailure(self):
+        self.server.token = "other"
+        jobId = self.__mint()
 
-            step = ProcessingStep.objects.get(job_id=jobId,
-                                              processingStepType=ProcessingStep.ProcessingStepType.MINT_ARKS.value)
-            self.assertEqual(step.status, Status.ERROR)
-            self.assertIn("ARK Shoulder is empty", step.log)
+        self.assertEqual("", Report.objects.get(job=jobId).noid)
+        self.assertEqual(Status.ERROR, self.__step(jobId).status)
+        self.assertIn("error occurred while obtaining a new ARK", self.__step(jobId).log)
 
-    def test_invalidShoulder(self):
-        with self.settings(MINTER_URL="http://example.com", MINTER_ORG_ID="12345",
-                           IIIF_BASE_URL="http://iiif.example.com", MINTER_AUTH="auth"):
-            initDefaultValues({"arkShoulder": "invalid"})
-            initDummyFilemaker()
-            jobId = initDummyTransfer({"unionId": "1", "title": "test title"})
-
-            mintArks(jobId, False)
-
-            step = ProcessingStep.objects.get(job_id=jobId,
-                                              processingStepType=ProcessingStep.ProcessingStepType.MINT_ARKS.value)
-            self.assertEqual(step.status, Status.ERROR)
-            self.assertIn("should start with a slash", step.log)
-
-    @mock.patch('requests.post', side_effect=failedPost)
-    def test_mintingFailur(self, _failedPostMock):
-        with self.settings(MINTER_URL="http://example.com", MINTER_ORG_ID="12345",
-                           IIIF_BASE_URL="http://iiif.example.com", MINTER_AUTH="auth"):
-            initDefaultValues()
-            initDummyFilemaker()
-            jobId = initDummyTransfer({"unionId": "1", "title": "test title"})
-
-            mintArks(jobId, False)
-
-            r = Report.objects.get(job=jobId)
-            self.assertEqual("", r.noid)
-
-            step = ProcessingStep.objects.get(job_id=jobId,
-                                              processingStepType=ProcessingStep.ProcessingStepType.MINT_ARKS.value)
-            self.assertEqual(step.status, Status.ERROR)
-            self.assertIn("error occurred while obtaining a new ARK", step.log)
-
-    @mock.patch('requests.put', side_effect=failedPut)
-    @mock.patch('requests.post', side_effect=successfulPost)
-    def test_updateFailure(self, successfulPostMock, _failedPutMock):
-        with self.settings(MINTER_URL="http://example.com", MINTER_ORG_ID="12345",
-                           IIIF_BASE_URL="http://iiif.example.com", MINTER_AUTH="auth"):
-            initDefaultValues()
-            initDummyFilemaker()
-            jobId = initDummyTransfer({"unionId": "1", "title": "test title"})
-
-            mintArks(jobId, False)
-
-            r = Report.objects.get(job=jobId)
-            self.assertEqual("testabc", r.noid)
-            for page in r.page_set.all():
-                self.assertEqual(f"testabc_{page.order}", page.iiifId)
-
-            self.assertEqual("https://ark.fauppsala.se/ark:/12345/testabc/manifest", r.identifier)
-            self.assertIn(mock.call('http://example.com/mint', headers={"Authorization": "Bearer auth"},
-                                    json={"naan": "12345", "shoulder": "/test"}), successfulPostMock.call_args_list)
-
-            step = ProcessingStep.objects.get(job_id=jobId,
-                                              processingStepType=ProcessingStep.ProcessingStepType.MINT_ARKS.value)
-            self.assertEqual(step.status, Status.ERROR)
-            self.assertIn("error occurred while updating the ARK", step.log)
-
-    @mock.patch('requests.put', side_effect=successfulPut)
-    @mock.patch('requests.post', side_effect=successfulPost)
-    def test_existingNoid(self, successfulPostMock, successfulPutMock):
-        with self.settings(MINTER_URL="http://example.com", MINTER_ORG_ID="12345",
-                           IIIF_BASE_URL="http://iiif.example.com", MINTER_AUTH="auth"):
-            initDefaultValues()
-            initDummyFilemaker()
-            jobId = initDummyTransfer()
-
-            mintArks(jobId, False)
-
-            r = Report.objects.get(job=jobId)
-            self.assertEqual("testbcd", r.noid)
-            self.assertEqual("http://ark.example.com/ark:/12345/testbcd/manifest", r.identifier)
-            self.assertFalse(successfulPostMock.called)
-            self.assertIn(mock.call(url='http://example.com/update', headers={"Authorization": "Bearer auth"},
-                                    json={"ark": "ark:/12345/testbcd", "title": "title",
-                                          "url": "http://iiif.example.com/iiif/presentation/testbcd"}),
-                          successfulPutMock.call_args_list)
+    def test_pageUpdateFailure(self):
+        self.server.failing.update({"ark:/12345/p3", "ark:/12345/p4"})  # the report and its references get r1 and r2
+        jobId = self.__mint(pageCount=3)
+
+        step = self.__step(jobId)
+        self.assertEqual(Status.ERROR, step.status)
+        self.assertEqual(2, len(step.log.splitlines()))
+        self.assertTrue(all(line.startswith("Page ") for line in step.log.splitlines()))
+        self.assertIn("error occurred while updating the ARK", step.log)
+        pages = Report.objects.get(job=jobId).page_set.order_by("order")
+        self.assertEqual(1, len([page for page in pages if page.registeredHash]))
+        self.assertTrue(all(page.noid for page in pages))
+
+    def test_existingNoid(self):
+        jobId = self.__mint(dict(TEST_REPORT, referencesNoid="refs"))
+
+        self.assertEqual(Status.COMPLETE, self.__step(jobId).status, self.__step(jobId).log)
+        r = Report.objects.get(job=jobId)
+        self.assertEqual("testbcd", r.noid)
+        self.assertEqual("http://ark.example.com/ark:/12345/testbcd", r.identifier)
+        self.assertEqual({"ark": "ark:/12345/testbcd", "title": "title",
+                          "url": "http://iiif.example.com/iiif/presentation/testbcd/manifest"},
+                         self.server.arks["ark:/12345/testbcd"])
+        self.assertEqual(2, self.server.mintCount)  # only the pages
+
+    def test_existingNoidWithoutIdentifier(self):
+        # the noid was saved in an earlier run, but its ARK could not be updated
+        jobId = self.__mint({"unionId": "1", "title": "test title", "noid": "saved"})
+
+        self.assertEqual(Status.COMPLETE, self.__step(jobId).status, self.__step(jobId).log)
+        self.assertEqual("https://ark.fauppsala.se/ark:/12345/saved", Report.objects.get(job=jobId).identifier)
+        self.assertIn("ark:/12345/saved", self.server.arks)
@@ -0,0 +1,250 @@
+import os
+import tempfile
+import zipfile
+from datetime import date
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from metadata.ingest import ingestTransfer, groupTranscriptionFiles, ingestZipTransfer, importOmekaTransfer
+from metadata.models import Report, Page, Job, ProcessingStep, Status, Pipeline, ExtractionTransfer, ReportTranslation
+from metadata.partials import FAC_PROCESSING_STEP_INITIAL
+
+STEP_CONFIG = [{"stepType": ProcessingStep.ProcessingStepType.FILENAME, "mode": "AUTOMATIC", "humanValidation": False},
+               {"stepType": ProcessingStep.ProcessingStepType.NER, "mode": "AUTOMATIC", "humanValidation": True}]
+
+
+def uploads(reports: int, pagesPerReport: int):
+    return [SimpleUploadedFile(f"fac_{r + 1:05d}_arsberattelse_1991_sid-{p + 1:02d}.xml", b"<xml/>")
+            for r in range(reports) for p in range(pagesPerReport)]
+
+
+class IngestTransferTests(TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpDir.cleanup)
+        mediaSettings = override_settings(MEDIA_ROOT=self.tmpDir.name)
+        mediaSettings.enable()
+        self.addCleanup(mediaSettings.disable)
+
+    def test_groupTranscriptionFiles(self):
+        groups = groupTranscriptionFiles(uploads(2, 3) + [SimpleUploadedFile("invalid.xml", b"")])
+        self.assertEqual(2, len(groups))
+        self.assertEqual([3, 3], [len(pages) for pages in groups.values()])
+
+    def test_createsTransfer(self):
+        transfer = ingestTransfer("name", "handler", Pipeline.ARAB_OTHER, uploads(3, 2), STEP_CONFIG)
+
+        self.assertEqual(Status.PENDING, transfer.status)
+        self.assertEqual(3, Report.objects.filter(transfer=transfer, publisher="SE/ARAB").count())
+        pages = Page.objects.filter(report__transfer=transfer).order_by("report", "order")
+        self.assertEqual([1, 2] * 3, [page.order for page in pages])
+        self.assertTrue(all(page.transcriptionFile.storage.exists(page.transcriptionFile.name) for page in pages))
+        self.assertEqual({Status.PENDING}, set(Job.objects.filter(transfer=transfer).values_list("status", flat=True)))
+        self.assertEqual(6, ProcessingStep.objects.filter(job__transfer=transfer).count())
+
+    def test_initialStatuses(self):
+        config = [dict(STEP_CONFIG[0], status=Status.COMPLETE), STEP_CONFIG[1]]
+        transfer = ingestTransfer("name", "", Pipeline.FAC, uploads(2, 1), config)
+
+        self.assertEqual(Status.IN_PROGRESS, transfer.status)
+        for job in Job.objects.filter(transfer=transfer):
+            self.assertEqual(Status.IN_PROGRESS, job.status)
+            self.assertIsNotNone(job.startDate)
+
+    def test_constantQueryCount(self):
+        counts = []
+        for reports in [2, 20]:
+            with CaptureQueriesContext(connection) as queries:
+                ingestTransfer("name", "", Pipeline.FAC, uploads(reports, 4), STEP_CONFIG)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_noValidFiles(self):
+        transfer = ingestTransfer("name", "", Pipeline.FAC, [SimpleUploadedFile("invalid.xml", b"")], STEP_CONFIG)
+        self.assertEqual(Status.AWAITING_HUMAN_VALIDATION, transfer.status)
+        self.assertFalse(Report.objects.filter(transfer=transfer).exists())
+        self.assertRaises(TypeError, ingestTransfer, "name", "", Pipeline.FAC, uploads(1, 1), [])
+
+
+def zipArchive(name: str, members: dict) -> SimpleUploadedFile:
+    content = BytesIO()
+    with zipfile.ZipFile(content, "w", zipfile.ZIP_DEFLATED) as archive:
+        for memberName, data in members.items():
+            archive.writestr(memberName, data)
+    return SimpleUploadedFile(name, content.getvalue(), content_type="application/zip")
+
+
+class ZipIngestTests(TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpDir.cleanup)
+        mediaSettings = override_settings(MEDIA_ROOT=self.tmpDir.name, ARCHIVE_INST="FAC")
+        mediaSettings.enable()
+        self.addCleanup(mediaSettings.disable)
+
+    def tearDown(self):
+        for page in Page.objects.all():
+            page.delete()
+
+    def __post(self, archives):
+        data = {"processName": "zipped", "handlerName": "", "zipFile": archives,
+                "form-TOTAL_FORMS": len(FAC_PROCESSING_STEP_INITIAL),
+                "form-INITIAL_FORMS": len(FAC_PROCESSING_STEP_INITIAL)}
+        for i, step in enumerate(FAC_PROCESSING_STEP_INITIAL):
+            data[f"form-{i}-mode"] = step["mode"]
+        return self.client.post(f"{reverse('metadata:create_transfer')}?source=zip", data)
+
+    def test_createFromArchives(self):
+        first = zipArchive("first.zip", {
+            "collection/fac_00001_arsberattelse_1991_sid-01.xml": b"page 1",
+            "collection/nested/fac_00001_arsberattelse_1991_sid-02.xml": b"page 2",
+            "__MACOSX/collection/._fac_00001_arsberattelse_1991_sid-01.xml": b"resource fork",
+            "collection/readme.pdf": b"ignored", "collection/invalid.xml": b"ignored"})
+        second = zipArchive("second.zip", {"fac_00002_arsberattelse_1992_sid-01.txt": b"page 3"})
+
+        response = self.__post([first, second])
+        transfer = ExtractionTransfer.objects.get(name="zipped")
+        self.assertRedirects(response, reverse("metadata:verify_transfer", args=[transfer.pk]),
+                             fetch_redirect_response=False)
+        self.assertEqual(2, transfer.report_set.count())
+        pages = {page.originalFileName: Path(page.transcriptionFile.path).read_bytes()
+                 for page in Page.objects.filter(report__transfer=transfer)}
+        self.assertEqual({"fac_00001_arsberattelse_1991_sid-01.xml": b"page 1",
+                          "fac_00001_arsberattelse_1991_sid-02.xml": b"page 2",
+                          "fac_00002_arsberattelse_1992_sid-01.txt": b"page 3"}, pages)
+
+        response = self.client.get(response.url)
+        self.assertContains(response, "Skipped 1 file(s) with unexpected names: collection/invalid.xml")
+
+    def test_invalidArchive(self):
+        response = self.__post([SimpleUploadedFile("broken.zip", b"not a zip")])
+        self.assertEqual(200, response.status_code)
+        self.assertContains(response, "is not a ZIP archive")
+        self.assertFalse(ExtractionTransfer.objects.exists())
+
+    def test_failureRemovesStoredFiles(self):
+        archive = zipArchive("a.zip", {"fac_00001_arsberattelse_1991_sid-01.xml": b"page 1"})
+        with mock.patch("metadata.ingest.buildTransfer", side_effect=ValueError("broken")):
+            self.assertRaises(ValueError, ingestZipTransfer, "name", "", Pipeline.FAC, [archive], STEP_CONFIG)
+        self.assertEqual([], os.listdir(self.tmpDir.name))
+
+
+def omekaExport(reports: int, pagesPerReport: int):
+    structure, items, media, files = {}, [], [], {}
+    for r in range(reports):
+        noid = f"r{r:05d}"
+        pages = []
+        for p in range(pagesPerReport):
+            filename = f"fac_{r + 1:05d}_arsberattelse_1991_sid-{p + 1:02d}.xml"
+            pages.append({"id": f"p{r:05d}x{p:02d}", "filename": filename, "order": str(p + 1)})
+            files[filename] = SimpleUploadedFile(filename, b"<xml/>")
+            media.append({"dcterms:identifier": f"https://iiif.example.org/iiif/image/p{r:05d}x{p:02d}/info.json",
+                          "lm:transcription": f"page {p + 1} ", "lm:normalised": "", "lm:person": "A | B",
+                          "lm:organisation": "", "lm:location": "", "lm:time": "", "lm:work": "", "lm:event": "",
+                          "lm:object": "", "lm:measure": "True" if p else "False"})
+        structure[noid] = {"title": f"report {r}", "pages": pages}
+        identifier = f"https://ark.example.org/ark:/12345/{noid}"
+        items.append({"dcterms:identifier": f"{identifier} {identifier}", "dcterms:title": f"report {r} ",
+                      "dcterms:creator": "creator", "dcterms:date": "1990--1991", "dcterms:coverage": "section",
+                      "dcterms:language": "sv", "dcterms:spatial": "Uppsala", "dcterms:type": "annual report",
+                      "dcterms:license": "CC0", "dcterms:isVersionOf": "", "dcterms:isFormatOf": "printed | digital",
+                      "dcterms:accessRights": "not restricted", "dcterms:relation": "", "dcterms:created": "1992",
+                      "dcterms:available": "2024-01-02", "dcterms:source": "", "dcterms:description": "",
+                      "dcterms:coverage.sv": "sektion", "dcterms:type.sv": "årsberättelse",
+                      "dcterms:isFormatOf.sv": "tryckt | digital", "dcterms:accessRights.sv": "ej begränsad",
+                      "dcterms:description.sv": ""})
+    return structure, pd.DataFrame(items), pd.DataFrame(media), files
+
+
+class ImportOmekaTransferTests(TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpDir.cleanup)
+        mediaSettings = override_settings(MEDIA_ROOT=self.tmpDir.name, ARCHIVE_INST="FAC")
+        mediaSettings.enable()
+        self.addCleanup(mediaSettings.disable)
+        self.config = [dict(entry, status=Status.COMPLETE) for entry in STEP_CONFIG]
+
+    def test_import(self):
+        structure, items, media, files = omekaExport(2, 2)
+        transfer, errors = importOmekaTransfer("name", "handler", Pipeline.FAC, structure, items, media, files,
+                                               self.config)
+
+        self.assertEqual([], errors)
+        self.assertEqual(Status.COMPLETE, transfer.status)
+        report = Report.objects.get(transfer=transfer, noid="r00001")
+        self.assertEqual("report 1", report.title)
+        self.assertEqual("2", report.unionId)
+        self.assertEqual([date(1990, 1, 1), date(1991, 1, 1)], report.date)
+        self.assertEqual(Report.UnionLevel.SECTION, report.coverage)
+        self.assertEqual([Report.DocumentFormat.PRINTED, Report.DocumentFormat.DIGITAL], report.isFormatOf)
+        self.assertEqual(Status.COMPLETE, report.job.status)
+        translation = ReportTranslation.objects.get(report=report)
+        self.assertEqual(("sv", "sektion", ["tryckt", "digital"]),
+                         (translation.language, translation.coverage, translation.isFormatOf))
+
+        pages = list(report.page_set.order_by("order"))
+        self.assertEqual(["p00001x00", "p00001x01"], [page.iiifId for page in pages])
+        self.assertEqual(["page 1", "page 2"], [page.transcription for page in pages])
+        self.assertEqual([False, True], [page.measures for page in pages])
+        self.assertEqual(["A", "B"], pages[0].persons)
+        self.assertTrue(all(page.transcriptionFile.storage.exists(page.transcriptionFile.name) for page in pages))
+
+    def test_missingEntries(self):
+        structure, items, media, files = omekaExport(3, 2)
+        items = items.drop(index=1)
+        media = media.drop(index=0)
+        del files["fac_00003_arsberattelse_1991_sid-02.xml"]
+
+        transfer, errors = importOmekaTransfer("name", "", Pipeline.FAC, structure, items, media, files, self.config)
+        self.assertEqual(["No entry for report ID r00001 in items.csv",
+                          "No entry for page ID p00000x00 in media.csv",
+                          "No transcription file fac_00003_arsberattelse_1991_sid-02.xml for page ID p00002x01"],
+                         sorted(errors, key=lambda e: e[-9:]))
+        self.assertEqual(2, transfer.report_set.count())
+        self.assertEqual(2, Page.objects.filter(report__transfer=transfer).count())
+
+    def test_identifierWithoutNoidSuffix(self):
+        structure, items, media, files = omekaExport(1, 1)
+        media.loc[0, "dcterms:identifier"] = "https://iiif.example.org/iiif/image/p00000x00/full/full/0/default.jpg"
+        transfer, errors = importOmekaTransfer("name", "", Pipeline.FAC, structure, items, media, files, self.config)
+        self.assertEqual([], errors)
+        self.assertEqual(1, Page.objects.filter(report__transfer=transfer).count())
+
+    def test_constantQueryCount(self):
+        counts = []
+        for reports in [2, 20]:
+            export = omekaExport(reports, 3)
+            with CaptureQueriesContext(connection) as queries:
+                importOmekaTransfer("name", "", Pipeline.FAC, *export, self.config)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_view(self):
+        structure, items, media, files = omekaExport(1, 2)
+        pages = "".join(f'<mets:div TYPE="page" ORDER="{page["order"]}" ID="{page["id"]}">'
+                        f'<mets:fptr FILEID="{page["filename"]}"/></mets:div>' for page in structure["r00000"]["pages"])
+        structMap = (f'<mets:structMap xmlns:mets="http://www.loc.gov/METS/"><mets:div TYPE="report" '
+                     f'LABEL="report 0" ID="r00000">{pages}</mets:div></mets:structMap>')
+        response = self.client.post(reverse("metadata:import_transfer"), {
+            "processName": "imported", "handlerName": "handler", "transcriptionFiles": list(files.values()),
+            "itemsFile": SimpleUploadedFile("items.csv", items.to_csv(index=False).encode()),
+            "mediaFile": SimpleUploadedFile("media.csv", media.to_csv(index=False).encode()),
+            "structMapFile": SimpleUploadedFile("mets_structmap.xml", structMap.encode())})
+
+        transfer = ExtractionTransfer.objects.get(name="imported")
+        self.assertRedirects(response, reverse("metadata:verify_transfer", args=[transfer.pk]),
+                             fetch_redirect_response=False)
+        self.assertEqual("handler", transfer.handler)
+        self.assertEqual(2, Page.objects.filter(report__transfer=transfer).count())
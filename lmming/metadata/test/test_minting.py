@@ -0,0 +1,496 @@
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from Crypto.PublicKey import RSA
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from metadata.models import Page, Report, ProcessingStep, Status, DefaultValueSettings, ReservedNoid, NoidPool
+from metadata.tasks.arab import arabMintHandle
+from metadata.tasks.fac import mintArks
+from metadata.tasks.minting import mintPageHandles, mintPageArks, RateLimiter, claimNoids, scheduleRefill, \
+    reserveHandleNoids, reserveArkNoids, mintPlainHandle, mintArk, refillArkNoids, handleNamespace, arkNamespace, \
+    finishRefill, REFILL_TIMEOUT
+from metadata.tasks.utils import HandleAdapter, Singleton, ArkletAdapter, HandleError, ArkError
+from metadata.stand_ins import HandleServer, ArkletServer
+from metadata.test.utils import initDummyTransfer, initDummyFilemaker
+
+IIIF_BASE = "http://iiif.example.com/"
+
+
+def describe(page, handle):
+    page.source = f"https://hdl.handle.net/{handle}?locatt=view:jpgfull"
+
+
+class MintPageHandlesTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        keyDir = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(keyDir.cleanup)
+        cls.keyFile = str(Path(keyDir.name) / "key.pem")
+        Path(cls.keyFile).write_bytes(RSA.generate(1024).export_key())
+
+    def setUp(self):
+        self.server = HandleServer(handles={"12345/taken": []})
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        Singleton._instances.pop(HandleAdapter, None)
+        self.addCleanup(Singleton._instances.pop, HandleAdapter, None)
+        host, port = self.server.address.rsplit(":", 1)
+        self.adapter = HandleAdapter(host, int(port), "12345", "0.NA/12345", self.keyFile, Path("unused"))
+
+    def tearDown(self):
+        for page in Page.objects.all():
+            page.delete()
+
+    def __pages(self, count: int, noids=()):
+        jobId = initDummyTransfer(archive="ARAB", pageData=[{"order": i + 1} for i in range(count)])
+        pages = list(Page.objects.filter(report__job=jobId).order_by("order"))
+        for page, noid in zip(pages, noids):
+            page.noid = noid
+        return pages
+
+    def test_mint(self):
+        pages = self.__pages(20, ["existing"])
+        with CaptureQueriesContext(connection) as queries:
+            errors = mintPageHandles(self.adapter, pages, IIIF_BASE, describe, 3, 4, 0)
+
+        self.assertEqual([], errors)
+        self.assertEqual(1, len([query for query in queries if query["sql"].startswith("UPDATE")]))
+        self.assertEqual(1, self.server.sessionCount)
+        self.assertEqual(21, len(self.server.handles))
+        for page in Page.objects.filter(pk__in=[p.pk for p in pages]):
+            self.assertEqual(page.noid, page.iiifId)
+            self.assertIn(f"12345/{page.noid}", self.server.handles)
+            self.assertEqual(f"https://hdl.handle.net/12345/{page.noid}?locatt=view:manifest", page.identifier)
+            self.assertEqual(f"https://hdl.handle.net/12345/{page.noid}?locatt=view:jpgfull", page.source)
+        self.assertEqual("existing", Page.objects.get(pk=pages[0].pk).noid)
+
+    def test_takenNoid(self):
+        pages = self.__pages(2)
+        with mock.patch("metadata.tasks.minting.generateNoid", side_effect=["taken", "first", "second"]):
+            errors = mintPageHandles(self.adapter, pages, IIIF_BASE, describe, 3, 2, 0)
+
+        self.assertEqual([], errors)
+        self.assertEqual({"first", "second"}, set(Page.objects.filter(pk__in=[p.pk for p in pages])
+                                                  .values_list("noid", flat=True)))
+
+    def test_exceedRetries(self):
+        pages = self.__pages(2, ["existing"])
+        with mock.patch("metadata.tasks.minting.generateNoid", return_value="taken"):
+            errors = mintPageHandles(self.adapter, pages, IIIF_BASE, describe, 3, 2, 0)
+
+        self.assertEqual(1, len(errors))
+        self.assertIn("unique handle", errors[0].userMessage)
+        self.assertEqual(["existing", ""], [p.noid for p in Page.objects.filter(pk__in=[p.pk for p in pages])
+                                           .order_by("order")])
+
+    def test_restart(self):
+        pages = self.__pages(3)
+        self.assertEqual([], mintPageHandles(self.adapter, pages, IIIF_BASE, describe, 3, 2, 0))
+        requestCount = len(self.server.requests)
+
+        pages = list(Page.objects.filter(pk__in=[p.pk for p in pages]).order_by("order"))
+        with CaptureQueriesContext(connection) as queries:
+            errors = mintPageHandles(self.adapter, pages, IIIF_BASE, describe, 3, 2, 0)
+        self.assertEqual([], errors)
+        self.assertEqual(requestCount, len(self.server.requests))
+        self.assertEqual(0, len(queries))
+
+        pages[0].registeredHash = ""
+        errors = mintPageHandles(self.adapter, pages, IIIF_BASE + "moved/", describe, 3, 2, 0)
+        self.assertEqual([], errors)
+        self.assertEqual(sorted(("PUT", f"/api/handles/12345/{page.noid}") for page in pages),
+                         sorted(request for request in self.server.requests[requestCount:] if request[0] == "PUT"))
+
+    def test_restartAfterFailure(self):
+        pages = self.__pages(2)
+        failure = HandleError("Could not update handle", "Could not update handle - response: 500")
+        with mock.patch.object(self.adapter, "updateLocationBasedHandle", side_effect=[failure, "12345/second"]), \
+                mock.patch("metadata.tasks.minting.generateNoid", side_effect=["first", "second"]):
+            errors = mintPageHandles(self.adapter, pages, IIIF_BASE, describe, 3, 1, 0)
+        self.assertEqual([failure], errors)
+        saved = list(Page.objects.filter(pk__in=[p.pk for p in pages]).order_by("order"))
+        self.assertEqual([("first", False), ("second", True)], [(p.noid, p.registeredHash != "") for p in saved])
+
+        ReservedNoid.objects.create(namespace=handleNamespace("12345"), noid="spare")
+        with mock.patch("metadata.tasks.minting.generateNoid") as generateNoid:
+            errors = mintPageHandles(self.adapter, saved, IIIF_BASE, describe, 3, 1, 0)
+
+        self.assertEqual([], errors)
+        self.assertFalse(generateNoid.called)
+        self.assertIn("12345/first", self.server.handles)
+        self.assertEqual("first", Page.objects.get(pk=saved[0].pk).noid)
+        self.assertEqual(["spare"], list(ReservedNoid.objects.values_list("noid", flat=True)))
+
+    def test_reservedNoids(self):
+        ReservedNoid.objects.bulk_create([ReservedNoid(namespace=handleNamespace("12345"), noid=noid)
+                                          for noid in ["reserved1", "reserved2"]])
+        pages = self.__pages(3)
+        with mock.patch("metadata.tasks.minting.generateNoid", return_value="generated"):
+            errors = mintPageHandles(self.adapter, pages, IIIF_BASE, describe, 3, 2, 0)
+
+        self.assertEqual([], errors)
+        self.assertFalse(ReservedNoid.objects.exists())
+        self.assertEqual(["reserved1", "reserved2", "generated"],
+                         [p.noid for p in Page.objects.filter(pk__in=[p.pk for p in pages]).order_by("order")])
+        self.assertEqual(1, len([request for request in self.server.requests if request[0] == "GET"]))
+
+    def test_reserveHandleNoids(self):
+        ReservedNoid.objects.create(namespace=handleNamespace("12345"), noid="first")
+        with mock.patch("metadata.tasks.minting.generateNoid", side_effect=["taken", "first", "second", "third"]):
+            errors = reserveHandleNoids(self.adapter, 2, 3, 2, 0)
+
+        self.assertEqual([], errors)
+        self.assertEqual({"first", "second", "third"},
+                         set(ReservedNoid.objects.filter(namespace=handleNamespace("12345"))
+                             .values_list("noid", flat=True)))
+
+    def test_mintPlainHandle(self):
+        ReservedNoid.objects.create(namespace=handleNamespace("12345"), noid="reserved")
+        report = Report.objects.get(job=initDummyTransfer(archive="ARAB", reportData={}))
+        handle = mintPlainHandle(self.adapter, report, "noid", "http://example.com/{}", 3)
+
+        self.assertEqual("12345/reserved", handle)
+        self.assertEqual("reserved", Report.objects.get(pk=report.pk).noid)
+        self.assertEqual("http://example.com/reserved", self.server.handles[handle][0]["data"]["value"])
+        self.assertNotIn("GET", [request[0] for request in self.server.requests])
+
+        with mock.patch("metadata.tasks.minting.generateNoid", return_value="taken"):
+            with self.assertRaisesRegex(HandleError, "unique handle"):
+                mintPlainHandle(self.adapter, report, "referencesNoid", "http://example.com/{}", 3)
+        self.assertEqual("", Report.objects.get(pk=report.pk).referencesNoid)
+
+    def test_mintPlainHandleFailure(self):
+        ReservedNoid.objects.create(namespace=handleNamespace("12345"), noid="reserved")
+        report = Report.objects.get(job=initDummyTransfer(archive="ARAB", reportData={}))
+        with mock.patch.object(self.adapter, "updatePlainHandle", side_effect=HandleError("failed", "failed")):
+            with self.assertRaises(HandleError):
+                mintPlainHandle(self.adapter, report, "noid", "http://example.com/{}", 3)
+
+        self.assertEqual("", Report.objects.get(pk=report.pk).noid)
+        self.assertEqual(["reserved"], list(ReservedNoid.objects.values_list("noid", flat=True)))
+
+    def test_reservedNoidTakenMeanwhile(self):
+        ReservedNoid.objects.bulk_create([ReservedNoid(namespace=handleNamespace("12345"), noid=noid)
+                                          for noid in ["taken", "free"]])
+        self.server.handles["12345/taken"] = ["someone else's"]
+        report = Report.objects.get(job=initDummyTransfer(archive="ARAB", reportData={}))
+        self.assertEqual("12345/free", mintPlainHandle(self.adapter, report, "noid", "http://example.com/{}", 3))
+        self.assertEqual(["someone else's"], self.server.handles["12345/taken"])
+        self.assertEqual("free", Report.objects.get(pk=report.pk).noid)
+
+        ReservedNoid.objects.bulk_create([ReservedNoid(namespace=handleNamespace("12345"), noid=noid)
+                                          for noid in ["taken", "reserved"]])
+        pages = self.__pages(3)
+        with mock.patch("metadata.tasks.minting.generateNoid", side_effect=["generated", "another"]):
+            errors = mintPageHandles(self.adapter, pages, IIIF_BASE, describe, 3, 2, 0)
+
+        self.assertEqual([], errors)
+        self.assertEqual(["someone else's"], self.server.handles["12345/taken"])
+        self.assertEqual(["another", "reserved", "generated"],
+                         [p.noid for p in Page.objects.filter(pk__in=[p.pk for p in pages]).order_by("order")])
+        self.assertFalse(ReservedNoid.objects.exists())
+
+    def test_task(self):
+        jobId = initDummyTransfer(archive="ARAB", pageData=[{"order": i + 1} for i in range(5)],
+                                  reportData={"title": "title"})
+        host, port = self.server.address.rsplit(":", 1)
+        with self.settings(ARAB_HANDLE_ADDRESS=host, ARAB_HANDLE_PORT=int(port), ARAB_HANDLE_PREFIX="12345",
+                           ARAB_HANDLE_ADMIN="0.NA/12345", ARAB_PRIVATE_KEY_FILE=self.keyFile, ARAB_CERT_FILE="",
+                           ARAB_RETRIES=3, ARAB_HANDLE_WORKERS=4, ARAB_HANDLE_RATE=0, ARAB_NOID_POOL_SIZE=10,
+                           IIIF_BASE_URL=IIIF_BASE):
+            arabMintHandle(jobId, False)
+
+        step = ProcessingStep.objects.get(
+            job_id=jobId, processingStepType=ProcessingStep.ProcessingStepType.ARAB_MINT_HANDLE.value)
+        self.assertEqual(Status.COMPLETE, step.status, step.log)
+        report = Report.objects.get(job=jobId)
+        self.assertTrue(all(page.identifier for page in report.page_set.all()))
+        self.assertEqual(5 + 2 + 1, len(self.server.handles))
+
+
+def describeArk(page, ark):
+    page.source = f"https://ark.example.com/{ark}/full/full/0/default.jpg"
+
+
+class MintPageArksTests(TestCase):
+
+    def setUp(self):
+        self.server = ArkletServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.adapter = ArkletAdapter(self.server.address, "12345", "auth")
+
+    def tearDown(self):
+        for page in Page.objects.all():
+            page.delete()
+
+    def __pages(self, count: int, noids=()):
+        jobId = initDummyTransfer(pageData=[{"order": i + 1} for i in range(count)])
+        pages = list(Page.objects.filter(report__job=jobId).order_by("order"))
+        for page, noid in zip(pages, noids):
+            page.noid = noid
+        return pages
+
+    def test_mint(self):
+        pages = self.__pages(10, ["existing"])
+        with CaptureQueriesContext(connection) as queries:
+            errors = mintPageArks(self.adapter, pages, "/p", IIIF_BASE, "title", describeArk, 4, 0)
+
+        self.assertEqual([], errors)
+        self.assertEqual(1, len([query for query in queries if query["sql"].startswith("UPDATE")]))
+        self.assertEqual(9, self.server.mintCount)
+        self.assertEqual(10, len(self.server.arks))
+        for page in Page.objects.filter(pk__in=[p.pk for p in pages]):
+            ark = self.server.arks[f"ark:/12345/{page.noid}"]
+            self.assertEqual(IIIF_BASE + f"iiif/image/{page.noid}", ark["url"])
+            self.assertEqual("title", ark["title"])
+            self.assertEqual(f"https://ark.example.com/ark:/12345/{page.noid}/full/full/0/default.jpg", page.source)
+        self.assertEqual("existing", Page.objects.get(pk=pages[0].pk).noid)
+
+    def test_failedPages(self):
+        pages = self.__pages(3, ["p3"])
+        self.server.failing.add("ark:/12345/p3")
+        errors = mintPageArks(self.adapter, pages, "/p", IIIF_BASE, "title", describeArk, 2, 0)
+
+        self.assertEqual(1, len(errors))
+        self.assertTrue(errors[0].userMessage.startswith("Page 1: "))
+        self.assertIn("error occurred while updating the ARK", errors[0].userMessage)
+        saved = list(Page.objects.filter(pk__in=[p.pk for p in pages]).order_by("order"))
+        self.assertEqual("", saved[0].source)
+        self.assertEqual({"p1", "p2"}, {page.noid for page in saved[1:]})
+        self.assertTrue(all(page.source for page in saved[1:]))
+
+    def test_unauthorised(self):
+        pages = self.__pages(2)
+        errors = mintPageArks(ArkletAdapter(self.server.address, "12345", "wrong"), pages, "/p", IIIF_BASE, "title",
+                              describeArk, 2, 0)
+
+        self.assertEqual(["Page 1", "Page 2"], sorted(e.userMessage.split(":")[0] for e in errors))
+        self.assertEqual(0, self.server.mintCount)
+        self.assertFalse(Page.objects.filter(pk__in=[p.pk for p in pages]).exclude(noid="").exists())
+
+    def test_restart(self):
+        pages = self.__pages(3)
+        self.server.failing.add("ark:/12345/p2")
+        errors = mintPageArks(self.adapter, pages, "/p", IIIF_BASE, "title", describeArk, 1, 0)
+        self.assertEqual(1, len(errors))
+
+        self.server.failing.clear()
+        requestCount = len(self.server.requests)
+        pages = list(Page.objects.filter(pk__in=[p.pk for p in pages]).order_by("order"))
+        errors = mintPageArks(self.adapter, pages, "/p", IIIF_BASE, "title", describeArk, 2, 0)
+
+        self.assertEqual([], errors)
+        self.assertEqual([("PUT", "/update")], self.server.requests[requestCount:])
+        self.assertEqual(3, self.server.mintCount)
+        self.assertEqual(["p1", "p2", "p3"], [p.noid for p in Page.objects.filter(pk__in=[p.pk for p in pages])
+                                             .order_by("order")])
+        self.assertEqual(IIIF_BASE + "iiif/image/p2", self.server.arks["ark:/12345/p2"]["url"])
+
+    def test_restartReserved(self):
+        reserveArkNoids(self.adapter, "/p", 1, 1, 0)
+        pages = self.__pages(1)
+        self.server.failing.add("ark:/12345/p1")
+        self.assertEqual(1, len(mintPageArks(self.adapter, pages, "/p", IIIF_BASE, "title", describeArk, 1, 0)))
+        page = Page.objects.get(pk=pages[0].pk)
+        self.assertEqual(("p1", ""), (page.noid, page.registeredHash))
+
+        self.server.failing.clear()
+        ReservedNoid.objects.create(namespace=arkNamespace("12345", "/p"), noid="spare")
+        errors = mintPageArks(self.adapter, [page], "/p", IIIF_BASE, "title", describeArk, 1, 0)
+
+        self.assertEqual([], errors)
+        self.assertEqual(1, self.server.mintCount)
+        self.assertEqual("p1", Page.objects.get(pk=page.pk).noid)
+        self.assertEqual(["spare"], list(ReservedNoid.objects.values_list("noid", flat=True)))
+
+    def test_changedPages(self):
+        pages = self.__pages(2)
+        self.assertEqual([], mintPageArks(self.adapter, pages, "/p", IIIF_BASE, "title", describeArk, 2, 0))
+        requestCount = len(self.server.requests)
+
+        pages = list(Page.objects.filter(pk__in=[p.pk for p in pages]).order_by("order"))
+        errors = mintPageArks(self.adapter, pages, "/p", IIIF_BASE, "new title", lambda page, ark: None, 2, 0)
+
+        self.assertEqual([], errors)
+        self.assertEqual([("PUT", "/update")] * 2, self.server.requests[requestCount:])
+        self.assertEqual("new title", self.server.arks[f"ark:/12345/{pages[0].noid}"]["title"])
+
+    def test_redescribedPages(self):
+        pages = self.__pages(2)
+        self.assertEqual([], mintPageArks(self.adapter, pages, "/p", IIIF_BASE, "title", describeArk, 2, 0))
+        requestCount = len(self.server.requests)
+
+        def describeElsewhere(page, ark):
+            page.source = f"https://elsewhere.example.com/{ark}"
+
+        pages = list(Page.objects.filter(pk__in=[p.pk for p in pages]).order_by("order"))
+        errors = mintPageArks(self.adapter, pages, "/p", IIIF_BASE, "title", describeElsewhere, 2, 0)
+
+        self.assertEqual([], errors)
+        self.assertEqual(requestCount, len(self.server.requests))
+        self.assertTrue(all(page.source.startswith("https://elsewhere.example.com/ark:/12345/p")
+                            for page in Page.objects.filter(pk__in=[p.pk for p in pages])))
+
+    @mock.patch("metadata.tasks.minting.CHECKPOINT_SIZE", 2)
+    def test_checkpoints(self):
+        pages = self.__pages(5)
+        with CaptureQueriesContext(connection) as queries:
+            errors = mintPageArks(self.adapter, pages, "/p", IIIF_BASE, "title", describeArk, 2, 0)
+
+        self.assertEqual([], errors)
+        self.assertEqual(3, len([query for query in queries if query["sql"].startswith("UPDATE")]))
+        self.assertFalse(Page.objects.filter(pk__in=[p.pk for p in pages], registeredHash="").exists())
+
+    def test_reservedArks(self):
+        errors = reserveArkNoids(self.adapter, "/p", 2, 2, 0)
+        self.assertEqual([], errors)
+        self.assertEqual({"p1", "p2"}, set(ReservedNoid.objects.filter(namespace=arkNamespace("12345", "/p"))
+                                           .values_list("noid", flat=True)))
+
+        pages = self.__pages(3)
+        errors = mintPageArks(self.adapter, pages, "/p", IIIF_BASE, "title", describeArk, 2, 0)
+
+        self.assertEqual([], errors)
+        self.assertEqual(3, self.server.mintCount)
+        self.assertFalse(ReservedNoid.objects.exists())
+        noids = [p.noid for p in Page.objects.filter(pk__in=[p.pk for p in pages]).order_by("order")]
+        self.assertEqual(["p1", "p2", "p3"], sorted(noids))
+        for noid in noids:
+            self.assertEqual(IIIF_BASE + f"iiif/image/{noid}", self.server.arks[f"ark:/12345/{noid}"]["url"])
+
+    def test_mintArkFailure(self):
+        report = Report.objects.get(job=initDummyTransfer(reportData={}))
+        self.server.failing.add("ark:/12345/r1")
+        with self.assertRaises(ArkError):
+            mintArk(self.adapter, report, "noid", "/r", IIIF_BASE + "{}", {"title": "title"})
+        self.assertEqual("r1", Report.objects.get(pk=report.pk).noid)
+        self.assertEqual([("POST", "/mint"), ("PUT", "/update")], self.server.requests)
+
+    def test_overlappingRefills(self):
+        namespace = arkNamespace("12345", "/p")
+        with self.settings(MINTER_URL=self.server.address, MINTER_ORG_ID="12345", MINTER_AUTH="auth",
+                           MINTER_WORKERS=2, MINTER_RATE=0, MINTER_NOID_POOL_SIZE=4), \
+                mock.patch.object(refillArkNoids, "delay", side_effect=refillArkNoids) as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                scheduleRefill(namespace, 4, refillArkNoids, "/p")
+                scheduleRefill(namespace, 4, refillArkNoids, "/p")
+            self.assertEqual(1, delay.call_count)
+            self.assertEqual(4, self.server.mintCount)
+            self.assertIsNone(NoidPool.objects.get(namespace=namespace).refillStarted)
+
+            claimNoids(namespace, 3, lambda noids: None)
+            with self.captureOnCommitCallbacks(execute=True):
+                scheduleRefill(namespace, 4, refillArkNoids, "/p")
+            self.assertEqual(2, delay.call_count)
+            self.assertEqual(4, ReservedNoid.objects.filter(namespace=namespace).count())
+
+    def test_refill(self):
+        ReservedNoid.objects.create(namespace=arkNamespace("12345", "/p"), noid="existing")
+        with self.settings(MINTER_URL=self.server.address, MINTER_ORG_ID="12345", MINTER_AUTH="auth",
+                           MINTER_WORKERS=2, MINTER_RATE=0, MINTER_NOID_POOL_SIZE=4):
+            refillArkNoids("/p")
+            refillArkNoids("/p")
+
+        self.assertEqual(3, self.server.mintCount)
+        self.assertEqual(4, ReservedNoid.objects.filter(namespace=arkNamespace("12345", "/p")).count())
+
+    def test_task(self):
+        for name, value in [(DefaultValueSettings.DefaultValueSettingsType.REPORT_ARK_SHOULDER, "/r"),
+                            (DefaultValueSettings.DefaultValueSettingsType.PAGE_ARK_SHOULDER, "/p")]:
+            DefaultValueSettings.objects.create(name=name, value=value)
+        initDummyFilemaker()
+        jobId = initDummyTransfer({"unionId": "1", "title": "test title"},
+                                  pageData=[{"order": i + 1} for i in range(5)])
+        with self.settings(MINTER_URL=self.server.address, MINTER_ORG_ID="12345", MINTER_AUTH="auth",
+                           MINTER_WORKERS=4, MINTER_RATE=0, MINTER_NOID_POOL_SIZE=10, IIIF_BASE_URL=IIIF_BASE):
+            mintArks(jobId, False)
+
+        step = ProcessingStep.objects.get(job_id=jobId,
+                                          processingStepType=ProcessingStep.ProcessingStepType.MINT_ARKS.value)
+        self.assertEqual(Status.COMPLETE, step.status, step.log)
+        for page in Report.objects.get(job=jobId).page_set.all():
+            self.assertEqual(f"https://ark.fauppsala.se/ark:/12345/{page.noid}/info.json", page.identifier)
+            self.assertIn(f"page ID: {page.noid}", page.bibCitation)
+            self.assertIn(f"ark:/12345/{page.noid}", self.server.arks)
+
+
+class NoidPoolTests(TestCase):
+
+    def setUp(self):
+        ReservedNoid.objects.bulk_create([ReservedNoid(namespace="hdl:12345", noid=f"noid{i}") for i in range(3)] +
+                                         [ReservedNoid(namespace="hdl:6789", noid="other")])
+
+    def test_claim(self):
+        assigned = []
+        self.assertEqual(["noid0", "noid1"], claimNoids("hdl:12345", 2, assigned.extend))
+        self.assertEqual(["noid2"], claimNoids("hdl:12345", 2, assigned.extend))
+        self.assertEqual([], claimNoids("hdl:12345", 2, assigned.extend))
+        self.assertEqual([], claimNoids("hdl:6789", 0, assigned.extend))
+        self.assertEqual(["noid0", "noid1", "noid2"], assigned)
+        self.assertTrue(ReservedNoid.objects.filter(namespace="hdl:6789").exists())
+
+    def test_failedAssignment(self):
+        with self.assertRaises(ValueError):
+            claimNoids("hdl:12345", 2, mock.Mock(side_effect=ValueError))
+        self.assertEqual(3, ReservedNoid.objects.filter(namespace="hdl:12345").count())
+
+    def test_scheduleRefill(self):
+        task = mock.Mock()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            scheduleRefill("hdl:12345", 6, task, "argument")
+            scheduleRefill("hdl:12345", 7, task, "argument")
+            scheduleRefill("hdl:12345", 0, task, "argument")
+
+        self.assertEqual(1, len(callbacks))
+        task.delay.assert_called_once_with("argument")
+
+    def test_refillPending(self):
+        task = mock.Mock()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            scheduleRefill("hdl:12345", 7, task)
+            scheduleRefill("hdl:12345", 7, task)
+        self.assertEqual(1, len(callbacks))
+
+        NoidPool.objects.filter(namespace="hdl:12345").update(refillStarted=timezone.now() - REFILL_TIMEOUT * 2)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            scheduleRefill("hdl:12345", 7, task)
+        self.assertEqual(1, len(callbacks))
+
+        finishRefill("hdl:12345")
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            scheduleRefill("hdl:12345", 7, task)
+        self.assertEqual(1, len(callbacks))
+        self.assertEqual(3, task.delay.call_count)
+
+
+class RateLimiterTests(TestCase):
+
+    def test_spacing(self):
+        limiter = RateLimiter(100)
+        with mock.patch("metadata.tasks.minting.sleep") as sleep:
+            for _ in range(3):
+                limiter.wait()
+        self.assertEqual(2, sleep.call_count)
+        self.assertTrue(all(0 < call.args[0] <= 0.02 for call in sleep.call_args_list))
+
+    def test_everyArkRequestCounted(self):
+        self.addCleanup(lambda: [page.delete() for page in Page.objects.all()])
+        server = ArkletServer()
+        with server:
+            jobId = initDummyTransfer(pageData=[{"order": i + 1} for i in range(3)])
+            pages = list(Page.objects.filter(report__job=jobId).order_by("order"))
+            pages[0].noid = "existing"
+            with mock.patch.object(RateLimiter, "wait") as wait:
+                errors = mintPageArks(ArkletAdapter(server.address, "12345", "auth"), pages, "/p", IIIF_BASE,
+                                      "title", describeArk, 2, 0)
+            self.assertEqual([], errors)
+            self.assertEqual(5, len(server.requests))
+            self.assertEqual(len(server.requests), wait.call_count)
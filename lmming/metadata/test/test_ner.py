@@ -0,0 +1,281 @@
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import torch
+from django.test import SimpleTestCase, override_settings
+from transformers import BertConfig, BertForTokenClassification, BertTokenizerFast
+
+from metadata.nlp import hf_utils, cache
+from metadata.nlp.aux import buildSynonymIndex, get_key
+from metadata.nlp.ner import normalizeTokens, NER_HELPER, processPages, processPage, filtered_entities, NlpResult
+from metadata.nlp.server import NerServer, parseAddress
+
+
+class SynonymIndexTests(SimpleTestCase):
+
+    def test_firstKeyWins(self):
+        dalin = {"a": {"x", "y"}, "b": {"y", "z"}}
+        index = buildSynonymIndex(dalin)
+        self.assertDictEqual({"x": "a", "y": "a", "z": "b"}, index)
+        for variant in ["x", "y", "z"]:
+            self.assertEqual(get_key(variant, dalin), index[variant])
+
+    def test_matchesLinearLookup(self):
+        for variant, key in list(NER_HELPER.DALIN_INDEX.items())[::500]:
+            self.assertEqual(get_key(variant, NER_HELPER.DALIN), key)
+
+
+class NormaliseTests(SimpleTestCase):
+
+    def test_rules(self):
+        self.assertEqual("Kvarnen vilket sak blev ", normalizeTokens(["Qvarnen", "hvilket", "saak", "blef"]))
+
+    def test_empty(self):
+        self.assertEqual("", normalizeTokens([]))
+
+
+class WhitespaceTokenizer:
+
+    def __call__(self, text, **_kwargs):
+        return {"offset_mapping": [(m.start(), m.end()) for m in re.finditer(r"\S+", text)]}
+
+
+class CapitalisedWordPipeline:
+    """
+    Stand-in for a HF token classification pipeline, tagging every run of capitalised words with the given label.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.tokenizer = WhitespaceTokenizer()
+        self.calls = []
+
+    def _tag(self, text):
+        return [{"word": m.group(), "entity_group": self.label, "start": m.start(), "end": m.end(), "score": 1.0}
+                for m in re.finditer(r"\b[A-ZÅÄÖ]\w+(?: [A-ZÅÄÖ]\w+)*", text)]
+
+    def __call__(self, inputs, **kwargs):
+        self.calls.append((inputs, kwargs))
+        if isinstance(inputs, list):
+            return [self._tag(text) for text in inputs]
+        return self._tag(inputs)
+
+
+class BatchedNerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.pages = []
+        for i, text in enumerate(["Anna och Erik reste till Uppsala", "", "inget att se här utom Stockholm"]):
+            path = Path(self.tmpDir.name) / f"page_{i}.txt"
+            path.write_text(text)
+            self.pages.append(path)
+
+        self.ra = CapitalisedWordPipeline("PRS")
+        self.kb = CapitalisedWordPipeline("LOC")
+        patcherRa = mock.patch.object(NER_HELPER, "_ner_ra", self.ra)
+        patcherKb = mock.patch.object(NER_HELPER, "_ner_kb", self.kb)
+        patcherRa.start()
+        patcherKb.start()
+        self.addCleanup(patcherRa.stop)
+        self.addCleanup(patcherKb.stop)
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_matchesPageWise(self):
+        batched = processPages(self.pages, normalise=False, batchSize=4, windowSize=3, stride=1)
+        pageWise = [processPage(p, normalise=False) for p in self.pages]
+        self.assertEqual(pageWise, batched)
+        self.assertEqual(["Anna", "Erik", "Uppsala"], batched[0].persons)
+        self.assertEqual([], batched[1].persons)
+        self.assertEqual(["Stockholm"], batched[2].locations)
+
+    def test_useBackend(self):
+        other = CapitalisedWordPipeline("ORG")
+        with mock.patch("metadata.nlp.ner.getHistbertPipeline", return_value=other) as getRa, \
+                mock.patch("metadata.nlp.ner.getKBPipeline", return_value=other):
+            with NER_HELPER.useBackend(hf_utils.Backend.QUANTISED):
+                result = processPages(self.pages[:1], normalise=False, windowSize=3, stride=1)[0]
+        getRa.assert_called_once_with(hf_utils.Backend.QUANTISED)
+        self.assertEqual(["Anna", "Erik", "Uppsala"], result.organisations)
+        self.assertEqual([], self.ra.calls)
+        self.assertIs(self.ra, NER_HELPER.NER_RA)
+        self.assertIs(self.kb, NER_HELPER.NER_KB)
+
+    def test_singleCallPerModel(self):
+        processPages(self.pages, normalise=False, batchSize=16, windowSize=4, stride=0)
+        batchedCalls = [c for c in self.ra.calls if isinstance(c[0], list)]
+        self.assertEqual(1, len(batchedCalls))
+        windows, kwargs = batchedCalls[0]
+        self.assertEqual(16, kwargs["batch_size"])
+        self.assertEqual(["Anna och Erik reste", "till Uppsala", "inget att se här", "utom Stockholm"], windows)
+
+
+class SlidingWindowTests(SimpleTestCase):
+
+    def setUp(self):
+        self.ra = CapitalisedWordPipeline("PRS")
+        self.kb = CapitalisedWordPipeline("LOC")
+        patcherRa = mock.patch.object(NER_HELPER, "_ner_ra", self.ra)
+        patcherKb = mock.patch.object(NER_HELPER, "_ner_kb", self.kb)
+        patcherRa.start()
+        patcherKb.start()
+        self.addCleanup(patcherRa.stop)
+        self.addCleanup(patcherKb.stop)
+
+    def test_overlappingWindows(self):
+        filtered_entities("ett två tre fyra fem sex sju", NlpResult(), windowSize=4, stride=2)
+        windows = self.ra.calls[0][0]
+        self.assertEqual(["ett två tre fyra", "tre fyra fem sex", "fem sex sju"], windows)
+
+    def test_straddlingEntity(self):
+        result = NlpResult()
+        filtered_entities("och så kom Karl Johan Andersson hit igen och sedan gick Erik", result, windowSize=4,
+                          stride=2)
+        self.assertEqual(["Karl Johan Andersson", "Erik"], result.persons)
+
+    def test_noSplitInsideWord(self):
+        tokenizer = mock.Mock(return_value={"offset_mapping": [(0, 3), (3, 7), (8, 10), (11, 16), (16, 20)]})
+        self.ra.tokenizer = tokenizer
+        filtered_entities("Uppsala är Stockholm", NlpResult(), windowSize=2, stride=0)
+        self.assertEqual(["Uppsala", "är", "Stockholm"], self.ra.calls[0][0])
+
+    def test_deterministic(self):
+        text = " ".join(["Anna Berg", "reste", "till", "Uppsala", "och", "Gävle", "igen"] * 20)
+        first, second = NlpResult(), NlpResult()
+        filtered_entities(text, first, windowSize=7, stride=3)
+        filtered_entities(text, second, windowSize=7, stride=3)
+        self.assertEqual(first, second)
+        first.removeDuplicates()
+        self.assertEqual(["Anna Berg", "Uppsala", "Gävle"], first.persons)
+
+
+class NerServerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpDir.cleanup)
+        self.pages = []
+        for i, text in enumerate(["Anna och Erik reste till Uppsala", "inget att se här utom Stockholm"]):
+            path = Path(self.tmpDir.name) / f"page_{i}.txt"
+            path.write_text(text)
+            self.pages.append(path)
+
+        self.ra = CapitalisedWordPipeline("PRS")
+        self.kb = CapitalisedWordPipeline("LOC")
+        patcherRa = mock.patch.object(NER_HELPER, "_ner_ra", self.ra)
+        patcherKb = mock.patch.object(NER_HELPER, "_ner_kb", self.kb)
+        patcherRa.start()
+        patcherKb.start()
+        self.addCleanup(patcherRa.stop)
+        self.addCleanup(patcherKb.stop)
+
+    def test_matchesLocal(self):
+        address = str(Path(self.tmpDir.name) / "ner.sock")
+        server = NerServer(address)
+        threading.Thread(target=server.serveForever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        for _ in range(100):
+            if Path(address).exists():
+                break
+            time.sleep(0.05)
+
+        local = processPages(self.pages, normalise=False, windowSize=3, stride=1)
+        with override_settings(NER_SERVER_ADDRESS=address):
+            served = processPages(self.pages, normalise=False, windowSize=3, stride=1)
+            single = processPage(self.pages[0], normalise=False)
+        self.assertEqual(local, served)
+        self.assertEqual(local[0], single)
+
+    def test_fallbackWhenUnavailable(self):
+        address = str(Path(self.tmpDir.name) / "missing.sock")
+        with override_settings(NER_SERVER_ADDRESS=address):
+            result = processPage(self.pages[0], normalise=False)
+        self.assertEqual(["Anna", "Erik", "Uppsala"], result.persons)
+
+    def test_parseAddress(self):
+        self.assertEqual(("localhost", 8765), parseAddress("localhost:8765"))
+        self.assertEqual("/run/lmming/ner.sock", parseAddress("/run/lmming/ner.sock"))
+
+
+class BackendTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpDir.cleanup)
+        self.path = Path(self.tmpDir.name)
+        vocabulary = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "anna", "reste", "till", "uppsala"]
+        (self.path / "vocab.txt").write_text("\n".join(vocabulary))
+        BertTokenizerFast(str(self.path / "vocab.txt")).save_pretrained(self.path)
+        config = BertConfig(vocab_size=len(vocabulary), hidden_size=16, num_hidden_layers=1, num_attention_heads=2,
+                            intermediate_size=32, id2label={0: "O", 1: "B-PRS", 2: "I-PRS"},
+                            label2id={"O": 0, "B-PRS": 1, "I-PRS": 2})
+        torch.manual_seed(0)
+        BertForTokenClassification(config).save_pretrained(self.path)
+
+    def test_quantised(self):
+        ner = hf_utils.__getPipeline__(self.path, hf_utils.Backend.QUANTISED)
+        linearLayers = [m for m in ner.model.modules() if type(m) is torch.nn.Linear]
+        self.assertEqual([], linearLayers)
+        for entity in ner("anna reste till uppsala"):
+            self.assertIn(entity["entity_group"], ["PRS"])
+
+    def test_torchUnchanged(self):
+        ner = hf_utils.__getPipeline__(self.path, hf_utils.Backend.TORCH)
+        self.assertTrue(any(type(m) is torch.nn.Linear for m in ner.model.modules()))
+
+
+class CacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpDir.cleanup)
+        cacheSettings = override_settings(NER_CACHE_DIR=Path(self.tmpDir.name) / "cache")
+        cacheSettings.enable()
+        self.addCleanup(cacheSettings.disable)
+        self.page = Path(self.tmpDir.name) / "page.txt"
+        self.page.write_text("Anna reste till Uppsala")
+
+    def test_key(self):
+        key = cache.cacheKey(self.page, True)
+        self.assertEqual(key, cache.cacheKey(self.page, True))
+        self.assertNotEqual(key, cache.cacheKey(self.page, False))
+        with self.settings(HF_CRINA_HASH="other"):
+            self.assertNotEqual(key, cache.cacheKey(self.page, True))
+        self.page.write_text("Anna reste till Gävle")
+        self.assertNotEqual(key, cache.cacheKey(self.page, True))
+
+    def test_roundTrip(self):
+        result = NlpResult(text="Anna reste till Uppsala", normalised="Anna reste till Uppsala", persons=["Anna"],
+                           locations=["Uppsala"], measures=True)
+        cache.store("ab" * 32, result)
+        self.assertEqual(result, cache.load("ab" * 32))
+        self.assertIsNone(cache.load("cd" * 32))
+
+    def test_evictLeastRecentlyUsed(self):
+        for i, key in enumerate(["aa" * 32, "bb" * 32, "cc" * 32]):
+            cache.store(key, NlpResult(text="x" * 100))
+            entry = Path(self.tmpDir.name) / "cache" / key[:2] / f"{key}.json"
+            os.utime(entry, (i, i))
+        size = (Path(self.tmpDir.name) / "cache" / "aa" / f"{'aa' * 32}.json").stat().st_size
+        cache.evict(2 * size)
+        self.assertIsNone(cache.load("aa" * 32))
+        self.assertIsNotNone(cache.load("bb" * 32))
+        self.assertIsNotNone(cache.load("cc" * 32))
+
+    def test_evictionThrottled(self):
+        with mock.patch("metadata.nlp.cache.evict") as evict:
+            cache.evictIfDue()
+            cache.evictIfDue()
+            self.assertEqual(1, evict.call_count)
+
+            marker = Path(self.tmpDir.name) / "cache" / ".evicted"
+            os.utime(marker, (0, 0))
+            cache.evictIfDue()
+            self.assertEqual(2, evict.call_count)
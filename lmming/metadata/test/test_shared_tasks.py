@@ -1,13 +1,19 @@
 import logging
+import tempfile
 from datetime import date
 from pathlib import Path
 from unittest import mock
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from metadata.models import Report, ProcessingStep, Status, Page
 from metadata.nlp.ner import NlpResult
-from metadata.tasks.shared import fileMakerLookup, namedEntityRecognition
+from lmming.celery import app
+from metadata.tasks.arab import arabMintHandle, translateToSwedish
+from metadata.tasks.arab_other import arabOtherMintHandle
+from metadata.tasks.fac import mintArks
+from metadata.tasks.shared import fileMakerLookup, namedEntityRecognition, extractFromFileNames, prepareNLP, \
+    nerPages, failNer
 from metadata.test.utils import initDefaultValues, initDummyTransfer, initDummyFilemaker
 
 
@@ -97,6 +103,11 @@ class NamedEntityRecognitionTests(TestCase):
 
     def setUp(self):
         logging.disable(logging.CRITICAL)
+        cacheDir = tempfile.TemporaryDirectory()
+        self.addCleanup(cacheDir.cleanup)
+        cacheSettings = override_settings(NER_CACHE_DIR=cacheDir.name)
+        cacheSettings.enable()
+        self.addCleanup(cacheSettings.disable)
 
     def tearDown(self):
         for page in Page.objects.all():
@@ -138,3 +149,184 @@ class NamedEntityRecognitionTests(TestCase):
 
         self.assertEqual("", page2.transcription)
         self.assertFalse(page2.measures)
+
+    @mock.patch("metadata.tasks.shared.processPages",
+                side_effect=lambda paths, normalise, **_kwargs: [successfulNer(p, normalise) for p in paths])
+    def test_batchedNer(self, _successfulNerMock):
+        with self.settings(NER_BATCHED=True):
+            initDefaultValues()
+            initDummyFilemaker()
+            jobId = initDummyTransfer({"unionId": "1", "title": "test title", "created": date(1910, 1, 1)})
+
+            namedEntityRecognition(jobId, False)
+            r = Report.objects.get(job=jobId)
+
+            page1 = Page.objects.get(report=r.id, order=1)
+            page2 = Page.objects.get(report=r.id, order=2)
+
+            self.assertEqual("new text", page1.transcription)
+            self.assertEqual("second text", page2.transcription)
+
+    @mock.patch("metadata.tasks.shared.processPage", side_effect=successfulNer)
+    def test_cachedNer(self, successfulNerMock):
+        initDefaultValues()
+        initDummyFilemaker()
+        jobId = initDummyTransfer({"unionId": "1", "title": "test title", "created": date(1910, 1, 1)})
+        page2 = Page.objects.get(report__job=jobId, order=2)
+        Path(page2.transcriptionFile.path).write_bytes(b"these are other file contents!")
+
+        namedEntityRecognition(jobId, False)
+        self.assertEqual(2, successfulNerMock.call_count)
+        Page.objects.filter(report__job=jobId).update(transcription="")
+
+        namedEntityRecognition(jobId, False)
+        self.assertEqual(2, successfulNerMock.call_count)
+        page1 = Page.objects.get(report__job=jobId, order=1)
+        self.assertEqual("new text", page1.transcription)
+        self.assertEqual(["A", "B"], sorted(page1.persons))
+
+        with self.settings(HF_KB_HASH="another revision"):
+            namedEntityRecognition(jobId, False)
+        self.assertEqual(4, successfulNerMock.call_count)
+
+    @mock.patch("metadata.tasks.shared.processPage", side_effect=failedNer)
+    def test_failedNerNotCached(self, failedNerMock):
+        initDefaultValues()
+        initDummyFilemaker()
+        jobId = initDummyTransfer({"unionId": "1", "title": "test title", "created": date(1910, 1, 1)})
+
+        namedEntityRecognition(jobId, False)
+        namedEntityRecognition(jobId, False)
+        self.assertEqual(4, failedNerMock.call_count)
+
+
+class NerFanOutTests(TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        cacheDir = tempfile.TemporaryDirectory()
+        self.addCleanup(cacheDir.cleanup)
+        fanOutSettings = override_settings(NER_CACHE_DIR=cacheDir.name, NER_PAGES_PER_TASK=1, NER_PAGE_RETRIES=1,
+                                           CELERY_TASK_ALWAYS_EAGER=True)
+        fanOutSettings.enable()
+        self.addCleanup(fanOutSettings.disable)
+
+    def tearDown(self):
+        for page in Page.objects.all():
+            page.delete()
+
+    @staticmethod
+    def distinctContents(jobId):
+        # the dummy pages share their content, which would make the second one a cache hit
+        page2 = Page.objects.get(report__job=jobId, order=2)
+        Path(page2.transcriptionFile.path).write_bytes(b"these are other file contents!")
+
+    @mock.patch("metadata.tasks.shared.processPage", side_effect=successfulNer)
+    def test_fanOut(self, successfulNerMock):
+        initDefaultValues()
+        initDummyFilemaker()
+        jobId = initDummyTransfer({"unionId": "1", "title": "test title", "created": date(1910, 1, 1)})
+        self.distinctContents(jobId)
+
+        namedEntityRecognition(jobId, False)
+
+        self.assertEqual(2, successfulNerMock.call_count)
+        self.assertEqual("new text", Page.objects.get(report__job=jobId, order=1).transcription)
+        self.assertEqual("second text", Page.objects.get(report__job=jobId, order=2).transcription)
+        step = ProcessingStep.objects.get(job_id=jobId, processingStepType=ProcessingStep.ProcessingStepType.NER.value)
+        self.assertEqual(Status.COMPLETE, step.status)
+
+    def test_failedPageRetried(self):
+        attempts = []
+
+        def flakyNer(path: Path, normalise: bool = False):
+            attempts.append(path.name)
+            if "sid-02" in path.name and attempts.count(path.name) == 1:
+                raise ValueError("test")
+            return successfulNer(path, normalise)
+
+        initDefaultValues()
+        initDummyFilemaker()
+        jobId = initDummyTransfer({"unionId": "1", "title": "test title", "created": date(1910, 1, 1)})
+        self.distinctContents(jobId)
+        with mock.patch("metadata.tasks.shared.processPage", side_effect=flakyNer):
+            namedEntityRecognition(jobId, False)
+
+        self.assertEqual(3, len(attempts))
+        self.assertEqual("second text", Page.objects.get(report__job=jobId, order=2).transcription)
+        step = ProcessingStep.objects.get(job_id=jobId, processingStepType=ProcessingStep.ProcessingStepType.NER.value)
+        self.assertEqual(Status.COMPLETE, step.status)
+
+    @mock.patch("metadata.tasks.shared.processPage", side_effect=failedNer)
+    def test_retriesExhausted(self, failedNerMock):
+        initDefaultValues()
+        initDummyFilemaker()
+        jobId = initDummyTransfer({"unionId": "1", "title": "test title", "created": date(1910, 1, 1)})
+        self.distinctContents(jobId)
+
+        namedEntityRecognition(jobId, False)
+
+        self.assertEqual(4, failedNerMock.call_count)
+        self.assertEqual("", Page.objects.get(report__job=jobId, order=1).transcription)
+        step = ProcessingStep.objects.get(job_id=jobId, processingStepType=ProcessingStep.ProcessingStepType.NER.value)
+        self.assertEqual(Status.COMPLETE, step.status)
+
+    def test_subtaskFailure(self):
+        initDefaultValues()
+        initDummyFilemaker()
+        jobId = initDummyTransfer({"unionId": "1", "title": "test title", "created": date(1910, 1, 1)})
+        self.distinctContents(jobId)
+        pagePks = list(Page.objects.filter(report__job=jobId).order_by("order").values_list("pk", flat=True))
+
+        with mock.patch("metadata.tasks.shared.cache.load", side_effect=OSError("cache unavailable")):
+            self.assertEqual([(pagePk, None) for pagePk in pagePks], nerPages(pagePks, False))
+
+        loads = []
+
+        def flakyLoad(key):
+            # the first subtask fails, its page is retried on its own
+            loads.append(key)
+            if len(loads) == 1:
+                raise OSError("cache unavailable")
+            return None
+
+        with mock.patch("metadata.tasks.shared.cache.load", side_effect=flakyLoad), \
+                mock.patch("metadata.tasks.shared.processPage", side_effect=successfulNer):
+            namedEntityRecognition(jobId, False)
+
+        self.assertEqual("new text", Page.objects.get(report__job=jobId, order=1).transcription)
+        step = ProcessingStep.objects.get(job_id=jobId, processingStepType=ProcessingStep.ProcessingStepType.NER.value)
+        self.assertEqual(Status.COMPLETE, step.status)
+
+    def test_failNer(self):
+        jobId = initDummyTransfer()
+        failNer(jobId)
+
+        step = ProcessingStep.objects.get(job_id=jobId, processingStepType=ProcessingStep.ProcessingStepType.NER.value)
+        self.assertEqual(Status.ERROR, step.status)
+        self.assertIn("restart", step.log)
+
+
+class WorkerQueueTests(TestCase):
+
+    def test_routes(self):
+        for task in [mintArks, arabMintHandle, arabOtherMintHandle, fileMakerLookup, translateToSwedish]:
+            self.assertEqual("io", app.amqp.router.route({}, task.name)["queue"].name)
+        self.assertEqual("ner", app.amqp.router.route({}, namedEntityRecognition.name)["queue"].name)
+        self.assertEqual("celery", app.amqp.router.route({}, extractFromFileNames.name)["queue"].name)
+        self.assertTrue(namedEntityRecognition.acks_late)
+        self.assertGreater(app.conf.broker_transport_options["visibility_timeout"], 3600)
+
+    @mock.patch("metadata.tasks.shared.download")
+    def test_modelsOnlyLoadedForNer(self, downloadMock):
+        ioWorker = mock.Mock()
+        ioWorker.task_consumer.queues = [mock.Mock()]
+        ioWorker.task_consumer.queues[0].name = "io"
+        prepareNLP(sender=ioWorker)
+        downloadMock.assert_not_called()
+
+        nerWorker = mock.Mock()
+        nerWorker.task_consumer.queues = [mock.Mock()]
+        nerWorker.task_consumer.queues[0].name = "ner"
+        prepareNLP(sender=nerWorker)
+        downloadMock.assert_called_once()
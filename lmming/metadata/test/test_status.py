@@ -0,0 +1,58 @@
+from django.test import TestCase
+
+from metadata.models import ExtractionTransfer, Report, Job, ProcessingStep, Status, deferredStatusUpdates, \
+    updateStatuses
+
+
+def initTransfer(reportCount: int) -> ExtractionTransfer:
+    transfer = ExtractionTransfer.objects.create(name="TestTransfer")
+    for _ in range(reportCount):
+        job = Job.objects.create(transfer=transfer, report=Report.objects.create(transfer=transfer))
+        for stepType in [ProcessingStep.ProcessingStepType.FILENAME, ProcessingStep.ProcessingStepType.NER]:
+            ProcessingStep.objects.create(job=job, order=stepType.order, processingStepType=stepType.value,
+                                          status=Status.COMPLETE)
+    return transfer
+
+
+def restartNer(transfer: ExtractionTransfer):
+    for step in ProcessingStep.objects.filter(job__transfer=transfer,
+                                              processingStepType=ProcessingStep.ProcessingStepType.NER.value):
+        step.status = Status.IN_PROGRESS
+        step.save()
+
+
+class StatusAggregationTests(TestCase):
+
+    def test_deferredMatchesImmediate(self):
+        immediate = initTransfer(3)
+        deferred = initTransfer(3)
+        self.assertEqual(Status.COMPLETE, ExtractionTransfer.objects.get(pk=immediate.pk).status)
+
+        restartNer(immediate)
+        with deferredStatusUpdates():
+            restartNer(deferred)
+            # nothing is updated until the context is left
+            self.assertEqual(Status.COMPLETE, ExtractionTransfer.objects.get(pk=deferred.pk).status)
+
+        for transfer in [immediate, deferred]:
+            transfer.refresh_from_db()
+            self.assertEqual(Status.IN_PROGRESS, transfer.status)
+            self.assertEqual({Status.IN_PROGRESS}, set(transfer.jobs.values_list("status", flat=True)))
+
+    def test_errorStep(self):
+        transfer = initTransfer(2)
+        step = ProcessingStep.objects.filter(job__transfer=transfer).first()
+        with deferredStatusUpdates():
+            step.status = Status.ERROR
+            step.save()
+        self.assertEqual(Status.ERROR, Job.objects.get(pk=step.job_id).status)
+        self.assertEqual(Status.ERROR, ExtractionTransfer.objects.get(pk=transfer.pk).status)
+
+    def test_constantQueryCount(self):
+        small = initTransfer(2)
+        large = initTransfer(10)
+        for transfer in [small, large]:
+            jobPks = list(transfer.jobs.values_list("pk", flat=True))
+            # one grouped query and one bulk update each for jobs and transfers
+            with self.assertNumQueries(4):
+                updateStatuses(jobPks)
@@ -1,10 +1,25 @@
+import tempfile
 from datetime import date
-from unittest import expectedFailure
+from pathlib import Path
+from unittest import expectedFailure, mock
+
+from Crypto.PublicKey import RSA
 
 from django.test import TestCase
 
 from metadata.models import Report
-from metadata.tasks.utils import getArabCoverage, getFacCoverage, splitIfNotNone, createArabTitle
+from metadata.tasks.utils import getArabCoverage, getFacCoverage, splitIfNotNone, createArabTitle, HandleAdapter, \
+    HandleError, Singleton, loadPrivateKey, signBytesSHA256
+
+class MockResponse:
+    def __init__(self, jsonData, statusCode: int = 200):
+        self.jsonData = jsonData
+        self.status_code = statusCode
+        self.ok = statusCode < 400
+        self.content = b""
+
+    def json(self):
+        return self.jsonData
 
 
 class FacCoverageTests(TestCase):
@@ -197,3 +212,52 @@ class CreateArabTitleTests(TestCase):
         with self.assertRaises(TypeError) as cm:
             createArabTitle("Union X", None)
         self.assertIn("no dates were supplied", str(cm.exception))
+
+
+class HandleAdapterTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        keyDir = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(keyDir.cleanup)
+        cls.keyFile = str(Path(keyDir.name) / "key.pem")
+        Path(cls.keyFile).write_bytes(RSA.generate(1024).export_key())
+
+    def setUp(self):
+        Singleton._instances.pop(HandleAdapter, None)
+        self.addCleanup(Singleton._instances.pop, HandleAdapter, None)
+        self.adapter = HandleAdapter("hdl.example.com", 8000, "12345", "0.NA/12345", self.keyFile, Path("unused"))
+        self.adapter.session = mock.Mock()
+        self.adapter.session.post.side_effect = lambda url, **_kwargs: \
+            MockResponse({"sessionId": "abc", "nonce": "c2VydmVybm9uY2U="}) if url.endswith("sessions") \
+            else MockResponse({})
+
+    def test_sessionReused(self):
+        self.adapter.session.put.return_value = MockResponse({})
+        for noid in ["a", "b", "c"]:
+            self.assertEqual(f"12345/{noid}", self.adapter.updatePlainHandle(noid, "https://example.com"))
+
+        self.assertEqual(2, self.adapter.session.post.call_count)
+        self.assertEqual(3, self.adapter.session.put.call_count)
+        self.adapter.session.get.assert_not_called()
+
+    def test_expiredSession(self):
+        self.adapter.session.put.side_effect = [MockResponse({}), MockResponse({}, 401), MockResponse({})]
+        self.adapter.updatePlainHandle("a", "https://example.com")
+        self.adapter.updatePlainHandle("b", "https://example.com")
+
+        self.assertEqual(4, self.adapter.session.post.call_count)
+        self.assertEqual(3, self.adapter.session.put.call_count)
+
+    def test_rejected(self):
+        self.adapter.session.put.return_value = MockResponse({}, 401)
+        self.assertRaises(HandleError, self.adapter.updatePlainHandle, "a", "https://example.com")
+        self.assertEqual(2, self.adapter.session.put.call_count)
+
+    def test_keyParsedOnce(self):
+        loadPrivateKey.cache_clear()
+        with mock.patch("metadata.tasks.utils.RSA.importKey", wraps=RSA.importKey) as importKey:
+            signatures = [signBytesSHA256(b"nonce", self.keyFile) for _ in range(3)]
+        self.assertEqual(1, importKey.call_count)
+        self.assertEqual(1, len(set(signatures)))
@@ -0,0 +1,63 @@
+import tempfile
+from pathlib import Path
+
+from django.test import SimpleTestCase
+from lxml import etree
+
+from metadata import xml_utils
+from metadata.nlp.ner import extractText
+from metadata.test.utils import PAGE_XML
+from metadata.transcription import extractTranscription, transcriptionFormat
+
+ALTO_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<alto xmlns="http://www.loc.gov/standards/alto/ns-v4#">
+  <Layout><Page><PrintSpace>
+    <TextBlock ID="b1">
+      <TextLine ID="l1"><String CONTENT="Protokoll"/><SP/><!-- comment --><String CONTENT="fört"/><HYP/></TextLine>
+      <TextLine ID="l2"><String CONTENT="vid-"/></TextLine>
+    </TextBlock>
+    <ComposedBlock ID="c1">
+      <TextBlock ID="b2"><TextLine ID="l3"><String CONTENT="sammanträde"/></TextLine></TextBlock>
+    </ComposedBlock>
+  </PrintSpace></Page></Layout>
+</alto>""".encode()
+
+
+class ExtractTranscriptionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpDir.cleanup)
+
+    def __write(self, name: str, content: bytes) -> Path:
+        path = Path(self.tmpDir.name) / name
+        path.write_bytes(content)
+        return path
+
+    def test_alto(self):
+        path = self.__write("alto.xml", ALTO_XML)
+        transcription = extractTranscription(path)
+        self.assertEqual("ALTO", transcription.format)
+        self.assertEqual(["Protokoll fört", "vid-", "sammanträde"], transcription.lines)
+        self.assertIsNone(transcription.page)
+        self.assertEqual("Protokoll fört vidsammanträde ", extractText(path))
+
+    def test_page(self):
+        path = self.__write("page.xml", PAGE_XML.replace(
+            b"</TextRegion>\n",
+            b"</TextRegion><TableRegion id='t1'><TextRegion id='r2'><TextLine id='l2'><Coords points='1,2 3,4'/>"
+            b"<TextEquiv><Unicode/></TextEquiv><TextEquiv><Unicode>second</Unicode></TextEquiv></TextLine>"
+            b"</TextRegion></TableRegion>"))
+        transcription = extractTranscription(path)
+        self.assertEqual("PAGE", transcription.format)
+        self.assertEqual(["Anna & Erik", "", "second"], transcription.lines)
+        self.assertEqual(xml_utils.__dict__["__parsePage"](etree.parse(str(path)).getroot()), transcription.page)
+
+        self.assertEqual([], extractTranscription(path, text=False).lines)
+        self.assertIsNone(extractTranscription(path, geometry=False).page)
+
+    def test_other(self):
+        path = self.__write("other.xml", b"<root><TextLine><String CONTENT='x'/></TextLine></root>")
+        self.assertEqual("OTHER", transcriptionFormat(path))
+        self.assertEqual([], extractTranscription(path).lines)
+        self.assertEqual("", extractText(path))
@@ -0,0 +1,127 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from metadata import uploads
+from metadata.models import TransferUpload, Page, Pipeline, ProcessingStep, Status
+from metadata.partials import FAC_PROCESSING_STEP_INITIAL
+from metadata.utils import parseFilename, buildReportIdentifier
+
+FILES = {"fac_00001_arsberattelse_1991_sid-01.xml": b"first page of the report",
+         "fac_00001_arsberattelse_1991_sid-02.xml": b"second page",
+         "fac_00002_arsberattelse_1992_sid-01.xml": b""}
+
+
+class ChunkedUploadTests(TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpDir.cleanup)
+        mediaSettings = override_settings(MEDIA_ROOT=self.tmpDir.name, UPLOAD_DIR=Path(self.tmpDir.name) / "uploads",
+                                          ARCHIVE_INST="FAC")
+        mediaSettings.enable()
+        self.addCleanup(mediaSettings.disable)
+
+    def tearDown(self):
+        for page in Page.objects.all():
+            page.delete()
+
+    def __start(self, files) -> dict:
+        data = {"processName": "chunked", "handlerName": "handler", "files": json.dumps(files),
+                "form-TOTAL_FORMS": len(FAC_PROCESSING_STEP_INITIAL),
+                "form-INITIAL_FORMS": len(FAC_PROCESSING_STEP_INITIAL)}
+        for i, step in enumerate(FAC_PROCESSING_STEP_INITIAL):
+            data[f"form-{i}-mode"] = step["mode"]
+        response = self.client.post(reverse("metadata:upload_start"), data)
+        self.assertEqual(200, response.status_code, response.content)
+        return response.json()
+
+    def __put(self, upload: str, name: str, content: bytes, start: int, size: int):
+        return self.client.put(f"{reverse('metadata:upload_chunk', args=[upload])}?name={name}", content,
+                               content_type="application/octet-stream",
+                               HTTP_CONTENT_RANGE=f"bytes {start}-{start + len(content) - 1}/{size}")
+
+    def test_upload(self):
+        progress = self.__start([{"name": name, "size": len(content)} for name, content in FILES.items()] +
+                                [{"name": "invalid.xml", "size": 3}, {"name": "../fac_00001_a_1991_sid-03.xml",
+                                                                      "size": 3}])
+        self.assertEqual(["invalid.xml", "../fac_00001_a_1991_sid-03.xml"], progress["rejected"])
+        self.assertEqual(sum(len(content) for content in FILES.values()), progress["size"])
+        upload = progress["upload"]
+
+        name, content = "fac_00001_arsberattelse_1991_sid-01.xml", FILES["fac_00001_arsberattelse_1991_sid-01.xml"]
+        self.assertEqual({"received": 10}, self.__put(upload, name, content[:10], 0, len(content)).json())
+        response = self.__put(upload, name, content[12:], 12, len(content))
+        self.assertEqual(409, response.status_code)
+        self.assertEqual(10, response.json()["received"])
+        self.__put(upload, name, content[10:], 10, len(content))
+
+        response = self.client.post(reverse("metadata:upload_finish", args=[upload]))
+        self.assertEqual(409, response.status_code)
+
+        name = "fac_00001_arsberattelse_1991_sid-02.xml"
+        self.__put(upload, name, FILES[name], 0, len(FILES[name]))
+        status = self.client.get(reverse("metadata:upload_status", args=[upload])).json()
+        self.assertEqual(status["size"], status["received"])
+
+        response = self.client.post(reverse("metadata:upload_finish", args=[upload]))
+        self.assertEqual(200, response.status_code, response.content)
+        transfer = TransferUpload.objects.get(pk=upload).transfer
+        self.assertEqual(reverse("metadata:verify_transfer", args=[transfer.pk]), response.json()["redirect"])
+        self.assertEqual(Pipeline.FAC, transfer.pipeline)
+        self.assertEqual(Status.PENDING, transfer.status)
+        self.assertEqual(2, transfer.report_set.count())
+        self.assertEqual(2 * len(FAC_PROCESSING_STEP_INITIAL),
+                         ProcessingStep.objects.filter(job__transfer=transfer).count())
+        for page in Page.objects.filter(report__transfer=transfer):
+            self.assertEqual(FILES[page.originalFileName], Path(page.transcriptionFile.path).read_bytes())
+        self.assertFalse((Path(self.tmpDir.name) / "uploads" / upload).exists())
+
+        response = self.client.post(reverse("metadata:upload_finish", args=[upload]))
+        self.assertEqual(reverse("metadata:verify_transfer", args=[transfer.pk]), response.json()["redirect"])
+        response = self.__put(upload, name, b"x", 0, 1)
+        self.assertEqual(404, response.status_code)
+
+    def test_failedFinish(self):
+        files = {name: content for name, content in FILES.items() if name.startswith("fac_00001")}
+        upload = self.__start([{"name": name, "size": len(content)} for name, content in files.items()])["upload"]
+        for name, content in files.items():
+            self.__put(upload, name, content, 0, len(content))
+
+        with mock.patch("metadata.uploads.buildTransfer", side_effect=RuntimeError("broken")):
+            with self.assertRaises(RuntimeError):
+                uploads.finishUpload(TransferUpload.objects.get(pk=upload))
+        for name, content in files.items():
+            self.assertEqual(content, (Path(self.tmpDir.name) / "uploads" / upload / name).read_bytes())
+            self.assertFalse((Path(self.tmpDir.name) / name).exists())
+
+        transfer = uploads.finishUpload(TransferUpload.objects.get(pk=upload))
+        for page in Page.objects.filter(report__transfer=transfer):
+            self.assertEqual(files[page.originalFileName], Path(page.transcriptionFile.path).read_bytes())
+
+    def test_invalidChunks(self):
+        upload = self.__start([{"name": "fac_00001_arsberattelse_1991_sid-01.xml", "size": 4}])["upload"]
+        self.assertEqual(400, self.__put(upload, "fac_00001_arsberattelse_1991_sid-01.xml", b"12345", 0, 5)
+                         .status_code)
+        self.assertEqual(404, self.__put(upload, "fac_00009_arsberattelse_1991_sid-01.xml", b"1", 0, 1).status_code)
+        response = self.client.put(f"{reverse('metadata:upload_chunk', args=[upload])}?name=x", b"1",
+                                   content_type="application/octet-stream")
+        self.assertEqual(400, response.status_code)
+
+    def test_addFilesKeepsProgress(self):
+        upload = uploads.startUpload("name", "", Pipeline.FAC, [
+            {"stepType": ProcessingStep.ProcessingStepType.FILENAME, "mode": "AUTOMATIC", "humanValidation": False}])
+        name = "fac_00001_arsberattelse_1991_sid-01.xml"
+        uploads.addFiles(upload, [(name, 4)])
+        with open(__file__, "rb") as stream:
+            uploads.writeChunk(upload, name, 0, 2, stream)
+        self.assertEqual([], uploads.addFiles(upload, [(name, 4)]))
+        self.assertEqual(2, upload.files.get().received)
+        self.assertEqual(buildReportIdentifier(parseFilename(name)), upload.files.get().reportIdentifier)
+
+        upload.delete()
+        self.assertFalse(upload.directory.exists())
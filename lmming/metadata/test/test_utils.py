@@ -1,11 +1,27 @@
+import os
+import tempfile
+import zipfile
+from collections.abc import Iterator
+from copy import deepcopy
 from datetime import date, datetime
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
 
 import pandas as pd
 from django.test import TestCase
 
-from metadata.models import Report, ExtractionTransfer, Job, ProcessingStep, Status, ExternalRecord
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from metadata.models import Report, ExtractionTransfer, Job, ProcessingStep, Status, ExternalRecord, Page, \
+    ReportTranslation
+from metadata.test.utils import initDefaultValues, initDummyTransfer, TEST_REPORT, TEST_PAGES, PAGE_XML
 from metadata.utils import parseFilename, buildReportIdentifier, buildProcessingSteps, updateExternalRecords, \
-    formatDateString
+    formatDateString, streamZip, buildFolderStructure, buildBulkTransferCsvs, csvLines, altoTranscription, \
+    noidFromIdentifier
+from metadata.xml_utils import convertPageFileToAlto
 
 
 class ParseFilenameTests(TestCase):
@@ -197,6 +213,21 @@ class BuildReportIdentifierTests(TestCase):
         self.assertEqual("1234-ANNUAL_REPORT-FINANCIAL_STATEMENT-1910-01-01--1911-01-01", buildReportIdentifier(a))
 
 
+class NoidFromIdentifierTests(TestCase):
+
+    def test_identifiers(self):
+        for identifier in ["https://ark.fauppsala.se/ark:/30441/x1b2c3", "https://ark.fauppsala.se/ark:/30441/x1b2c3/",
+                           "https://ark.fauppsala.se/ark:/30441/x1b2c3/manifest",
+                           "https://iiif.example.org/iiif/image/x1b2c3/info.json",
+                           "https://hdl.handle.net/20.500.14423/x1b2c3?locatt=view:manifest",
+                           " https://hdl.handle.net/20.500.14423/x1b2c3#page "]:
+            self.assertEqual("x1b2c3", noidFromIdentifier(identifier), identifier)
+
+    def test_noNoid(self):
+        self.assertEqual("", noidFromIdentifier(""))
+        self.assertEqual("x1b2c3", noidFromIdentifier("x1b2c3"))
+
+
 class BuildProcessingStepsTests(TestCase):
 
     def test_buildFacSteps(self):
@@ -471,3 +502,162 @@ class FormatDateStringTests(TestCase):
                  datetime(year=1993, month=1, day=1), datetime(year=2010, month=1, day=1),
                  datetime(year=2011, month=1, day=1), datetime(year=2012, month=1, day=1)]
         self.assertEqual(formatDateString(dates, "|"), "1991--1993|2010--2012")
+
+
+class StreamZipTests(TestCase):
+
+    def test_archive(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            largeFile = Path(tmpDir) / "large.txt"
+            largeFile.write_bytes(os.urandom(300 * 1024))
+            chunks = list(streamZip([("folder/", ""), ("large.txt", largeFile), ("text.csv", "a,b\n1,2\n"),
+                                     ("bytes.xml", b"<xml/>")], chunkSize=16 * 1024))
+
+            self.assertGreater(len(chunks), 10)
+            with zipfile.ZipFile(BytesIO(b"".join(chunks))) as zf:
+                self.assertIsNone(zf.testzip())
+                self.assertEqual(["folder/", "large.txt", "text.csv", "bytes.xml"], zf.namelist())
+                self.assertEqual(largeFile.read_bytes(), zf.read("large.txt"))
+                self.assertEqual(b"a,b\n1,2\n", zf.read("text.csv"))
+                self.assertTrue(zf.getinfo("large.txt").flag_bits & 0x08)  # sizes follow in a data descriptor
+
+    def test_folderStructure(self):
+        initDefaultValues()
+        reportData = deepcopy(TEST_REPORT)
+        reportData.update({"coverage": Report.UnionLevel.WORKPLACE, "isFormatOf": [Report.DocumentFormat.PRINTED]})
+        pageData = deepcopy(TEST_PAGES)
+        for page in pageData:
+            page["works"] = []
+        jobId = initDummyTransfer(reportData, pageData)
+        transfer = Job.objects.get(pk=jobId).transfer
+
+        chunks = buildFolderStructure(transfer, forArab=True)
+        self.assertIsInstance(chunks, Iterator)
+        with zipfile.ZipFile(BytesIO(b"".join(chunks))) as zf:
+            names = zf.namelist()
+        self.assertIn("transcription/fac_00001_arsberattelse_1991_sid-01.xml", names)
+        self.assertIn("metadata/mets_structmap.xml", names)
+        self.assertIn("items.csv", names)
+
+        for page in Page.objects.all():
+            page.delete()
+
+
+class CsvLinesTests(TestCase):
+
+    def test_matchesPandas(self):
+        records = [{"a": "plain", "b": 'quote "d", comma', "c": 1992, "d": True, "e": None},
+                   {"a": "line\nbreak", "b": "", "c": 1993, "d": False, "e": date(2082, 1, 1)},
+                   {"a": "ünïcode", "b": ["x", "y"], "c": 1994, "d": True, "e": None}]
+        expected = pd.DataFrame.from_records(records).to_csv(index=False)
+        lines = csvLines(["a", "b", "c", "d", "e"], [list(record.values()) for record in records])
+        self.assertEqual(expected, "".join(lines))
+
+    def test_streamedIntoZip(self):
+        lines = csvLines(["dc.rights", "dc.rights"], [["restricted", "license"]])
+        with zipfile.ZipFile(BytesIO(b"".join(streamZip([("metadata.csv", lines)])))) as zf:
+            self.assertEqual(b"dc.rights,dc.rights\nrestricted,license\n", zf.read("metadata.csv"))
+
+
+class TransferSnapshotTests(TestCase):
+
+    def setUp(self):
+        initDefaultValues()
+        reportData = deepcopy(TEST_REPORT)
+        reportData.update({"coverage": Report.UnionLevel.WORKPLACE, "isFormatOf": [Report.DocumentFormat.PRINTED]})
+        pageData = deepcopy(TEST_PAGES)
+        for page in pageData:
+            page["works"] = []
+        self.transfer = Job.objects.get(pk=initDummyTransfer(reportData, pageData)).transfer
+        self.reportData = reportData
+
+    def tearDown(self):
+        for page in Page.objects.all():
+            page.delete()
+
+    def __grow(self, reports: int, pages: int):
+        for i in range(reports):
+            reportData = deepcopy(self.reportData)
+            reportData.update({"noid": f"grown{i}", "accessRights": Report.AccessRights.NOT_RESTRICTED})
+            report = Report.objects.create(transfer=self.transfer, **reportData)
+            ReportTranslation.objects.create(report=report, language="sv", coverage="arbetsplats",
+                                             type=["årsberättelse"], isFormatOf=["tryckt"])
+            for order in range(pages, 0, -1):
+                Page.objects.create(report=report, order=order, originalFileName=f"grown{i}_{order}.xml",
+                                    transcriptionFile=SimpleUploadedFile(f"grown{i}_{order}.xml", b"<xml/>"),
+                                    persons=[], organisations=[], locations=[], times=[], works=[], events=[],
+                                    ner_objects=[])
+
+    def __countQueries(self, build) -> int:
+        transfer = ExtractionTransfer.objects.get(pk=self.transfer.pk)
+        with CaptureQueriesContext(connection) as queries:
+            build(transfer)
+        return len(queries)
+
+    def test_constantQueryCount(self):
+        def buildAll(transfer):
+            list(buildFolderStructure(transfer, forArab=True))
+            list(buildFolderStructure(transfer, checkRestriction=True, forArab=True, arabOther=True))
+            buildBulkTransferCsvs([transfer], forArab=True)
+
+        small = self.__countQueries(buildAll)
+        self.__grow(reports=4, pages=5)
+        self.assertEqual(small, self.__countQueries(buildAll))
+
+    def test_pagesInOrder(self):
+        self.__grow(reports=1, pages=3)
+        with zipfile.ZipFile(BytesIO(b"".join(buildFolderStructure(self.transfer, forArab=True)))) as zf:
+            names = [n for n in zf.namelist() if n.startswith("transcription/grown")]
+        self.assertEqual(["transcription/grown0_1.xml", "transcription/grown0_2.xml", "transcription/grown0_3.xml"],
+                         names)
+
+
+class AltoTranscriptionTests(TestCase):
+
+    def setUp(self):
+        initDefaultValues()
+        reportData = deepcopy(TEST_REPORT)
+        reportData.update({"coverage": Report.UnionLevel.WORKPLACE, "isFormatOf": [Report.DocumentFormat.PRINTED]})
+        pageData = deepcopy(TEST_PAGES)
+        pageData[0]["transcriptionFile"] = SimpleUploadedFile("page_01.xml", PAGE_XML)
+        pageData[1]["transcriptionFile"] = SimpleUploadedFile("alto_02.xml", b"<alto xmlns='x'/>")
+        for page in pageData:
+            page["works"] = []
+        self.transfer = Job.objects.get(pk=initDummyTransfer(reportData, pageData)).transfer
+        self.pagePage, self.altoPage = Page.objects.filter(report__transfer=self.transfer).order_by("order")
+
+    def tearDown(self):
+        for page in Page.objects.all():
+            page.delete()
+
+    def test_convertedOnce(self):
+        with mock.patch("metadata.xml_utils.convertPageFileToAlto", wraps=convertPageFileToAlto) as convert:
+            first = b"".join(buildFolderStructure(ExtractionTransfer.objects.get(pk=self.transfer.pk)))
+            second = b"".join(buildFolderStructure(ExtractionTransfer.objects.get(pk=self.transfer.pk)))
+        self.assertEqual(1, convert.call_count)
+
+        for archive in [first, second]:
+            with zipfile.ZipFile(BytesIO(archive)) as zf:
+                alto = zf.read("transcription/fac_00001_arsberattelse_1991_sid-01.xml").decode()
+                self.assertIn('CONTENT="Anna &amp; Erik"', alto)
+                self.assertIn("<fileName>fac_00001_arsberattelse_1991_sid-01.jpg</fileName>", alto)
+                self.assertEqual(b"<alto xmlns='x'/>", zf.read("transcription/fac_00001_arsberattelse_1991_sid-02.xml"))
+
+        self.pagePage.refresh_from_db()
+        self.altoPage.refresh_from_db()
+        self.assertEqual(Page.TranscriptionFormat.PAGE, self.pagePage.transcriptionFormat)
+        self.assertEqual(Page.TranscriptionFormat.ALTO, self.altoPage.transcriptionFormat)
+
+    def test_changedSourceConvertedAgain(self):
+        converted = altoTranscription(self.pagePage)
+        self.assertNotEqual(Path(self.pagePage.transcriptionFile.path), converted)
+        self.assertEqual(Path(self.altoPage.transcriptionFile.path), altoTranscription(self.altoPage))
+
+        Path(self.pagePage.transcriptionFile.path).write_bytes(PAGE_XML.replace(b"Anna", b"Greta"))
+        updated = altoTranscription(self.pagePage)
+        self.assertNotEqual(converted, updated)
+        self.assertFalse(converted.exists())
+        self.assertIn('CONTENT="Greta &amp; Erik"', updated.read_text())
+
+        self.pagePage.delete()
+        self.assertFalse(updated.exists())
@@ -36,8 +36,23 @@ TEST_PAGES = [{"order": 1,
                "ner_objects": ["object1", "object2"], "measures": True, "iiifId": "testbcd_2"}
               ]
 
+PAGE_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<PcGts xmlns="http://schema.primaresearch.org/PAGE/gts/pagecontent/2013-07-15">
+  <Page imageFilename="page.jpg" imageWidth="1000" imageHeight="2000">
+    <TextRegion id="r1">
+      <Coords points="10,10 500,10 500,100 10,100"/>
+      <TextLine id="l1">
+        <Coords points="10,10 500,10 500,50 10,50"/>
+        <Baseline points="10,45 500,45"/>
+        <TextEquiv><Unicode>Anna &amp; Erik</Unicode></TextEquiv>
+      </TextLine>
+    </TextRegion>
+  </Page>
+</PcGts>"""
+
 DEFAULT_VALUES = {"license": "license", "language": "language", "source": "source", "accessRights": "RESTRICTED",
-                  "arkShoulder": "/test", "yearOffset": 70, "normalisationCutOff": 1910}
+                  "arkShoulder": "/test", "reportArkShoulder": "/r", "pageArkShoulder": "/p", "yearOffset": 70,
+                  "normalisationCutOff": 1910}
 
 
 def initDefaultValues(values: Dict[str, Any] = None):
@@ -62,6 +77,13 @@ def initDefaultValues(values: Dict[str, Any] = None):
         DefaultValueSettings.objects.create(name=DefaultValueSettings.DefaultValueSettingsType.ARK_SHOULDER,
                                             value=values["arkShoulder"])
 
+    if "reportArkShoulder" in values:
+        DefaultValueSettings.objects.create(name=DefaultValueSettings.DefaultValueSettingsType.REPORT_ARK_SHOULDER,
+                                            value=values["reportArkShoulder"])
+    if "pageArkShoulder" in values:
+        DefaultValueSettings.objects.create(name=DefaultValueSettings.DefaultValueSettingsType.PAGE_ARK_SHOULDER,
+                                            value=values["pageArkShoulder"])
+
     if "yearOffset" in values:
         DefaultNumberSettings.objects.create(name=DefaultNumberSettings.DefaultNumberSettingsType.AVAILABLE_YEAR_OFFSET,
                                              value=values["yearOffset"])
@@ -0,0 +1,199 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional
+
+from lxml import etree
+
+from metadata.nlp.utils import handleLinebreakChars
+
+
+@dataclass
+class TextLine:
+    id: str
+    xCoords: List[int]
+    yCoords: List[int]
+    x0: int = 0
+    x1: int = 0
+    y0: int = 0
+    y1: int = 0
+    transcription: str = ""
+    baseline: str = ""
+
+    def __post_init__(self):
+        self.x0 = min(self.xCoords)
+        self.x1 = max(self.xCoords)
+        self.y0 = min(self.yCoords)
+        self.y1 = max(self.yCoords)
+
+
+@dataclass
+class TextRegion:
+    id: str
+    x0: int
+    x1: int
+    y0: int
+    y1: int
+    lines: List[TextLine] = field(default_factory=list)
+    coordString: str = ""
+
+
+@dataclass
+class Page:
+    regions: List[TextRegion] = field(default_factory=list)
+    height: int = -1
+    width: int = -1
+
+
+@dataclass
+class Transcription:
+    """
+    Everything read from a transcription file: its format ("ALTO", "PAGE" or "OTHER"), the text of every line in
+    document order and, for PAGE files, the geometry of the text regions directly below the page.
+    """
+    format: str
+    lines: List[str] = field(default_factory=list)
+    page: Optional[Page] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(handleLinebreakChars(line) for line in self.lines)
+
+
+def pageNamespace(rootTag: str) -> dict:
+    if "PcGts" in rootTag:
+        return {"": rootTag.replace("PcGts", "").strip("{}")}
+    else:
+        return {"": "http://schema.primaresearch.org/PAGE/gts/pagecontent/2013-07-15"}
+
+
+def __tag(namespace: str, name: str) -> str:
+    return f"{{{namespace}}}{name}" if namespace else name
+
+
+def __firstChild(element, tag):
+    return next(element.iterchildren(tag), None)
+
+
+def parseTextRegion(textRegion, namespace: dict) -> Optional[TextRegion]:
+    coordsTag, textLineTag, baselineTag, textEquivTag, unicodeTag = \
+        [__tag(namespace[""], name) for name in ["Coords", "TextLine", "Baseline", "TextEquiv", "Unicode"]]
+    trCoords = __firstChild(textRegion, coordsTag)
+    if trCoords is None:
+        return None
+    coordString = trCoords.attrib["points"]
+    coords = coordString.split()
+    xCoords = [int(p.split(",")[0]) for p in coords]
+    yCoords = [int(p.split(",")[1]) for p in coords]
+
+    tR = TextRegion(id=textRegion.attrib["id"], x0=min(xCoords), x1=max(xCoords), y0=min(yCoords), y1=max(yCoords),
+                    coordString=coordString)
+
+    for line in textRegion.iterchildren(textLineTag):
+        coords = __firstChild(line, coordsTag).attrib["points"].split()
+        xCoords = [int(p.split(",")[0]) for p in coords]
+        yCoords = [int(p.split(",")[1]) for p in coords]
+
+        baseline = __firstChild(line, baselineTag)
+        baselineString = ""
+        if baseline is not None:
+            baselineString = baseline.attrib["points"]
+
+        l = TextLine(id=line.attrib["id"], xCoords=xCoords, yCoords=yCoords, baseline=baselineString)
+
+        textEquiv = __firstChild(line, textEquivTag)
+        if textEquiv is not None and len(textEquiv):
+            unicodeText = __firstChild(textEquiv, unicodeTag).text
+            if unicodeText:
+                l.transcription = unicodeText
+
+        tR.lines.append(l)
+    return tR
+
+
+def __rootTag(path: Path) -> str:
+    with path.open("rb") as inFile:
+        _, root = next(etree.iterparse(inFile, events=("start",)))
+    return root.tag
+
+
+def transcriptionFormat(path: Path) -> str:
+    """
+    Returns "ALTO" or "PAGE" depending on the root element of the transcription file, or "OTHER" for any other XML.
+    Only the root tag is read, not the whole file.
+    """
+    return __format(__rootTag(path))
+
+
+def __format(rootTag: str) -> str:
+    if "alto" in rootTag:
+        return "ALTO"
+    elif "PcGts" in rootTag:
+        return "PAGE"
+    return "OTHER"
+
+
+def __release(element):
+    # drops the element's content and everything before it, which has been processed already
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def __altoLines(path: Path, rootTag: str) -> List[str]:
+    namespace = rootTag.split("}")[0].strip("{")
+    textLineTag, spTag, stringTag = [__tag(namespace, name) for name in ["TextLine", "SP", "String"]]
+    lines = []
+    with path.open("rb") as inFile:
+        for _, element in etree.iterparse(inFile, tag=[textLineTag, __tag(namespace, "TextBlock")]):
+            if element.tag == textLineTag:
+                lines.append("".join(" " if entry.tag == spTag else entry.get("CONTENT")
+                                     for entry in element.iterchildren(spTag, stringTag)))
+            __release(element)
+    return lines
+
+
+def __pageContent(path: Path, rootTag: str, geometry: bool, text: bool) -> Transcription:
+    transcription = Transcription("PAGE")
+    namespace = pageNamespace(rootTag)
+    pageTag, regionTag, textLineTag, textEquivTag, unicodeTag = \
+        [__tag(namespace[""], name) for name in ["Page", "TextRegion", "TextLine", "TextEquiv", "Unicode"]]
+    pageElement = None
+    tags = [pageTag, regionTag, textLineTag] if text else [pageTag, regionTag]
+    with path.open("rb") as inFile:
+        for event, element in etree.iterparse(inFile, events=("start", "end"), tag=tags):
+            if event == "start":
+                if element.tag == pageTag and pageElement is None and element.getparent().getparent() is None:
+                    pageElement = element
+                    if geometry:
+                        transcription.page = Page(height=element.attrib["imageHeight"],
+                                                  width=element.attrib["imageWidth"])
+            elif element.tag == textLineTag:
+                for textEquiv in element.iterchildren(textEquivTag):
+                    for unicodeElement in textEquiv.iterchildren(unicodeTag):
+                        transcription.lines.append(unicodeElement.text or "")
+            elif element.tag == regionTag and pageElement is not None and element.getparent() is pageElement:
+                if geometry:
+                    region = parseTextRegion(element, namespace)
+                    if region is not None:
+                        transcription.page.regions.append(region)
+                __release(element)
+    return transcription
+
+
+def extractTranscription(path: Path, geometry: bool = True, text: bool = True) -> Transcription:
+    """
+    Reads the transcription file in a single ``iterparse`` pass (after peeking at the root tag), releasing every line
+    (ALTO) or text region (PAGE) once it has been processed, so that memory use does not grow with the size of the
+    file. Line texts follow the ALTO ``String``/``SP`` elements of each ``TextLine`` and the
+    ``TextLine/TextEquiv/Unicode`` elements of PAGE. The page geometry is only collected for PAGE files and if
+    ``geometry`` is set, the lines of PAGE files only if ``text`` is set.
+    """
+    rootTag = __rootTag(path)
+    fileFormat = __format(rootTag)
+    if fileFormat == "ALTO":
+        return Transcription(fileFormat, __altoLines(path, rootTag))
+    elif fileFormat == "PAGE":
+        return __pageContent(path, rootTag, geometry, text)
+    return Transcription(fileFormat)
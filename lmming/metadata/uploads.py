@@ -0,0 +1,134 @@
+import os
+import shutil
+from pathlib import Path
+from typing import List, Dict, Any, Tuple, BinaryIO
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from metadata.ingest import buildTransfer
+from metadata.models import TransferUpload, UploadedFile, ExtractionTransfer, ProcessingStep
+from metadata.utils import parseFilename, buildReportIdentifier
+
+READ_SIZE = 64 * 1024
+
+
+class UploadConflict(Exception):
+    """
+    Raised if a chunk does not start where the data received so far ends, e.g. because an earlier request was
+    interrupted. The client should continue from ``received``.
+    """
+
+    def __init__(self, received: int):
+        super().__init__(f"expected a chunk starting at byte {received}")
+        self.received = received
+
+
+def startUpload(name: str, handler: str, pipeline: str, stepConfig: List[Dict[str, Any]]) -> TransferUpload:
+    return TransferUpload.objects.create(name=name, handler=handler, pipeline=pipeline, stepConfig=[
+        {"stepType": entry["stepType"].name, "mode": entry["mode"], "humanValidation": entry["humanValidation"]}
+        for entry in stepConfig])
+
+
+def addFiles(upload: TransferUpload, files: List[Tuple[str, int]]) -> List[str]:
+    """
+    Registers the ``(name, size)`` files of an upload, parsing their names right away so that the reports they belong
+    to are known before any data arrives. Returns the names that were rejected. Files that are already registered keep
+    their progress, so the same list can be sent again when resuming an upload.
+    """
+    rejected, accepted = [], []
+    for name, size in files:
+        try:
+            if not name or os.path.basename(name) != name or name.startswith(".") or size < 0:
+                raise SyntaxError(f"invalid file '{name}'")
+            reportIdentifier = buildReportIdentifier(parseFilename(name))
+        except SyntaxError as _e:
+            rejected.append(name)
+            continue
+        accepted.append(UploadedFile(upload=upload, name=name, size=size, reportIdentifier=reportIdentifier))
+    UploadedFile.objects.bulk_create(accepted, ignore_conflicts=True)
+    return rejected
+
+
+def uploadProgress(upload: TransferUpload) -> Dict[str, Any]:
+    files = {name: {"size": size, "received": received}
+             for name, size, received in upload.files.values_list("name", "size", "received")}
+    return {"upload": str(upload.pk), "files": files,
+            "size": sum(f["size"] for f in files.values()), "received": sum(f["received"] for f in files.values()),
+            "transfer": upload.transfer_id}
+
+
+def writeChunk(upload: TransferUpload, name: str, start: int, length: int, stream: BinaryIO) -> int:
+    """
+    Appends ``length`` bytes read from ``stream`` to the part file of the given file, block by block, and returns the
+    number of bytes received for this file so far. Chunks of the same file are written one at a time.
+    """
+    with transaction.atomic():
+        uploadedFile = upload.files.select_for_update().get(name=name)
+        if start != uploadedFile.received:
+            raise UploadConflict(uploadedFile.received)
+        if length < 0 or start + length > uploadedFile.size:
+            raise ValueError(f"chunk exceeds the size of '{name}'")
+
+        part = upload.directory / name
+        part.parent.mkdir(parents=True, exist_ok=True)
+        with part.open("r+b" if part.exists() else "wb") as outFile:
+            # drops whatever an interrupted request wrote without it being recorded
+            outFile.truncate(start)
+            outFile.seek(start)
+            remaining = length
+            while remaining:
+                block = stream.read(min(READ_SIZE, remaining))
+                if not block:
+                    break
+                outFile.write(block)
+                remaining -= len(block)
+
+        uploadedFile.received = start + length - remaining
+        uploadedFile.save(update_fields=["received"])
+    return uploadedFile.received
+
+
+def finishUpload(upload: TransferUpload) -> ExtractionTransfer:
+    """
+    Moves the uploaded files into the media storage and creates the transfer (see ``ingest.buildTransfer``). Calling
+    this again returns the same transfer.
+    """
+    moved = []
+    try:
+        with transaction.atomic():
+            upload = TransferUpload.objects.select_for_update().get(pk=upload.pk)
+            if upload.transfer:
+                return upload.transfer
+
+            files = list(upload.files.order_by("name"))
+            missing = [f.name for f in files if not f.complete]
+            if missing:
+                raise ValueError(f"{len(missing)} file(s) have not been uploaded completely: {', '.join(missing[:5])}")
+
+            pagesToReports = {}
+            for uploadedFile in files:
+                data = parseFilename(uploadedFile.name)
+                data["file"] = default_storage.get_available_name(uploadedFile.name)
+                data["originalFileName"] = uploadedFile.name
+                part = upload.directory / uploadedFile.name
+                if not uploadedFile.size:
+                    part.parent.mkdir(parents=True, exist_ok=True)
+                    part.touch()
+                target = Path(settings.MEDIA_ROOT) / data["file"]
+                os.replace(part, target)
+                moved.append((part, target))
+                pagesToReports.setdefault(uploadedFile.reportIdentifier, []).append(data)
+
+            stepConfig = [dict(entry, stepType=ProcessingStep.ProcessingStepType[entry["stepType"]])
+                          for entry in upload.stepConfig]
+            upload.transfer = buildTransfer(upload.name, upload.handler, upload.pipeline, pagesToReports, stepConfig)
+            upload.save()
+    except BaseException:
+        # the transaction was rolled back: put the files back so that the upload can be finished again
+        for part, target in moved:
+            os.replace(target, part)
+        raise
+    shutil.rmtree(upload.directory, ignore_errors=True)
+    return upload.transfer
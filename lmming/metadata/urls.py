@@ -10,6 +10,10 @@ urlpatterns = [
     path("transfers", views.Transfers.as_view(), name="transfer_table"),
     path("transfer/create", partials.createTransfer, name="create_transfer"),
     path("transfer/import", partials.importTransfer, name="import_transfer"),
+    path("transfer/upload", partials.uploadStart, name="upload_start"),
+    path("transfer/upload/<uuid:upload_id>", partials.uploadStatus, name="upload_status"),
+    path("transfer/upload/<uuid:upload_id>/chunk", partials.uploadChunk, name="upload_chunk"),
+    path("transfer/upload/<uuid:upload_id>/finish", partials.uploadFinish, name="upload_finish"),
     path("transfer/<int:transfer_id>", views.Transfer.as_view(), name="transfer"),
     path("transfer/<int:transfer_id>/verify", partials.verifyTransfer, name="verify_transfer"),
     path("transfer/<int:transfer_id>/download/<str:filetype>", views.downloadTransfer, name="download_transfer"),
@@ -17,7 +21,6 @@ urlpatterns = [
     path("transfers/download", views.batchDownload, name="transfer_batch_export"),
     path("transfer/modal/delete/<int:transfer_id>", partials.deleteModal, name="transfer_delete_modal"),
     path("transfer/modal/cancel/<int:transfer_id>", partials.cancelTransferModal, name="transfer_cancel_modal"),
-    path("transfers/redirect/download", partials.batchDownloadRedirect, name="transfer_batch_redirect"),
     path("transfers/waiting/table", partials.waitingProcesses, name="waiting_reports_table"),
     path("job/<int:job_id>", views.jobDetails, name="job"),
     path("job/<int:job_id>/edit/<str:step>", views.JobEditView.as_view(), name="edit_job"),
@@ -1,19 +1,24 @@
+import csv
 import re
+import time
 import zipfile
 from collections.abc import Iterable
 from datetime import datetime, date
 from functools import partial
 from io import BytesIO
 from pathlib import Path
-from typing import Dict, Union, List, Any, Tuple
+from typing import Dict, Union, List, Any, Tuple, Iterator, Optional
+from urllib.parse import urlsplit
 
 import pandas as pd
 from django.conf import settings
+from django.db.models import Prefetch, prefetch_related_objects
 from lxml.etree import SubElement, register_namespace, QName, Element, tostring, parse
 from requests.compat import urljoin
 
-from metadata.models import Report, ExtractionTransfer, ExternalRecord, ProcessingStep, Status
-from metadata.xml_utils import convertPageToAlto
+from metadata.models import Report, ExtractionTransfer, ExternalRecord, ProcessingStep, Status, Page
+from metadata.transcription import transcriptionFormat
+from metadata.xml_utils import convertedAltoPath, conversionKey, writeAlto, removeOutdatedAlto
 
 __REPORT_TYPE_INDEX = {"ars": Report.DocumentType.ANNUAL_REPORT,
                        "verksam": Report.DocumentType.ANNUAL_REPORT,
@@ -84,6 +89,20 @@ def parseUnionId(filename: str) -> str:
     return unionId
 
 
+__IDENTIFIER_SUFFIXES = {"info.json", "manifest"}
+
+
+def noidFromIdentifier(identifier: str) -> str:
+    """
+    Returns the noid an ARK or handle URL points to, e.g. ``abc123`` for ``https://ark.example.org/ark:/12345/abc123``,
+    ``https://iiif.example.org/iiif/image/abc123/info.json`` or ``https://hdl.handle.net/20.1/abc123?locatt=view:x``.
+    """
+    segments = [s for s in urlsplit(identifier.strip()).path.split("/") if s]
+    while len(segments) > 1 and segments[-1] in __IDENTIFIER_SUFFIXES:
+        segments.pop()
+    return segments[-1] if segments else ""
+
+
 def parseFilename(filename: str) -> Dict[str, Union[int, str, List[str], List[datetime]]]:
     """
     Retrieves the union's ID, a type hint for the report type, the report's year(s) and the page number from the given
@@ -197,226 +216,172 @@ def __isRestricted(report: Report) -> bool:
     return report.accessRights == Report.AccessRights.RESTRICTED
 
 
-def __buildOmekaSummariesArabOther(transfer: ExtractionTransfer, checkRestriction: bool = False, forArab: bool = True):
-    reportSummary = []
-    pageSummary = []
-    for report in transfer.report_set.all():
-        # TODO: add null/none checks!!
-        reportEntry = {"dcterms:identifier": report.identifier,
-                       "dcterms:title": report.title,
-                       "dcterms:creator": report.creator,
-                       "dcterms:date": formatDateString(report.date, "|"),
-                       "dcterms:language": __toOmekaList(report.language),
-                       "dcterms:spatial": __toOmekaList(report.spatial),
-                       "dcterms:type": report.type_other,
-                       "dcterms:license": __toOmekaList(report.license),
-                       "dcterms:accessRights": Report.AccessRights[report.accessRights].label,
-                       "dcterms:created": report.created.year,
-                       "dcterms:source": __toOmekaList(report.source),
-                       "dcterms:description": report.description,
-                       "dcterms:publisher": report.publisher,
-                       "dcterms:format": __toOmekaList(report.format),
-                       "dcterms:comment": report.comment,
-                       "dcterms:medium": __toOmekaList(report.medium)
-                       }
+def loadTransferSnapshots(transfers: List[ExtractionTransfer]) -> List[ExtractionTransfer]:
+    """
+    Loads all reports of the given transfers together with their pages (ordered by ``order``), translations and
+    FAC-specific data in a fixed number of queries, independent of the number of transfers, reports and pages.
+    Afterwards, ``transfer.report_set.all()``, ``report.page_set.all()`` and ``report.reporttranslation_set.all()`` are
+    served from memory, so the export builders can walk a transfer as often as they need to. Transfers that were
+    already loaded are not queried again.
+    """
+    transfers = list(transfers)
+    prefetch_related_objects(transfers,
+                             Prefetch("report_set", queryset=Report.objects.order_by("pk").select_related(
+                                 "facspecificdata")),
+                             Prefetch("report_set__page_set", queryset=Page.objects.order_by("order")),
+                             "report_set__reporttranslation_set")
+    return transfers
+
+
+def __swedishTranslation(report: Report):
+    # filtering the prefetched translations instead of the queryset avoids a query per report
+    return next((t for t in report.reporttranslation_set.all() if t.language == "sv"), None)
+
+
+__OMEKA_ITEM_COLUMNS = ["dcterms:identifier", "dcterms:title", "dcterms:creator", "dcterms:date", "dcterms:coverage",
+                        "dcterms:language", "dcterms:spatial", "dcterms:type", "dcterms:license", "dcterms:isVersionOf",
+                        "dcterms:isFormatOf", "dcterms:accessRights", "dcterms:relation", "dcterms:created",
+                        "dcterms:available", "dcterms:source", "dcterms:description"]
+__OMEKA_ITEM_COLUMNS_ARAB_OTHER = ["dcterms:identifier", "dcterms:title", "dcterms:creator", "dcterms:date",
+                                   "dcterms:language", "dcterms:spatial", "dcterms:type", "dcterms:license",
+                                   "dcterms:accessRights", "dcterms:created", "dcterms:source", "dcterms:description",
+                                   "dcterms:publisher", "dcterms:format", "dcterms:comment", "dcterms:medium"]
+__OMEKA_MEDIA_COLUMNS = ["dcterms:isPartOf", "dcterms:identifier", "dcterms:source", "dcterms:bibliographicCitation",
+                         "lm:transcription", "lm:normalised", "lm:person", "lm:organisation", "lm:location", "lm:time",
+                         "lm:work", "lm:event", "lm:object", "lm:measure"]
+__OMEKA_MEDIA_COLUMNS_ARAB_OTHER = ["dcterms:isPartOf", "dcterms:identifier", "dcterms:source",
+                                    "dcterms:bibliographicCitation", "lm:transcription", "lm:person", "lm:organisation",
+                                    "lm:location", "lm:time", "lm:work", "lm:event", "lm:object"]
+__ENTITY_COLUMNS = {"lm:person": "persons", "lm:organisation": "organisations", "lm:location": "locations",
+                    "lm:time": "times", "lm:work": "works", "lm:event": "events", "lm:object": "ner_objects"}
+__TRANSLATION_FIELDS = ["coverage", "type", "isFormatOf", "accessRights", "description"]
+
+
+def __restrictedTranscription(forArab: bool) -> str:
+    if forArab:
+        return ("THE CONTENTS OF THIS REPORT ARE NOT PUBLICLY AVAILABLE. PLEASE CONTACT "
+                "ARBETARRÖRELSENS ARKIV OCH BIBLIOTEK FOR MORE INFORMATION. INFO@ARBARK.SE "
+                "WWW.ARBARK.SE/KONTAKT ARBETARRÖRELSENS ARKIV OCH BIBLIOTEK Swedish Labour Movement's "
+                "Archvies and Library")
+    return ("FOLKRÖRELSEARKVET FÖR UPPSALA LÄN The contents of this report are "
+            "not publicly available. Please contact Folkrörelsearkivet för "
+            "Uppsala Län for more information. Email: info@fauppsala.se "
+            "https://www.fauppsala.se/kontakt/ FOLKRÖRELSEARKIVET FÖR UPPSALA "
+            "LÄN")
+
+
+def __restrictedPageIdentifier(report: Report) -> str:
+    return urljoin(settings.IIIF_BASE_URL, f"iiif/image/{report.noid}_1/info.json")
+
+
+def __omekaItemValues(report: Report) -> List[Any]:
+    # TODO: add null/none checks!!
+    identifier = report.identifier
+    if settings.ARCHIVE_INST in ["FAC", "ARAB"]:
+        if " " not in report.identifier:
+            identifier = f"{report.identifier} {report.identifier}"
+
+    return [identifier, report.title, report.creator, formatDateString(report.date, "|"),
+            Report.UnionLevel[report.coverage].label, __toOmekaList(report.language), __toOmekaList(report.spatial),
+            __toOmekaList([Report.DocumentType[x].label for x in report.type]), __toOmekaList(report.license),
+            report.isVersionOf, __toOmekaList([Report.DocumentFormat[x].label for x in report.isFormatOf]),
+            Report.AccessRights[report.accessRights].label, __toOmekaList(report.relation), report.created.year,
+            report.available, __toOmekaList(report.source), report.description]
+
+
+def __omekaItemValuesArabOther(report: Report) -> List[Any]:
+    # TODO: add null/none checks!!
+    return [report.identifier, report.title, report.creator, formatDateString(report.date, "|"),
+            __toOmekaList(report.language), __toOmekaList(report.spatial), report.type_other,
+            __toOmekaList(report.license), Report.AccessRights[report.accessRights].label, report.created.year,
+            __toOmekaList(report.source), report.description, report.publisher, __toOmekaList(report.format),
+            report.comment, __toOmekaList(report.medium)]
+
+
+def __omekaItemColumns(reports: List[Report], baseColumns: List[str]) -> List[str]:
+    """
+    Columns of items.csv in the order they have always been written in: the fixed columns, the translation columns of
+    the first report, the entity columns and then the translation columns of any further language.
+    """
+    columns = list(baseColumns)
+    for i, report in enumerate(reports):
         for translation in report.reporttranslation_set.all():
-            language = translation.language
-            reportEntry.update({f"dcterms:coverage.{language}": translation.coverage,
-                                f"dcterms:type.{language}": __toOmekaList(translation.type),
-                                f"dcterms:isFormatOf.{language}": __toOmekaList(translation.isFormatOf),
-                                f"dcterms:accessRights.{language}": translation.accessRights,
-                                f"dcterms:description.{language}": translation.description})
-
-        reportSummary.append(reportEntry)
-
-        persons = set()
-        organisations = set()
-        locations = set()
-        times = set()
-        works = set()
-        events = set()
-        objects = set()
+            for field in __TRANSLATION_FIELDS:
+                column = f"dcterms:{field}.{translation.language}"
+                if column not in columns:
+                    columns.append(column)
+        if i == 0:
+            columns.extend(__ENTITY_COLUMNS)
+    return columns
 
-        if checkRestriction and __isRestricted(report):
-            transcription = ("FOLKRÖRELSEARKVET FÖR UPPSALA LÄN The contents of this report are "
-                             "not publicly available. Please contact Folkrörelsearkivet för "
-                             "Uppsala Län for more information. Email: info@fauppsala.se "
-                             "https://www.fauppsala.se/kontakt/ FOLKRÖRELSEARKIVET FÖR UPPSALA "
-                             "LÄN")
-            if forArab:
-                transcription = ("THE CONTENTS OF THIS REPORT ARE NOT PUBLICLY AVAILABLE. PLEASE CONTACT "
-                                 "ARBETARRÖRELSENS ARKIV OCH BIBLIOTEK FOR MORE INFORMATION. INFO@ARBARK.SE "
-                                 "WWW.ARBARK.SE/KONTAKT ARBETARRÖRELSENS ARKIV OCH BIBLIOTEK Swedish Labour Movement's "
-                                 "Archvies and Library")
-
-            pageSummary.append({"dcterms:isPartOf": report.identifier,
-                                "dcterms:identifier": urljoin(settings.IIIF_BASE_URL,
-                                                              f"iiif/image/{report.noid}_1/info.json"),
-                                "dcterms:source": "",
-                                "dcterms:bibliographicCitation": "",
-                                "lm:transcription": transcription, "lm:person": "",
-                                "lm:organisation": "", "lm:location": "", "lm:time": "", "lm:work": "", "lm:event": "",
-                                "lm:object": ""})
-        else:
-            for page in report.page_set.all().order_by("order"):
-                pageSummary.append({"dcterms:isPartOf": report.identifier,
-                                    "dcterms:identifier": page.identifier,
-                                    "dcterms:source": page.source,
-                                    "dcterms:bibliographicCitation": page.bibCitation,
-                                    "lm:transcription": page.transcription,
-                                    "lm:person": __toOmekaList(page.persons),
-                                    "lm:organisation": __toOmekaList(page.organisations),
-                                    "lm:location": __toOmekaList(page.locations),
-                                    "lm:time": __toOmekaList(page.times),
-                                    "lm:work": __toOmekaList(page.works),
-                                    "lm:event": __toOmekaList(page.events),
-                                    "lm:object": __toOmekaList(page.ner_objects)})
-                persons.update(page.persons)
-                organisations.update(page.organisations)
-                locations.update(page.locations)
-                times.update(page.times)
-                works.update(page.works)
-                events.update(page.events)
-                objects.update(page.ner_objects)
-        reportEntry["lm:person"] = __toOmekaList(persons)
-        reportEntry["lm:organisation"] = __toOmekaList(organisations)
-        reportEntry["lm:location"] = __toOmekaList(locations)
-        reportEntry["lm:time"] = __toOmekaList(times)
-        reportEntry["lm:work"] = __toOmekaList(works)
-        reportEntry["lm:event"] = __toOmekaList(events)
-        reportEntry["lm:object"] = __toOmekaList(objects)
-
-    return reportSummary, pageSummary
-
-
-def __buildOmekaSummaries(transfer: ExtractionTransfer, checkRestriction: bool = False, forArab: bool = False) -> \
-        Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
-    reportSummary = []
-    pageSummary = []
-    for report in transfer.report_set.all():
-        # TODO: add null/none checks!!
-        identifier = report.identifier
-        if settings.ARCHIVE_INST in ["FAC", "ARAB"]:
-            if " " not in report.identifier:
-                identifier = f"{report.identifier} {report.identifier}"
-
-        reportEntry = {"dcterms:identifier": identifier,
-                       "dcterms:title": report.title,
-                       "dcterms:creator": report.creator,
-                       "dcterms:date": formatDateString(report.date, "|"),
-                       "dcterms:coverage": Report.UnionLevel[report.coverage].label,
-                       "dcterms:language": __toOmekaList(report.language),
-                       "dcterms:spatial": __toOmekaList(report.spatial),
-                       "dcterms:type": __toOmekaList([Report.DocumentType[x].label for x in report.type]),
-                       "dcterms:license": __toOmekaList(report.license),
-                       "dcterms:isVersionOf": report.isVersionOf,
-                       "dcterms:isFormatOf": __toOmekaList(
-                           [Report.DocumentFormat[x].label for x in report.isFormatOf]),
-                       "dcterms:accessRights": Report.AccessRights[report.accessRights].label,
-                       "dcterms:relation": __toOmekaList(report.relation),
-                       "dcterms:created": report.created.year,
-                       "dcterms:available": report.available,
-                       "dcterms:source": __toOmekaList(report.source),
-                       "dcterms:description": report.description}
+
+def __omekaItemRows(reports: List[Report], columns: List[str], itemValues, checkRestriction: bool):
+    position = {column: i for i, column in enumerate(columns)}
+    for report in reports:
+        row = itemValues(report)
+        row.extend([None] * (len(columns) - len(row)))
         for translation in report.reporttranslation_set.all():
             language = translation.language
-            reportEntry.update({f"dcterms:coverage.{language}": translation.coverage,
-                                f"dcterms:type.{language}": __toOmekaList(translation.type),
-                                f"dcterms:isFormatOf.{language}": __toOmekaList(translation.isFormatOf),
-                                f"dcterms:accessRights.{language}": translation.accessRights,
-                                f"dcterms:description.{language}": translation.description})
-
-        reportSummary.append(reportEntry)
-
-        persons = set()
-        organisations = set()
-        locations = set()
-        times = set()
-        works = set()
-        events = set()
-        objects = set()
+            row[position[f"dcterms:coverage.{language}"]] = translation.coverage
+            row[position[f"dcterms:type.{language}"]] = __toOmekaList(translation.type)
+            row[position[f"dcterms:isFormatOf.{language}"]] = __toOmekaList(translation.isFormatOf)
+            row[position[f"dcterms:accessRights.{language}"]] = translation.accessRights
+            row[position[f"dcterms:description.{language}"]] = translation.description
+
+        entities = {column: set() for column in __ENTITY_COLUMNS}
+        if not (checkRestriction and __isRestricted(report)):
+            for page in report.page_set.all():
+                for column, field in __ENTITY_COLUMNS.items():
+                    entities[column].update(getattr(page, field))
+        for column, values in entities.items():
+            row[position[column]] = __toOmekaList(values)
+        yield row
 
+
+def __omekaMediaRows(reports: List[Report], checkRestriction: bool, forArab: bool, arabOther: bool = False):
+    for report in reports:
         if checkRestriction and __isRestricted(report):
-            transcription = ("FOLKRÖRELSEARKVET FÖR UPPSALA LÄN The contents of this report are "
-                             "not publicly available. Please contact Folkrörelsearkivet för "
-                             "Uppsala Län for more information. Email: info@fauppsala.se "
-                             "https://www.fauppsala.se/kontakt/ FOLKRÖRELSEARKIVET FÖR UPPSALA "
-                             "LÄN")
-            if forArab:
-                transcription = ("THE CONTENTS OF THIS REPORT ARE NOT PUBLICLY AVAILABLE. PLEASE CONTACT "
-                                 "ARBETARRÖRELSENS ARKIV OCH BIBLIOTEK FOR MORE INFORMATION. INFO@ARBARK.SE "
-                                 "WWW.ARBARK.SE/KONTAKT ARBETARRÖRELSENS ARKIV OCH BIBLIOTEK Swedish Labour Movement's "
-                                 "Archvies and Library")
-
-            pageSummary.append({"dcterms:isPartOf": report.identifier,
-                                "dcterms:identifier": urljoin(settings.IIIF_BASE_URL,
-                                                              f"iiif/image/{report.noid}_1/info.json"),
-                                "dcterms:source": "",
-                                "dcterms:bibliographicCitation": "",
-                                "lm:transcription": transcription, "lm:normalised": "", "lm:person": "",
-                                "lm:organisation": "", "lm:location": "", "lm:time": "", "lm:work": "", "lm:event": "",
-                                "lm:object": "", "lm:measure": False})
+            row = [report.identifier, __restrictedPageIdentifier(report), "", "", __restrictedTranscription(forArab)]
+            if arabOther:
+                yield row + [""] * len(__ENTITY_COLUMNS)
+            else:
+                yield row + [""] + [""] * len(__ENTITY_COLUMNS) + [False]
         else:
-            for page in report.page_set.all().order_by("order"):
-                pageSummary.append({"dcterms:isPartOf": report.identifier,
-                                    "dcterms:identifier": page.identifier,
-                                    "dcterms:source": page.source,
-                                    "dcterms:bibliographicCitation": page.bibCitation,
-                                    "lm:transcription": page.transcription,
-                                    "lm:normalised": page.normalisedTranscription,
-                                    "lm:person": __toOmekaList(page.persons),
-                                    "lm:organisation": __toOmekaList(page.organisations),
-                                    "lm:location": __toOmekaList(page.locations),
-                                    "lm:time": __toOmekaList(page.times),
-                                    "lm:work": __toOmekaList(page.works),
-                                    "lm:event": __toOmekaList(page.events),
-                                    "lm:object": __toOmekaList(page.ner_objects),
-                                    "lm:measure": page.measures})
-                persons.update(page.persons)
-                organisations.update(page.organisations)
-                locations.update(page.locations)
-                times.update(page.times)
-                works.update(page.works)
-                events.update(page.events)
-                objects.update(page.ner_objects)
-        reportEntry["lm:person"] = __toOmekaList(persons)
-        reportEntry["lm:organisation"] = __toOmekaList(organisations)
-        reportEntry["lm:location"] = __toOmekaList(locations)
-        reportEntry["lm:time"] = __toOmekaList(times)
-        reportEntry["lm:work"] = __toOmekaList(works)
-        reportEntry["lm:event"] = __toOmekaList(events)
-        reportEntry["lm:object"] = __toOmekaList(objects)
-
-    return reportSummary, pageSummary
-
+            for page in report.page_set.all():
+                row = [report.identifier, page.identifier, page.source, page.bibCitation, page.transcription]
+                entities = [__toOmekaList(getattr(page, field)) for field in __ENTITY_COLUMNS.values()]
+                if arabOther:
+                    yield row + entities
+                else:
+                    yield row + [page.normalisedTranscription] + entities + [page.measures]
 
-def buildBulkTransferCsvs(transfers: List[ExtractionTransfer], checkRestriction: bool = False, forArab: bool = False):
-    reportBulk = []
-    pageBulk = []
-    for transfer in transfers:
-        reportSummary, pageSummary = __buildOmekaSummaries(transfer, checkRestriction, forArab=forArab)
-        reportBulk.extend(reportSummary)
-        pageBulk.extend(pageSummary)
 
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-        zf.writestr("bulk_items.csv", pd.DataFrame.from_records(reportBulk).to_csv(index=False))
-        zf.writestr("bulk_media.csv", pd.DataFrame.from_records(pageBulk).to_csv(index=False))
-    zip_buffer.seek(0)
+def __omekaCsvs(transfers: List[ExtractionTransfer], checkRestriction: bool, forArab: bool, arabOther: bool = False) \
+        -> Tuple[Iterator[str], Iterator[str]]:
+    """
+    Returns the lines of the Omeka items and media CSVs of the given transfers.
+    """
+    reports = [report for transfer in loadTransferSnapshots(transfers) for report in transfer.report_set.all()]
+    if arabOther:
+        columns = __omekaItemColumns(reports, __OMEKA_ITEM_COLUMNS_ARAB_OTHER)
+        items = __omekaItemRows(reports, columns, __omekaItemValuesArabOther, checkRestriction)
+        media = __omekaMediaRows(reports, checkRestriction, forArab, arabOther=True)
+        return csvLines(columns, items), csvLines(__OMEKA_MEDIA_COLUMNS_ARAB_OTHER, media)
 
-    return zip_buffer
+    columns = __omekaItemColumns(reports, __OMEKA_ITEM_COLUMNS)
+    items = __omekaItemRows(reports, columns, __omekaItemValues, checkRestriction)
+    media = __omekaMediaRows(reports, checkRestriction, forArab)
+    return csvLines(columns, items), csvLines(__OMEKA_MEDIA_COLUMNS, media)
 
 
-def buildTransferCsvs(transfer: ExtractionTransfer, checkRestriction: bool = False, forArab: bool = False):
-    reportSummary, pageSummary = __buildOmekaSummaries(transfer, checkRestriction, forArab=forArab)
+def buildBulkTransferCsvs(transfers: List[ExtractionTransfer], checkRestriction: bool = False, forArab: bool = False):
+    items, media = __omekaCsvs(transfers, checkRestriction, forArab=forArab)
+    return BytesIO(b"".join(streamZip([("bulk_items.csv", items), ("bulk_media.csv", media)])))
 
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-        zf.writestr("items.csv", pd.DataFrame.from_records(reportSummary).to_csv(index=False))
-        zf.writestr("media.csv", pd.DataFrame.from_records(pageSummary).to_csv(index=False))
-    zip_buffer.seek(0)
 
-    return zip_buffer
+def buildTransferCsvs(transfer: ExtractionTransfer, checkRestriction: bool = False, forArab: bool = False):
+    items, media = __omekaCsvs([transfer], checkRestriction, forArab=forArab)
+    return BytesIO(b"".join(streamZip([("items.csv", items), ("media.csv", media)])))
 
 
 def buildStructMap(transfer: ExtractionTransfer, checkRestriction: bool = False) -> str:
@@ -428,6 +393,7 @@ def buildStructMap(transfer: ExtractionTransfer, checkRestriction: bool = False)
     structMap = SubElement(root, f("structMap"), TYPE="logical", ID="structMap_lm", LABEL="LM structure")
     outerDiv = SubElement(structMap, f("div"))
 
+    loadTransferSnapshots([transfer])
     for report in transfer.report_set.all():
         reportNode = SubElement(outerDiv, f("div"), TYPE="report", LABEL=report.title, ID=str(report.noid))
 
@@ -463,86 +429,62 @@ def buildNormalizationCsv(srcNames, withPreservation: bool = True) -> str:
     return df.to_csv(header=False, index=False)
 
 
-def buildArabOtherMetadataCsv(transfer: ExtractionTransfer, checkRestriction: bool = False) -> str:
-    records = []
+__ARAB_OTHER_METADATA_COLUMNS = ["filename", "dc.identifier", "dc.type", "dc.date", "dc.language", "dc.publisher",
+                                 "dc.source", "dc.creator", "dc.title", "dc.description", "dc.created", "dc.format",
+                                 "dc.accessRights", "dc.license", "dc.comment", "dc.spatial", "dc.medium"]
+# access rights and license are both written as dc.rights
+__METADATA_COLUMNS = ["filename", "dc.identifier", "dc.type", "dc.date", "dc.language", "dc.coverage", "dc.title",
+                      "dc.creator", "dc.source", "dc.relation", "dc.format", "dc.rights", "dc.rights", "dc.contributor",
+                      "dc.publisher", "dc.subject"]
 
-    for report in transfer.report_set.all():
-        translation = report.reporttranslation_set.filter(language="sv")
+
+def __arabOtherMetadataRows(transfer: ExtractionTransfer, checkRestriction: bool):
+    for report in loadTransferSnapshots([transfer])[0].report_set.all():
+        translation = __swedishTranslation(report)
         if translation:
-            translation = translation.first()
             dcType = __toCSList(translation.type)
             dcAccessRights = translation.accessRights
         else:
             dcType = report.type_other
             dcAccessRights = Report.AccessRights[report.accessRights].label
 
-        if checkRestriction and __isRestricted(report):
-            # Not following the AtoM standard, since ARAB doesn't use that!
-            row = {"dc.identifier": report.identifier,
-                   "dc.type": dcType,
-                   "dc.date": "/".join([d.strftime("%Y-%m-%d") for d in report.date]),
-                   "dc.language": __toCSList(report.language),
-                   "dc.publisher": report.publisher,
-                   "dc.source": __toCSList(report.source),
-                   "dc.creator": report.creator,
-                   "dc.title": report.title,
-                   "dc.description": report.description,
-                   "dc.created": report.created.strftime("%Y-%m-%d"),
-                   "dc.format": __toCSList(report.format),
-                   "dc.accessRights": dcAccessRights,
-                   "dc.license": __toCSList(report.license),
-                   "dc.comment": report.comment,
-                   "dc.spatial": __toCSList(report.spatial),
-                   "dc.medium": __toCSList(report.medium)
-                   }
+        # Not following the AtoM standard, since ARAB doesn't use that!
+        restricted = checkRestriction and __isRestricted(report)
+        row = [report.identifier if restricted else report.noid,
+               dcType,
+               "/".join([d.strftime("%Y-%m-%d") for d in report.date]),
+               __toCSList(report.language),
+               report.publisher,
+               __toCSList(report.source),
+               report.creator,
+               report.title,
+               report.description,
+               report.created.strftime("%Y-%m-%d"),
+               __toCSList(report.format),
+               dcAccessRights,
+               __toCSList(report.license),
+               report.comment,
+               __toCSList(report.spatial),
+               __toCSList(report.medium) if restricted else report.medium]
+
+        if restricted:
             filename = f"page_not_available_{report.noid}"
-            transcriptionFilename = f"objects/transcription/{filename}.xml"
-            preserverationFilename = f"objects/{filename}.jpg"
-            a = {"filename": transcriptionFilename}
-            a.update(row)
-            b = {"filename": preserverationFilename}
-            b.update(row)
-            records.append(a)
-            records.append(b)
+            yield [f"objects/transcription/{filename}.xml"] + row
+            yield [f"objects/{filename}.jpg"] + row
         else:
-            row = {"dc.identifier": report.noid,
-                   "dc.type": dcType,
-                   "dc.date": "/".join([d.strftime("%Y-%m-%d") for d in report.date]),
-                   "dc.language": __toCSList(report.language),
-                   "dc.publisher": report.publisher,
-                   "dc.source": __toCSList(report.source),
-                   "dc.creator": report.creator,
-                   "dc.title": report.title,
-                   "dc.description": report.description,
-                   "dc.created": report.created.strftime("%Y-%m-%d"),
-                   "dc.format": __toCSList(report.format),
-                   "dc.accessRights": dcAccessRights,
-                   "dc.license": __toCSList(report.license),
-                   "dc.comment": report.comment,
-                   "dc.spatial": __toCSList(report.spatial),
-                   "dc.medium": report.medium
-                   }
             for page in report.page_set.all():
-                transcriptionFilename = f"objects/transcription/{page.originalFileName}"
-                preserverationFilename = f"objects/{page.originalFileName[:-4]}.jpg"
-                a = {"filename": transcriptionFilename}
-                a.update(row)
-                b = {"filename": preserverationFilename}
-                b.update(row)
-                records.append(a)
-                records.append(b)
-    df = pd.DataFrame.from_records(records)
-    cols = df.columns.to_list()
-    return df.to_csv(index=False, header=cols)
-
-
-def buildMetadataCsv(transfer: ExtractionTransfer, checkRestriction: bool = False) -> str:
-    records = []
+                yield [f"objects/transcription/{page.originalFileName}"] + row
+                yield [f"objects/{page.originalFileName[:-4]}.jpg"] + row
 
-    for report in transfer.report_set.all():
-        translation = report.reporttranslation_set.filter(language="sv")
+
+def buildArabOtherMetadataCsv(transfer: ExtractionTransfer, checkRestriction: bool = False) -> Iterator[str]:
+    return csvLines(__ARAB_OTHER_METADATA_COLUMNS, __arabOtherMetadataRows(transfer, checkRestriction))
+
+
+def __metadataRows(transfer: ExtractionTransfer, checkRestriction: bool):
+    for report in loadTransferSnapshots([transfer])[0].report_set.all():
+        translation = __swedishTranslation(report)
         if translation:
-            translation = translation.first()
             dcType = __toCSList(translation.type)
             dcCoverage = translation.coverage
             dcAccessRights = translation.accessRights
@@ -553,139 +495,192 @@ def buildMetadataCsv(transfer: ExtractionTransfer, checkRestriction: bool = Fals
             dcAccessRights = Report.AccessRights[report.accessRights].label
             dcFormat = f"{report.description} - {__toCSList([Report.DocumentFormat[x].label for x in report.isFormatOf])}"
 
+        # dc.title comes after the first six columns and is prefixed for the transcriptions
+        head = [report.noid, dcType, "/".join([str(d.year) for d in report.date]), __toCSList(report.language),
+                dcCoverage]
+        tail = [report.creator, __toCSList(report.source), __toCSList(report.relation), dcFormat,
+                # "dc.description": report.description, # TODO: ???
+                dcAccessRights, __toOmekaList(report.license),
+                "", "", ""]  # dc.contributor, dc.publisher and dc.subject stay emtpy for now!
+        transcriptionTitle = "Transcription: " + report.title
+
         if checkRestriction and __isRestricted(report):
-            row = {"dc.identifier": report.noid,
-                   "dc.type": dcType,
-                   "dc.date": "/".join([str(d.year) for d in report.date]),
-                   "dc.language": __toCSList(report.language),
-                   "dc.coverage": dcCoverage,
-                   "dc.title": report.title,
-                   "dc.creator": report.creator,
-                   "dc.source": __toCSList(report.source),
-
-                   "dc.relation": __toCSList(report.relation),
-                   "dc.format": dcFormat,
-                   # "dc.description": report.description, # TODO: ???
-                   "dc.rights1": dcAccessRights,
-                   "dc.rights2": __toOmekaList(report.license),
-                   "dc.contributor": "", "dc.publisher": "", "dc.subject": ""  # these 3 stay emtpy for now!
-                   }
             filename = f"page_not_available_{report.noid}"
-            transcriptionFilename = f"objects/transcription/{filename}.xml"
-            preserverationFilename = f"objects/{filename}.jpg"
-            a = {"filename": transcriptionFilename}
-            a.update(row)
-            a["dc.title"] = "Transcription: " + a["dc.title"]
-            b = {"filename": preserverationFilename}
-            b.update(row)
-            records.append(a)
-            records.append(b)
+            yield [f"objects/transcription/{filename}.xml"] + head + [transcriptionTitle] + tail
+            yield [f"objects/{filename}.jpg"] + head + [report.title] + tail
         else:
-            row = {"dc.identifier": report.noid,
-                   "dc.type": dcType,
-                   "dc.date": "/".join([str(d.year) for d in report.date]),
-                   "dc.language": __toCSList(report.language),
-                   "dc.coverage": dcCoverage,
-                   "dc.title": report.title,
-                   "dc.creator": report.creator,
-                   "dc.source": __toCSList(report.source),
-                   "dc.relation": __toCSList(report.relation),
-                   "dc.format": dcFormat,
-                   # "dc.description": report.description, # TODO: ???
-                   "dc.rights1": dcAccessRights,
-                   "dc.rights2": __toOmekaList(report.license),
-                   "dc.contributor": "", "dc.publisher": "", "dc.subject": ""  # these 3 stay emtpy for now!
-                   }
             for page in report.page_set.all():
-                transcriptionFilename = f"objects/transcription/{page.originalFileName}"
-                preserverationFilename = f"objects/{page.originalFileName[:-4]}.jpg"
-                a = {"filename": transcriptionFilename}
-                a.update(row)
-                a["dc.title"] = "Transcription: " + a["dc.title"]
-                b = {"filename": preserverationFilename}
-                b.update(row)
-                records.append(a)
-                records.append(b)
-    df = pd.DataFrame.from_records(records)
-    cols = df.columns.to_list()
-    cols[cols.index("dc.rights1")] = "dc.rights"
-    cols[cols.index("dc.rights2")] = "dc.rights"
-    print(cols)
-    return df.to_csv(index=False, header=cols)
+                yield [f"objects/transcription/{page.originalFileName}"] + head + [transcriptionTitle] + tail
+                yield [f"objects/{page.originalFileName[:-4]}.jpg"] + head + [report.title] + tail
 
 
-def buildFolderStructure(transfer: ExtractionTransfer, checkRestriction: bool = False, forArab: bool = False,
-                         arabOther: bool = False):
-    dummyFileName = "page_not_available"
-    if forArab:
-        dummyFileName = "arab_restricted"
+def buildMetadataCsv(transfer: ExtractionTransfer, checkRestriction: bool = False) -> Iterator[str]:
+    return csvLines(__METADATA_COLUMNS, __metadataRows(transfer, checkRestriction))
+
+
+def altoTranscription(page: Page) -> Optional[Path]:
+    """
+    Returns the page's transcription as ALTO file, or None if it is neither ALTO nor PAGE XML. The format is detected
+    once and stored on the page; PAGE files are converted once and the result is kept next to the source, keyed by its
+    content and the ALTO template, so that later exports only copy it.
+    """
+    source = Path(page.transcriptionFile.path)
+    if not page.transcriptionFormat:
+        page.transcriptionFormat = transcriptionFormat(source)
+        # update() leaves lastUpdated alone, so cached exports stay valid
+        Page.objects.filter(pk=page.pk).update(transcriptionFormat=page.transcriptionFormat)
+
+    if page.transcriptionFormat == Page.TranscriptionFormat.ALTO:
+        return source
+    elif page.transcriptionFormat != Page.TranscriptionFormat.PAGE:
+        return None
+
+    converted = convertedAltoPath(source, conversionKey(source))
+    if not converted.exists():
+        writeAlto(source, converted, Path(page.originalFileName))
+        removeOutdatedAlto(source, converted)
+    return converted
 
-    outfile = BytesIO()
-    filenames = []
 
-    with zipfile.ZipFile(outfile, 'w', zipfile.ZIP_DEFLATED) as zf:
-        zif = zipfile.ZipInfo("manualNormalization/access/")
-        zf.writestr(zif, "")
+class __LineSink:
+    # csv writers return whatever ``write`` returns, which turns them into line formatters
+    @staticmethod
+    def write(line: str) -> str:
+        return line
+
+
+def csvLines(header: List[str], rows: Iterable[Iterable[Any]]) -> Iterator[str]:
+    """
+    Formats the header and rows as CSV lines, exactly like ``DataFrame.to_csv(index=False)`` would: minimal quoting,
+    "\\n" line endings, ``None`` as empty cell and everything else converted with ``str``.
+    """
+    writer = csv.writer(__LineSink(), lineterminator="\n")
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+class ZipStream:
+    """
+    Write-only file object that collects the output of a ``ZipFile`` until it is read. As it cannot seek, ``ZipFile``
+    writes a data descriptor after each entry instead of going back to fill in sizes and checksums, so everything
+    written so far can be passed on right away.
+    """
+
+    def __init__(self):
+        self.__chunks = []
+        self.__position = 0
 
-        if not forArab:
-            zif = zipfile.ZipInfo("manualNormalization/preservation/")
-            zf.writestr(zif, "")
+    def write(self, data) -> int:
+        self.__chunks.append(bytes(data))
+        self.__position += len(data)
+        return len(data)
 
-        for report in transfer.report_set.all():
-            if checkRestriction and __isRestricted(report):
-                page_name = f"page_not_available_{report.noid}"
-                zf.write(__DUMMY_DIR / f"{dummyFileName}.jpg", f"manualNormalization/access/{page_name}.jpg")
-                zf.write(__DUMMY_DIR / f"{dummyFileName}.jpg", f"{page_name}.jpg")
+    def tell(self) -> int:
+        return self.__position
 
-                if not forArab:
-                    zf.write(__DUMMY_DIR / f"{dummyFileName}.tif",
-                             f"manualNormalization/preservation/{page_name}.tif")
+    def flush(self):
+        pass
 
-                filenames.append(f"{page_name}.xml")
-                filenames.append(f"{page_name}.jpg")
+    def read(self) -> bytes:
+        data = b"".join(self.__chunks)
+        self.__chunks = []
+        return data
 
-                zf.write(__DUMMY_DIR / f"{dummyFileName}.xml", f"transcription/{page_name}.xml")
+
+def streamZip(entries: Iterable, chunkSize: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Builds a zip archive from ``(name, content)`` entries and yields it piece by piece, so that only the chunk currently
+    being compressed is held in memory. ``content`` may be a path (read in chunks of ``chunkSize``), bytes, a string or
+    an iterator of strings (e.g. from ``csvLines``); names ending in "/" create directories.
+    """
+    sink = ZipStream()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, content in entries:
+            if name.endswith("/"):
+                zf.writestr(zipfile.ZipInfo(name), "")
+            elif isinstance(content, Path):
+                info = zipfile.ZipInfo.from_file(content, name)
+                info.compress_type = zf.compression
+                with content.open("rb") as inFile, zf.open(info, "w") as outFile:
+                    for chunk in iter(partial(inFile.read, chunkSize), b""):
+                        outFile.write(chunk)
+                        data = sink.read()
+                        if data:
+                            yield data
+            elif isinstance(content, (bytes, str)):
+                zf.writestr(name, content)
             else:
-                for page in report.page_set.all():
-                    pageFileName = page.originalFileName
+                info = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+                info.compress_type = zf.compression
+                info.external_attr = 0o600 << 16
+                with zf.open(info, "w") as outFile:
+                    for line in content:
+                        outFile.write(line.encode("utf-8"))
+                        data = sink.read()
+                        if data:
+                            yield data
+            data = sink.read()
+            if data:
+                yield data
+    yield sink.read()
+
+
+def __folderStructureEntries(transfer: ExtractionTransfer, checkRestriction: bool, forArab: bool, arabOther: bool):
+    dummyFileName = "page_not_available"
+    if forArab:
+        dummyFileName = "arab_restricted"
 
-                    if arabOther:
-                        pass  # TODO
+    yield "manualNormalization/access/", ""
 
-                    filenames.append(pageFileName)
-                    filenames.append(str(Path(pageFileName).with_suffix(".jpg")))
+    if not forArab:
+        yield "manualNormalization/preservation/", ""
 
-                    if forArab:
-                        zf.write(page.transcriptionFile.path, f"transcription/{pageFileName}")
-                    else:
-                        root = parse(page.transcriptionFile.path).getroot()
-                        rootTag = root.tag
-                        if "alto" in rootTag:
-                            zf.write(page.transcriptionFile.path, f"transcription/{pageFileName}")
-                        elif "PcGts" in rootTag:
-                            zf.writestr(f"transcription/{pageFileName}", convertPageToAlto(Path(pageFileName), root))
+    loadTransferSnapshots([transfer])
+    for report in transfer.report_set.all():
+        if checkRestriction and __isRestricted(report):
+            page_name = f"page_not_available_{report.noid}"
+            yield f"manualNormalization/access/{page_name}.jpg", __DUMMY_DIR / f"{dummyFileName}.jpg"
+            yield f"{page_name}.jpg", __DUMMY_DIR / f"{dummyFileName}.jpg"
 
-        filenames.sort(key=lambda x: (x[-3:], x[:-4]))
+            if not forArab:
+                yield f"manualNormalization/preservation/{page_name}.tif", __DUMMY_DIR / f"{dummyFileName}.tif"
 
-        if arabOther:
-            zf.writestr("metadata/metadata.csv", buildArabOtherMetadataCsv(transfer, checkRestriction))
+            yield f"transcription/{page_name}.xml", __DUMMY_DIR / f"{dummyFileName}.xml"
         else:
-            zf.writestr("metadata/metadata.csv", buildMetadataCsv(transfer, checkRestriction))
-        zf.writestr("metadata/mets_structmap.xml", buildStructMap(transfer, checkRestriction))
+            for page in report.page_set.all():
+                pageFileName = page.originalFileName
 
-        if arabOther:
-            reportSummary, pageSummary = __buildOmekaSummariesArabOther(transfer, checkRestriction)
-            zf.writestr("items.csv", pd.DataFrame.from_records(reportSummary).to_csv(index=False))
-            zf.writestr("media.csv", pd.DataFrame.from_records(pageSummary).to_csv(index=False))
-        else:
-            reportSummary, pageSummary = __buildOmekaSummaries(transfer, checkRestriction, forArab=forArab)
-            zf.writestr("items.csv", pd.DataFrame.from_records(reportSummary).to_csv(index=False))
-            zf.writestr("media.csv", pd.DataFrame.from_records(pageSummary).to_csv(index=False))
+                if arabOther:
+                    pass  # TODO
+
+                if forArab:
+                    yield f"transcription/{pageFileName}", Path(page.transcriptionFile.path)
+                else:
+                    altoFile = altoTranscription(page)
+                    if altoFile:
+                        yield f"transcription/{pageFileName}", altoFile
 
-        zf.close()
-    outfile.seek(0)
+    if arabOther:
+        yield "metadata/metadata.csv", buildArabOtherMetadataCsv(transfer, checkRestriction)
+    else:
+        yield "metadata/metadata.csv", buildMetadataCsv(transfer, checkRestriction)
+    yield "metadata/mets_structmap.xml", buildStructMap(transfer, checkRestriction)
+
+    if arabOther:
+        items, media = __omekaCsvs([transfer], checkRestriction, forArab=True, arabOther=True)
+    else:
+        items, media = __omekaCsvs([transfer], checkRestriction, forArab=forArab)
+    yield "items.csv", items
+    yield "media.csv", media
 
-    return outfile
+
+def buildFolderStructure(transfer: ExtractionTransfer, checkRestriction: bool = False, forArab: bool = False,
+                         arabOther: bool = False) -> Iterator[bytes]:
+    """
+    Returns the transfer's folder structure as a zip archive, streamed in chunks while it is being built.
+    """
+    return streamZip(__folderStructureEntries(transfer, checkRestriction, forArab, arabOther))
 
 
 def updateExternalRecordsFAC(df: pd.DataFrame):
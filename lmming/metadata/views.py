@@ -1,11 +1,15 @@
+import re
 from datetime import datetime
 from io import BytesIO
+from pathlib import Path
 from typing import Dict, Any
 
 from django.conf import settings
-from django.http import HttpResponseRedirect, FileResponse, HttpResponse, QueryDict
+from django.db import transaction
+from django.http import HttpResponseRedirect, FileResponse, HttpResponse, QueryDict, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse
+from django.utils.http import content_disposition_header
 from django.views.generic import View
 
 from metadata.models import ExtractionTransfer, Job, Status, ProcessingStep, Pipeline
@@ -13,7 +17,9 @@ from metadata.pipeline_views.arab import arabGenerate, arabManual, arabMint, ara
 from metadata.pipeline_views.arab_other import filemakerLookupArab, arabOtherManual, arabOtherMintHandle
 from metadata.pipeline_views.fac import mint, facManual, facFilename, facTranslate
 from metadata.pipeline_views.shared import ner, compute, filemaker
-from metadata.utils import buildTransferCsvs, buildStructMap, buildFolderStructure, buildBulkTransferCsvs
+from metadata.exports import ExportRequest, fingerprint, artefactPath, claim, popError
+from metadata.tasks.export import buildExport
+from metadata.utils import buildStructMap
 
 
 def index(request):
@@ -53,19 +59,80 @@ def jobDetails(request, job_id):
     return render(request, "partial/job.html", {"job": job, "error": error, "steps": stepData, "mode": mode})
 
 
-def arabOtherDownload(transfer_id: int, filetype: str):
+def __fileResponse(request, path: Path, filename: str):
+    """
+    Serves a finished export, honouring a single byte range so that interrupted downloads can be resumed.
+    """
+    size = path.stat().st_size
+    byteRange = re.fullmatch(r"bytes=(\d*)-(\d*)", request.headers.get("Range", "").strip())
+    if not byteRange or not any(byteRange.groups()):
+        response = FileResponse(path.open("rb"), as_attachment=True, filename=filename)
+        response["Accept-Ranges"] = "bytes"
+        return response
+
+    start, end = byteRange.groups()
+    if start:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    else:
+        start, end = max(size - int(end), 0), size - 1
+    if start > end:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    def readRange(inFile, remaining: int, chunkSize: int = 64 * 1024):
+        with inFile:
+            inFile.seek(start)
+            while remaining > 0:
+                chunk = inFile.read(min(chunkSize, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    response = StreamingHttpResponse(readRange(path.open("rb"), end - start + 1), status=206,
+                                     content_type="application/zip")
+    response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Content-Length"] = str(end - start + 1)
+    response["Accept-Ranges"] = "bytes"
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    return response
+
+
+def __export(request, export: ExportRequest, filename: str):
+    """
+    Serves the export if it was already built for the current state of the transfer(s). Otherwise, the export is built
+    in the background and the modal shown instead polls until it is ready.
+    """
+    artefact = artefactPath(export, fingerprint(export))
+    isHtmx = request.headers.get("HX-Request") == "true"
+    if artefact.exists():
+        if isHtmx:
+            return render(request, "modal/export.html", {"ready": True, "url": request.get_full_path()})
+        return __fileResponse(request, artefact, filename)
+
+    error = popError(artefact)
+    if error:
+        return render(request, "modal/export.html", {"error": error, "url": request.get_full_path()})
+
+    if claim(artefact):
+        transaction.on_commit(lambda: buildExport.delay(export.filetype, export.transferIds, export.forArab,
+                                                        export.arabOther, str(artefact)))
+    template = "modal/export.html" if isHtmx else "partial/export.html"
+    return render(request, template, {"url": request.get_full_path()})
+
+
+def arabOtherDownload(request, transfer_id: int, filetype: str):
     transfer = get_object_or_404(ExtractionTransfer, pk=transfer_id)
 
     if filetype == "zip_restricted":
-        outFile = buildFolderStructure(transfer, checkRestriction=True, forArab=True, arabOther=True)
         folderName = transfer.name.replace(" ", "_")
-        return FileResponse(outFile, as_attachment=True,
-                            filename=f"restricted_{folderName}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
+        return __export(request, ExportRequest(filetype, [transfer.pk], forArab=True, arabOther=True),
+                        f"restricted_{folderName}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
     elif filetype == "zip":
-        outFile = buildFolderStructure(transfer, forArab=True, arabOther=True)
         folderName = transfer.name.replace(" ", "_")
-        return FileResponse(outFile, as_attachment=True,
-                            filename=f"{folderName}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
+        return __export(request, ExportRequest(filetype, [transfer.pk], forArab=True, arabOther=True),
+                        f"{folderName}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
     else:
         # TODO: raise error
         pass
@@ -73,33 +140,28 @@ def arabOtherDownload(transfer_id: int, filetype: str):
 
 def downloadTransfer(request, transfer_id: int, filetype: str):
     if request.GET.get("mode") == "arab":
-        print("here")
-        return arabOtherDownload(transfer_id, filetype)
+        return arabOtherDownload(request, transfer_id, filetype)
 
     transfer = get_object_or_404(ExtractionTransfer, pk=transfer_id)
     forArab = settings.ARCHIVE_INST == "ARAB"
 
     if filetype == "csv":
-        outFile = buildTransferCsvs(transfer, forArab=forArab)
-        return FileResponse(outFile, as_attachment=True,
-                            filename=f"Omeka_CSVs_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
+        return __export(request, ExportRequest(filetype, [transfer.pk], forArab=forArab),
+                        f"Omeka_CSVs_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
     elif filetype == "csv_restricted":
-        outFile = buildTransferCsvs(transfer, checkRestriction=True, forArab=forArab)
-        return FileResponse(outFile, as_attachment=True,
-                            filename=f"restricted_Omeka_CSVs_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
+        return __export(request, ExportRequest(filetype, [transfer.pk], forArab=forArab),
+                        f"restricted_Omeka_CSVs_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
     elif filetype == "struct_map":
         outFile = buildStructMap(transfer)
         return FileResponse(BytesIO(outFile.encode()), as_attachment=True, filename="mets_structmap.xml")
     elif filetype == "zip_restricted":
-        outFile = buildFolderStructure(transfer, checkRestriction=True, forArab=forArab)
         folderName = transfer.name.replace(" ", "_")
-        return FileResponse(outFile, as_attachment=True,
-                            filename=f"restricted_{folderName}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
+        return __export(request, ExportRequest(filetype, [transfer.pk], forArab=forArab),
+                        f"restricted_{folderName}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
     elif filetype == "zip":
-        outFile = buildFolderStructure(transfer, forArab=forArab)
         folderName = transfer.name.replace(" ", "_")
-        return FileResponse(outFile, as_attachment=True,
-                            filename=f"{folderName}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
+        return __export(request, ExportRequest(filetype, [transfer.pk], forArab=forArab),
+                        f"{folderName}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
     else:
         # TODO: raise error
         pass
@@ -114,9 +176,8 @@ def batchDownload(request):
     if len(set(pipelines)) > 1:
         return
 
-    outFile = buildBulkTransferCsvs(transfers, checkRestriction=True, forArab=forArab)
-    return FileResponse(outFile, as_attachment=True,
-                        filename=f"bulk_Omeka_CSVs_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
+    return __export(request, ExportRequest("bulk_csv", [t.pk for t in transfers], forArab=forArab),
+                    f"bulk_Omeka_CSVs_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
 
 
 class Transfers(View):
@@ -1,110 +1,136 @@
-from dataclasses import dataclass, field
+import glob
+import hashlib
+import os
+from copy import deepcopy
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import List, Tuple
 
 from lxml import etree
 
+from metadata.transcription import Page, pageNamespace, parseTextRegion, extractTranscription
 
-@dataclass
-class TextLine:
-    id: str
-    xCoords: List[int]
-    yCoords: List[int]
-    x0: int = 0
-    x1: int = 0
-    y0: int = 0
-    y1: int = 0
-    transcription: str = ""
-    baseline: str = ""
-
-    def __post_init__(self):
-        self.x0 = min(self.xCoords)
-        self.x1 = max(self.xCoords)
-        self.y0 = min(self.yCoords)
-        self.y1 = max(self.yCoords)
-
-
-@dataclass
-class TextRegion:
-    id: str
-    x0: int
-    x1: int
-    y0: int
-    y1: int
-    lines: List[TextLine] = field(default_factory=list)
-    coordString: str = ""
-
-
-@dataclass
-class Page:
-    regions: List[TextRegion] = field(default_factory=list)
-    height: int = -1
-    width: int = -1
+ALTO_TEMPLATE = Path(__file__).parent.absolute() / "alto_template.xml"
 
 
 def __parsePage(root) -> Page:
     parsedPage = Page()
-    rootTag = root.tag
-    if "PcGts" in rootTag:
-        namespace = {"": rootTag.replace("PcGts", "").strip("{}")}
-    else:
-        namespace = {"": "http://schema.primaresearch.org/PAGE/gts/pagecontent/2013-07-15"}
+    namespace = pageNamespace(root.tag)
     pageElement = root.find("Page", namespace)
     parsedPage.height = pageElement.attrib["imageHeight"]
     parsedPage.width = pageElement.attrib["imageWidth"]
 
     for textRegion in pageElement.findall("TextRegion", namespace):
-        trCoords = textRegion.find("Coords", namespace)
-        if trCoords is None:
-            continue
-        coordString = trCoords.attrib["points"]
-        coords = coordString.split()
-        xCoords = [int(p.split(",")[0]) for p in coords]
-        yCoords = [int(p.split(",")[1]) for p in coords]
-
-        tR = TextRegion(id=textRegion.attrib["id"], x0=min(xCoords), x1=max(xCoords), y0=min(yCoords), y1=max(yCoords),
-                        coordString=coordString)
-
-        for line in textRegion.findall("TextLine", namespace):
-            coords = line.find("Coords", namespace).attrib["points"].split()
-            xCoords = [int(p.split(",")[0]) for p in coords]
-            yCoords = [int(p.split(",")[1]) for p in coords]
-
-            baseline = line.find("Baseline", namespace)
-            baselineString = ""
-            if baseline is not None:
-                baselineString = baseline.attrib["points"]
-
-            l = TextLine(id=line.attrib["id"], xCoords=xCoords, yCoords=yCoords, baseline=baselineString)
-
-            textEquiv = line.find("TextEquiv", namespace)
-            if textEquiv:
-                unicodeText = textEquiv.find("Unicode", namespace).text
-                if unicodeText:
-                    l.transcription = unicodeText
-
-            tR.lines.append(l)
-        parsedPage.regions.append(tR)
+        tR = parseTextRegion(textRegion, namespace)
+        if tR is not None:
+            parsedPage.regions.append(tR)
 
     return parsedPage
 
 
+def parsePageFile(path: Path) -> Page:
+    """
+    Same as parsing the whole file and calling ``__parsePage``, but in a single ``iterparse`` pass that drops every text
+    region once it has been processed (see ``extractTranscription``).
+    """
+    page = extractTranscription(path, text=False).page
+    if page is None:
+        raise ValueError(f"{path.name} does not contain a PAGE element")
+    return page
+
+
+@lru_cache(maxsize=1)
+def __altoTemplate():
+    parser = etree.XMLParser(remove_blank_text=True)
+    return etree.parse(str(ALTO_TEMPLATE), parser=parser).getroot()
+
+
+def __fillTemplate(root, values: dict):
+    for element in root.iter():
+        if element.text and "{" in element.text:
+            for placeholder, value in values.items():
+                element.text = element.text.replace(placeholder, value)
+        for key, attribute in element.attrib.items():
+            if "{" in attribute:
+                for placeholder, value in values.items():
+                    attribute = attribute.replace(placeholder, value)
+                element.set(key, attribute)
+
+
+@lru_cache(maxsize=1)
+def templateHash() -> str:
+    return hashlib.sha256(ALTO_TEMPLATE.read_bytes()).hexdigest()
+
+
+def conversionKey(source: Path) -> str:
+    """
+    Hash of everything the ALTO conversion of the given PAGE file depends on: its content and the ALTO template.
+    """
+    digest = hashlib.sha256(templateHash().encode())
+    with source.open("rb") as inFile:
+        for chunk in iter(lambda: inFile.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def convertedAltoPath(source: Path, key: str) -> Path:
+    """
+    Where the ALTO conversion of the given PAGE file is kept: next to the source, named after its conversion key.
+    """
+    return source.with_name(f"{source.stem}.{key[:16]}.alto.xml")
+
+
+def convertedAltoFiles(source: Path) -> List[Path]:
+    return list(source.parent.glob(f"{glob.escape(source.stem)}.*.alto.xml"))
+
+
+def removeOutdatedAlto(source: Path, current: Path):
+    for outdated in convertedAltoFiles(source):
+        if outdated != current:
+            outdated.unlink(missing_ok=True)
+
+
+def writeAlto(source: Path, target: Path, filename: Path):
+    """
+    Converts the PAGE file ``source`` to ALTO and writes it to ``target``; ``filename`` is the name of the original
+    transcription, from which the image file name is derived. Readers never see a partially written file.
+    """
+    alto = convertPageFileToAlto(filename, source)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    temporary = target.with_suffix(f".{os.getpid()}.tmp")
+    temporary.write_text(alto, encoding="utf-8")
+    temporary.replace(target)
+
+
+def convertJob(job: Tuple[str, str, str]) -> Tuple[str, str]:
+    """
+    ``writeAlto`` for process pools: takes ``(source, target, filename)`` and returns the source together with the
+    error message, which is empty if the conversion succeeded.
+    """
+    source, target, filename = job
+    try:
+        writeAlto(Path(source), Path(target), Path(filename))
+    except Exception as e:
+        return source, f"{type(e).__name__}: {e}"
+    return source, ""
+
+
 def convertPageToAlto(filename: Path, pageRoot) -> str:
-    page = __parsePage(pageRoot)
+    return __buildAlto(filename, __parsePage(pageRoot))
 
-    templateString = ""
-    with (Path( __file__ ).parent.absolute()/"alto_template.xml").open("r") as inFile:
-        templateString = inFile.read()
 
-    templateString = templateString.replace("{FILENAME}", filename.with_suffix(".jpg").name)
-    templateString = templateString.replace("{PROCESSING_DATETIME}", datetime.now().isoformat())
-    templateString = templateString.replace("{PAGE_HEIGHT}", str(page.height))
-    templateString = templateString.replace("{PAGE_WIDTH}", str(page.width))
+def convertPageFileToAlto(filename: Path, source: Path) -> str:
+    return __buildAlto(filename, parsePageFile(source))
 
-    parser = etree.XMLParser(remove_blank_text=True)
 
-    root = etree.fromstring(templateString, parser=parser)
+def __buildAlto(filename: Path, page: Page) -> str:
+    # the template is parsed once per process, every conversion works on its own copy
+    root = deepcopy(__altoTemplate())
+    __fillTemplate(root, {"{FILENAME}": filename.with_suffix(".jpg").name,
+                          "{PROCESSING_DATETIME}": datetime.now().isoformat(),
+                          "{PAGE_HEIGHT}": str(page.height),
+                          "{PAGE_WIDTH}": str(page.width)})
 
     rootTag = root.tag
     if "alto" in rootTag: